@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+"""
+Generate a large synthetic NML project, to measure the speed of nmlc.
+
+The project has many train items, each with its own sprites on big sprite sheets,
+a chain of switches to select the graphics, and a name in many languages.
+The output is deterministic, so the same parameters always give the same project.
+"""
+
+import optparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from nml import palette  # noqa: E402
+
+# Size of the cell of each sprite on the sprite sheets
+CELL_SIZE = 32
+
+# Sprites of each item, as (width, height, x offset, y offset)
+ITEM_SPRITES = [(8, 24, -3, -12), (22, 17, -14, -9), (32, 12, -16, -8), (22, 17, -6, -9)]
+
+NML_HEADER = """\
+grf {
+    grfid: "NMLB";
+    name: string(STR_GRF_NAME);
+    desc: string(STR_GRF_DESC);
+    version: 0;
+    min_compatible_version: 0;
+}
+
+cargotable { PASS, MAIL, COAL, GRAI, WHEA, MAIZ, FRUT, GOOD }
+
+"""
+
+NML_ITEM = """\
+spriteset(item_{i}_set, "{sheet}") {{
+{sprites}
+}}
+spritegroup item_{i}_group {{
+    loaded: [item_{i}_set];
+    loading: [item_{i}_set];
+}}
+spritegroup item_{i}_group_full {{
+    loaded: [item_{i}_set, item_{i}_set];
+    loading: [item_{i}_set];
+}}
+{switches}
+switch (FEAT_TRAINS, SELF, item_{i}_capacity, cargo_type_in_veh) {{
+    COAL: return {capacity};
+    GRAI: return 20 + {i} % 7;
+    return 30;
+}}
+item(FEAT_TRAINS, item_{i}, {i}) {{
+    property {{
+        name: string(STR_ITEM_{i});
+        climates_available: ALL_CLIMATES;
+        refittable_cargo_classes: bitmask(CC_BULK);
+        default_cargo_type: COAL;
+        sprite_id: SPRITE_ID_NEW_TRAIN;
+        introduction_date: date({year}, 1, 1);
+        model_life: VEHICLE_NEVER_EXPIRES;
+        vehicle_life: 30;
+        loading_speed: 10;
+        cost_factor: {cost};
+        running_cost_factor: 5;
+        speed: 0;
+        track_type: RAIL;
+        power: 0;
+        cargo_capacity: 30;
+        weight: {weight} ton;
+    }}
+    graphics {{
+        cargo_capacity: item_{i}_capacity;
+        default: item_{i}_switch_0;
+    }}
+}}
+
+"""
+
+NML_SWITCH = """\
+switch (FEAT_TRAINS, SELF, item_{i}_switch_{depth}, {expression}) {{
+    0: {next};
+    1..{limit}: {next};
+    item_{i}_group_full;
+}}
+"""
+
+# Expressions of the switches, that are cycled through along the chain
+SWITCH_EXPRESSIONS = [
+    "(position_in_consist + {depth}) % 4",
+    "current_year - build_year > {age} ? 1 : 0",
+    "max(age_in_days / 365, {depth}) % 8",
+    "STORE_TEMP(cargo_subtype * {depth}, 0x10) + LOAD_TEMP(0x10) % 3",
+]
+
+
+def generate_nml(items, switch_depth, sheets, sprites_per_sheet):
+    """
+    Generate the NML script.
+
+    @return: Script.
+    @rtype:  C{str}
+    """
+    cells_per_row = int(sprites_per_sheet**0.5)
+    parts = [NML_HEADER]
+    for i in range(items):
+        first = i * len(ITEM_SPRITES)
+        sprites = []
+        for j, (width, height, xofs, yofs) in enumerate(ITEM_SPRITES):
+            cell = (first + j) % sprites_per_sheet
+            x = (cell % cells_per_row) * CELL_SIZE
+            y = (cell // cells_per_row) * CELL_SIZE
+            sprites.append("    [{:d}, {:d}, {:d}, {:d}, {:d}, {:d}]".format(x, y, width, height, xofs, yofs))
+
+        switches = []
+        for depth in range(switch_depth - 1, -1, -1):
+            expression = SWITCH_EXPRESSIONS[depth % len(SWITCH_EXPRESSIONS)].format(depth=depth, age=5 + i % 20)
+            next_block = "item_{:d}_switch_{:d}".format(i, depth + 1) if depth + 1 < switch_depth else "item_{:d}_group"
+            switches.append(
+                NML_SWITCH.format(i=i, depth=depth, expression=expression, next=next_block.format(i), limit=2 + i % 5)
+            )
+
+        parts.append(
+            NML_ITEM.format(
+                i=i,
+                sheet="gfx/sheet_{:d}.png".format((first // sprites_per_sheet) % sheets),
+                sprites="\n".join(sprites),
+                switches="".join(switches),
+                capacity=20 + i % 11,
+                year=1850 + i % 100,
+                cost=100 + i % 120,
+                weight=10 + i % 30,
+            )
+        )
+    return "".join(parts)
+
+
+def generate_sheet(filename, index, sheet_size):
+    """
+    Draw a sprite sheet with the default palette. Each cell has a different shape and colour,
+    so the sprites have to be encoded separately.
+    """
+    im = Image.new("P", (sheet_size, sheet_size), 0)
+    im.putpalette(palette.palette_data[0])
+    draw = ImageDraw.Draw(im)
+    cells_per_row = sheet_size // CELL_SIZE
+    for cell in range(cells_per_row * cells_per_row):
+        x = (cell % cells_per_row) * CELL_SIZE
+        y = (cell // cells_per_row) * CELL_SIZE
+        seed = index * 7919 + cell * 104729
+        colour = 0x10 + seed % 0x90
+        inset = seed % 5
+        draw.rectangle((x + inset, y + 4, x + CELL_SIZE - 1 - inset, y + CELL_SIZE - 5), fill=colour)
+        draw.ellipse((x + 6, y + 6 + seed % 7, x + 25, y + 18 + seed % 7), fill=(colour + 0x21) % 0xD0 + 0x10)
+        for k in range(seed % 9):
+            draw.line((x + k * 3, y + 2, x + CELL_SIZE - 1, y + k * 3 + 2), fill=0x01 + (seed >> k) % 0x0F)
+    im.save(filename)
+
+
+def generate_lang(filename, langid, items):
+    """
+    Write a language file with the names of all items.
+    """
+    with open(filename, "w", encoding="utf-8") as lang_file:
+        lang_file.write("##grflangid 0x{:02X}\n".format(langid))
+        lang_file.write("STR_GRF_NAME :NML benchmark {:02X}\n".format(langid))
+        lang_file.write("STR_GRF_DESC :{{ORANGE}}Synthetic project{{}}{{BLACK}}Language {:02X}\n".format(langid))
+        for i in range(items):
+            lang_file.write(
+                "STR_ITEM_{:d} :{{BLACK}}Wagon {:d} ({:02X}){{}}{{SILVER}}Built for testing\n".format(i, i, langid)
+            )
+
+
+def generate(directory, items=2000, switch_depth=8, languages=40, sheet_size=1024):
+    """
+    Generate a synthetic NML project.
+
+    @param directory: Directory to write the project to. It is created if needed.
+    @type  directory: C{str}
+
+    @param items: Number of train items.
+    @type  items: C{int}
+
+    @param switch_depth: Number of switches in the chain that selects the graphics of each item.
+    @type  switch_depth: C{int}
+
+    @param languages: Number of language files, including the default language.
+    @type  languages: C{int}
+
+    @param sheet_size: Width and height of the sprite sheets in pixels.
+    @type  sheet_size: C{int}
+
+    @return: Name of the NML file, relative to the directory.
+    @rtype:  C{str}
+    """
+    sprites_per_sheet = (sheet_size // CELL_SIZE) ** 2
+    sheets = max(1, -(-items * len(ITEM_SPRITES) // sprites_per_sheet))
+    os.makedirs(os.path.join(directory, "gfx"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "lang"), exist_ok=True)
+
+    for index in range(sheets):
+        generate_sheet(os.path.join(directory, "gfx", "sheet_{:d}.png".format(index)), index, sheet_size)
+
+    # Language ids 0x01 (the default language) and 0x7F are not used by other languages
+    other_ids = [langid for langid in range(0x7F) if langid != 0x01]
+    generate_lang(os.path.join(directory, "lang", "english.lng"), 0x01, items)
+    for langid in other_ids[: max(0, languages - 1)]:
+        generate_lang(os.path.join(directory, "lang", "lang_{:02x}.lng".format(langid)), langid, items)
+
+    nml_filename = "benchmark.nml"
+    with open(os.path.join(directory, nml_filename), "w", encoding="utf-8") as nml_file:
+        nml_file.write(generate_nml(items, switch_depth, sheets, sprites_per_sheet))
+    return nml_filename
+
+
+def add_options(opt_parser):
+    """
+    Add the options for the size of the project to an option parser.
+    """
+    opt_parser.add_option("--items", type="int", default=2000, help="Number of items [default: %default]")
+    opt_parser.add_option(
+        "--switch-depth", type="int", default=8, help="Length of the switch chain of each item [default: %default]"
+    )
+    opt_parser.add_option("--languages", type="int", default=40, help="Number of languages [default: %default]")
+    opt_parser.add_option(
+        "--sheet-size", type="int", default=1024, help="Size of the sprite sheets in pixels [default: %default]"
+    )
+
+
+def main(argv):
+    opt_parser = optparse.OptionParser(usage="Usage: %prog [options] <directory>")
+    add_options(opt_parser)
+    opts, args = opt_parser.parse_args(argv)
+    if len(args) != 1:
+        opt_parser.error("Error: a single output directory is required")
+    if opts.items < 1 or opts.switch_depth < 1 or opts.languages < 1 or opts.sheet_size < CELL_SIZE:
+        opt_parser.error("Error: the project must have at least one item, switch, language and sprite")
+
+    nml_filename = generate(args[0], opts.items, opts.switch_depth, opts.languages, opts.sheet_size)
+    print(os.path.join(args[0], nml_filename))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
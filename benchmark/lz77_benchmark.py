@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+"""
+Compare the speed and output size of the LZ77 encoders on real sprite data.
+
+Sprites are cut from the images of the regression tests and examples, or from
+the images given on the command line.
+"""
+
+import array
+import glob
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image  # noqa: E402
+
+from nml import lz77  # noqa: E402
+
+
+def decode(data):
+    """
+    GRF decompression algorithm, to verify the encoders.
+
+    @param data: Compressed data.
+    @type  data: C{bytes} or similar.
+
+    @return: Uncompressed data.
+    @rtype:  C{bytes}
+    """
+    output = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code & 0x80:
+            length = 16 - ((code >> 3) & 0x0F)
+            distance = ((code & 0x07) << 8) | data[i + 1]
+            for _ in range(length):
+                output.append(output[-distance])
+            i += 2
+        else:
+            length = code or 0x80
+            output.extend(data[i + 1 : i + 1 + length])
+            i += 1 + length
+    return bytes(output)
+
+
+def load_sprites(filenames, size):
+    """
+    Cut square sprites from images.
+
+    @return: Uncompressed pixel data of the sprites.
+    @rtype:  C{list} of C{array}
+    """
+    sprites = []
+    for filename in filenames:
+        with Image.open(filename) as im:
+            if im.mode not in ("P", "RGB", "RGBA"):
+                continue
+            width, height = im.size
+            for y in range(0, height, size):
+                for x in range(0, width, size):
+                    sprite = im.crop((x, y, min(x + size, width), min(y + size, height)))
+                    sprites.append(array.array("B", sprite.tobytes()))
+    return sprites
+
+
+def main(argv):
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    opt_parser = optparse.OptionParser(usage="Usage: %prog [options] [<image> ...]")
+    opt_parser.add_option("--size", type="int", default=64, help="Size of the sprites [default: %default]")
+    opt_parser.add_option(
+        "--repeat", type="int", default=3, help="Number of runs, the fastest counts [default: %default]"
+    )
+    opts, filenames = opt_parser.parse_args(argv)
+    if not filenames:
+        filenames = sorted(glob.glob(os.path.join(root, "regression", "*.png")))
+        filenames += sorted(glob.glob(os.path.join(root, "examples", "*", "*.png")))
+
+    sprites = load_sprites(filenames, opts.size)
+    total_size = sum(len(sprite) for sprite in sprites)
+    print("{:d} sprites, {:d} bytes".format(len(sprites), total_size))
+
+    encoders = [("_encode", lz77._encode), ("greedy", lz77._encode_greedy), ("optimal", lz77.encode_optimal)]
+    if lz77.is_native:
+        encoders.append(("native", lz77.encode))
+
+    reference = [bytes(lz77._encode(sprite)) for sprite in sprites]
+    print("{:<10} {:>10} {:>12} {:>8}".format("encoder", "time (s)", "size", "ratio"))
+    for name, encode in encoders:
+        best_time = None
+        for _ in range(opts.repeat):
+            start = time.perf_counter()
+            result = [bytes(encode(sprite)) for sprite in sprites]
+            elapsed = time.perf_counter() - start
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+        for sprite, data, ref in zip(sprites, result, reference):
+            if name == "optimal":
+                assert decode(data) == sprite.tobytes(), "optimal encoder output does not decode to the input"
+            else:
+                assert data == ref, "{} encoder output differs from _encode".format(name)
+
+        compressed_size = sum(len(data) for data in result)
+        print(
+            "{:<10} {:>10.3f} {:>12d} {:>7.1f}%".format(
+                name, best_time, compressed_size, 100 * compressed_size / max(total_size, 1)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
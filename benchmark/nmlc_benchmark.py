@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+"""
+Measure the time of the processing steps of nmlc, on a synthetic project made by
+generate_project.py or on an existing project.
+
+Every compilation runs in a separate process. A cold run starts with an empty sprite cache,
+the warm run after it uses the sprite cache written by the cold run. The results are printed
+as a table, and can be written as JSON to compare runs over time.
+"""
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import generate_project  # noqa: E402
+
+# Version of the format of the JSON results
+RESULTS_FORMAT = 1
+
+
+def run_child(result_filename, input_filename, nmlc_args):
+    """
+    Compile in this process, and write the times of the processing steps to a file.
+    This runs in the child process started by L{compile_project}.
+
+    @param result_filename: File to write the result to, as JSON.
+    @type  result_filename: C{str}
+
+    @param input_filename: Name of the NML file, to replace it by 'input' in the names of the steps.
+    @type  input_filename: C{str}
+
+    @param nmlc_args: Command line arguments of nmlc.
+    @type  nmlc_args: C{list} of C{str}
+    """
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    phases = {}
+    current = ["import", start_wall, start_cpu]
+
+    def end_phase():
+        if current[0] is not None:
+            wall, cpu = phases.get(current[0], (0.0, 0.0))
+            phases[current[0]] = (wall + time.perf_counter() - current[1], cpu + time.process_time() - current[2])
+        current[0] = None
+
+    def listener(msg):
+        end_phase()
+        if msg is not None:
+            name = msg.replace(input_filename, "input")
+            if name.endswith(" ..."):
+                name = name[: -len(" ...")]
+            current[:] = [name, time.perf_counter(), time.process_time()]
+
+    from nml import generic, main
+
+    end_phase()
+    generic.progress_listener = listener
+    exit_code = 0
+    try:
+        main.main(nmlc_args)
+    except SystemExit as ex:
+        exit_code = ex.code or 0
+    except generic.ScriptError as ex:
+        generic.print_error(str(ex))
+        exit_code = 1
+    end_phase()
+
+    result = {
+        "exit_code": exit_code,
+        "wall": time.perf_counter() - start_wall,
+        "cpu": time.process_time() - start_cpu,
+        "phases": [{"name": name, "wall": wall, "cpu": cpu} for name, (wall, cpu) in phases.items()],
+    }
+    with open(result_filename, "w", encoding="utf-8") as result_file:
+        json.dump(result, result_file)
+
+
+def compile_project(directory, nml_filename, cache_dir, output_dir, jobs, extra_args):
+    """
+    Compile a project in a new process.
+
+    @return: Result of the compilation, see L{run_child}.
+    @rtype:  C{dict}
+    """
+    result_filename = os.path.join(output_dir, "result.json")
+    args = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        result_filename,
+        nml_filename,
+        "--quiet",
+        "--cache-dir=" + cache_dir,
+        "--jobs={:d}".format(jobs),
+        "--grf=" + os.path.join(output_dir, "benchmark.grf"),
+    ]
+    args.extend(extra_args)
+    args.append(nml_filename)
+    if os.path.exists(result_filename):
+        os.remove(result_filename)
+    start = time.perf_counter()
+    process = subprocess.run(args, cwd=directory, check=False)
+    wall = time.perf_counter() - start
+    if not os.path.exists(result_filename):
+        sys.exit("nmlc failed with exit code {:d}".format(process.returncode))
+    with open(result_filename, encoding="utf-8") as result_file:
+        result = json.load(result_file)
+    # Includes starting the interpreter
+    result["process_wall"] = wall
+    return result
+
+
+def summarize(runs):
+    """
+    Get the fastest time of each processing step, per cache state.
+
+    @return: Mapping of cache state to a mapping of step names to the fastest wall clock and CPU time.
+    @rtype:  C{dict}
+    """
+    summary = {}
+    for run in runs:
+        steps = summary.setdefault(run["cache"], {})
+        for phase in run["phases"] + [{"name": "total", "wall": run["process_wall"], "cpu": run["cpu"]}]:
+            best = steps.get(phase["name"])
+            if best is None or phase["wall"] < best["wall"]:
+                steps[phase["name"]] = {"wall": phase["wall"], "cpu": phase["cpu"]}
+    return summary
+
+
+def print_summary(summary):
+    states = list(summary)
+    names = []
+    for state in states:
+        names.extend(name for name in summary[state] if name not in names)
+    print("{:<36}".format("step") + "".join(" {:>12}".format(state + " (s)") for state in states))
+    for name in names:
+        times = []
+        for state in states:
+            step = summary[state].get(name)
+            times.append(" {:>12}".format("-" if step is None else "{:.3f}".format(step["wall"])))
+        print("{:<36}".format(name[:36]) + "".join(times))
+
+
+def main(argv):
+    if argv[:1] == ["--child"]:
+        run_child(argv[1], argv[2], argv[3:])
+        return
+
+    opt_parser = optparse.OptionParser(
+        usage="Usage: %prog [options] [-- <nmlc options>]",
+        description="Without --project, a synthetic project is generated with the given size.",
+    )
+    generate_project.add_options(opt_parser)
+    opt_parser.add_option("--project", metavar="<file>", help="Compile an existing NML file, relative to its directory")
+    opt_parser.add_option(
+        "--repeat", type="int", default=3, help="Number of runs, the fastest counts [default: %default]"
+    )
+    opt_parser.add_option("--jobs", type="int", default=1, help="Number of processes of nmlc [default: %default]")
+    opt_parser.add_option("--output", metavar="<file>", help="Write the results as JSON to <file>, '-' for stdout")
+    opt_parser.add_option("--work-dir", metavar="<dir>", help="Directory for the generated project, cache and output")
+    opts, extra_args = opt_parser.parse_args(argv)
+
+    work_dir = opts.work_dir or tempfile.mkdtemp(prefix="nml_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        if opts.project is None:
+            directory = os.path.join(work_dir, "project")
+            parameters = {
+                "items": opts.items,
+                "switch_depth": opts.switch_depth,
+                "languages": opts.languages,
+                "sheet_size": opts.sheet_size,
+            }
+            nml_filename = generate_project.generate(directory, **parameters)
+        else:
+            directory, nml_filename = os.path.split(os.path.abspath(opts.project))
+            parameters = {"project": os.path.abspath(opts.project)}
+        parameters.update({"jobs": opts.jobs, "nmlc_args": extra_args})
+
+        cache_dir = os.path.join(work_dir, "cache")
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(output_dir, exist_ok=True)
+        runs = []
+        for repeat in range(opts.repeat):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            for cache in ("cold", "warm"):
+                result = compile_project(directory, nml_filename, cache_dir, output_dir, opts.jobs, extra_args)
+                if result["exit_code"] != 0:
+                    sys.exit("nmlc failed with exit code {}".format(result["exit_code"]))
+                result.update({"cache": cache, "repeat": repeat})
+                runs.append(result)
+    finally:
+        if opts.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    from nml import version_info
+
+    results = {
+        "format": RESULTS_FORMAT,
+        "nml_version": version_info.get_nml_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "parameters": parameters,
+        "summary": summarize(runs),
+        "runs": runs,
+    }
+    if opts.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print_summary(results["summary"])
+    if opts.output is not None:
+        with open(opts.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
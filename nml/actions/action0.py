@@ -13,6 +13,8 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
+import bisect
+
 from nml import expression, generic, grfstrings, nmlop
 from nml.actions import action4, action6, action7, actionD, base_action
 from nml.actions.action0properties import Action0Property, BaseAction0Property, properties, two_byte_property
@@ -25,13 +27,11 @@ class BlockAllocation:
     Blocks always start at address C{0}, but the first available freely usable
     address may be further.
 
-    The allocation information is kept in L{allocated}. It has the following cases
-    - An address does not exist in the dictionary.
-      The address is free for use.
-    - An address exists, with an integer number as size.
-      At this address a block has been allocated with that size.
-    - An address exists, with value C{None}.
-      The address is part of an allocated block, but not the start.
+    The allocation information is kept in two forms
+    - L{allocated} maps the first address of every allocated block to its size.
+    - L{run_starts} and L{run_ends} are the sorted first and last addresses of the runs of used addresses.
+      Adjacent blocks are merged into a single run, so the free space between the runs can be searched
+      with a binary search, rather than address by address.
 
     @ivar first: First freely usable address.
     @type first: C{int}
@@ -45,8 +45,17 @@ class BlockAllocation:
     @ivar dynamic_allocation: True, if ids are allocated. False, if they refer to static entities.
     @type dynamic_allocation: C{bool}
 
-    @ivar allocated: Mapping of allocated blocks.
-    @type allocated: C{dict} of C{int} to allocation information.
+    @ivar allocated: Mapping of the first address of allocated blocks to their size.
+    @type allocated: C{dict} of C{int} to C{int}
+
+    @ivar num_allocated: Number of allocated addresses.
+    @type num_allocated: C{int}
+
+    @ivar run_starts: First addresses of the runs of used addresses, in increasing order.
+    @type run_starts: C{list} of C{int}
+
+    @ivar run_ends: Last addresses of the runs of used addresses, in the same order as L{run_starts}.
+    @type run_ends: C{list} of C{int}
 
     @ivar filled: Mapping of block size to the smallest address that may contain free space.
                   Serves as a cache to speed up searches.
@@ -58,7 +67,16 @@ class BlockAllocation:
         self.last = last
         self.name = name
         self.dynamic_allocation = dynamic_allocation
+        self.clear()
+
+    def clear(self):
+        """
+        Free all allocated blocks.
+        """
         self.allocated = {}
+        self.num_allocated = 0
+        self.run_starts = []
+        self.run_ends = []
         self.filled = {}
 
     def get_num_allocated(self):
@@ -66,7 +84,7 @@ class BlockAllocation:
         Return number of allocated ids.
         """
         if self.dynamic_allocation:
-            return len(self.allocated)
+            return self.num_allocated
         else:
             return 0
 
@@ -118,7 +136,8 @@ class BlockAllocation:
         @return: Whether the space at the provided address is available.
         @rtype:  C{bool}
         """
-        return addr not in self.allocated
+        idx = bisect.bisect_right(self.run_starts, addr) - 1
+        return idx < 0 or self.run_ends[idx] < addr
 
     def get_last_used(self, addr, length):
         """
@@ -135,10 +154,12 @@ class BlockAllocation:
 
         @precond: Addresses of the range should be within the available address space.
         """
-        for idx in range(addr + length - 1, addr - 1, -1):
-            if idx in self.allocated:
-                return idx
-        return None
+        last_addr = addr + length - 1
+        # The last run that starts in or before the block is the only one that can contain its last used address
+        idx = bisect.bisect_right(self.run_starts, last_addr) - 1
+        if idx < 0 or self.run_ends[idx] < addr:
+            return None
+        return min(self.run_ends[idx], last_addr)
 
     def mark_used(self, addr, length):
         """
@@ -154,8 +175,23 @@ class BlockAllocation:
         @precond: No address in the block may have been allocated.
         """
         self.allocated[addr] = length
-        for idx in range(addr + 1, addr + length):
-            self.allocated[idx] = None
+        self.num_allocated += length
+
+        last_addr = addr + length - 1
+        idx = bisect.bisect_right(self.run_starts, addr)
+        join_previous = idx > 0 and self.run_ends[idx - 1] == addr - 1
+        join_next = idx < len(self.run_starts) and self.run_starts[idx] == last_addr + 1
+        if join_previous and join_next:
+            self.run_ends[idx - 1] = self.run_ends[idx]
+            del self.run_starts[idx]
+            del self.run_ends[idx]
+        elif join_previous:
+            self.run_ends[idx - 1] = last_addr
+        elif join_next:
+            self.run_starts[idx] = addr
+        else:
+            self.run_starts.insert(idx, addr)
+            self.run_ends.insert(idx, last_addr)
 
     def find_unused(self, length):
         """
@@ -175,14 +211,20 @@ class BlockAllocation:
             smaller_filleds = [min_f for sz, min_f in self.filled.items() if sz < length]
             idx = self.first if len(smaller_filleds) == 0 else max(smaller_filleds)
 
+        # Skip to the end of the run that contains idx, if any. Then check the free space before each next run.
+        run = bisect.bisect_right(self.run_starts, idx) - 1
+        if run >= 0 and self.run_ends[run] >= idx:
+            idx = self.run_ends[run] + 1
+        run += 1
+
         last_idx = self.last - length + 1
         while idx < last_idx:
-            last_used = self.get_last_used(idx, length)
-            if last_used is None:
+            if run == len(self.run_starts) or self.run_starts[run] - idx >= length:
                 self.filled[length] = idx + length
                 return idx
 
-            idx = last_used + 1
+            idx = self.run_ends[run] + 1
+            run += 1
 
         return None
 
@@ -215,14 +257,33 @@ used_ids = [
 ]
 
 
+def reset():
+    """
+    Free all ids, to compile another file.
+    """
+    for feature in used_ids:
+        feature.clear()
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [
+        ("{} items".format(feature.name), feature.get_num_allocated(), feature.get_max_allocated(), None)
+        for feature in used_ids
+        if feature.dynamic_allocation
+    ]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    for feature in used_ids:
-        used = feature.get_num_allocated()
-        if used > 0 and feature.dynamic_allocation:
-            generic.print_info("{} items: {}/{}".format(feature.name, used, feature.get_max_allocated()))
+    generic.print_id_stats(get_stats())
 
 
 def mark_id_used(feature, id, num_ids):
@@ -875,10 +936,7 @@ class ByteListProp(BaseAction0Property):
     def write(self, file):
         file.print_bytex(self.prop_num)
         file.newline()
-        for i, data_val in enumerate(self.data):
-            if i > 0 and i % 8 == 0:
-                file.newline()
-            file.print_bytex(ord(data_val))
+        file.print_bytes([ord(data_val) for data_val in self.data], 8)
         file.newline()
 
     def get_size(self):
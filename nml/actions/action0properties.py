@@ -31,6 +31,13 @@ from nml.expression import (
 tilelayout_names = {}
 
 
+def reset():
+    """
+    Forget the tile layouts, to compile another file.
+    """
+    tilelayout_names.clear()
+
+
 class BaseAction0Property:
     """
     Base class for Action0 properties.
@@ -809,8 +816,7 @@ class StationLayoutProp(BaseAction0Property):
             file.print_byte(number)
             file.newline()
             for platform in layout:
-                for type in platform:
-                    file.print_bytex(type)
+                file.print_bytes(platform)
                 file.newline()
         file.print_byte(0)
         file.print_byte(0)
@@ -1276,8 +1282,7 @@ class IndustryInputMultiplierProp(BaseAction0Property):
             file.print_byte(len(self.data[0]))  # assume all sub-arrays are equal length
             file.newline()
             for out_muls in self.data:
-                for mul in out_muls:
-                    file.print_wordx(mul)
+                file.print_words(out_muls)
                 file.newline()
 
     def get_size(self):
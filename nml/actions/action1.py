@@ -110,7 +110,7 @@ class SpritesetCollection(base_action.BaseAction):
         @rtype: C{bool}
         """
         assert self.first_set + 1 <= self.max_id
-        if len(real_sprite.parse_sprite_data(spriteset)) != self.num_sprites_per_spriteset:
+        if real_sprite.get_num_sprites(spriteset) != self.num_sprites_per_spriteset:
             return False
         return self.first_set + len(self.spritesets) + (1 if spriteset not in self.spritesets else 0) <= self.max_id
 
@@ -149,11 +149,9 @@ class SpritesetCollection(base_action.BaseAction):
         @rtype: C{list} of L{BaseAction}
         """
         actions = [Action1(self.feature, self.first_set, len(self.spritesets), self.num_sprites_per_spriteset)]
-        for idx in range(len(self.spritesets)):
-            for spriteset, spriteset_offset in self.spritesets.items():
-                if idx == spriteset_offset:
-                    actions.extend(real_sprite.parse_sprite_data(spriteset))
-                    break
+        # Spritesets are added with increasing indices, so the mapping is already in the order of the indices
+        for spriteset in self.spritesets:
+            actions.extend(real_sprite.parse_sprite_data(spriteset))
         return actions
 
 
@@ -165,11 +163,27 @@ be created.
 """
 spriteset_collections = {}
 
+"""
+Mapping of feature to a mapping of each spriteset to the collection it was added to.
+The sets of earlier Action1s stay valid when a new Action1 is written with a higher first set,
+so a spriteset is added only once and referred to in its collection by all later action2s.
+"""
+spriteset_collection_map = {}
+
+
+def reset():
+    """
+    Forget the sprite set collections, to compile another file.
+    """
+    spriteset_collections.clear()
+    spriteset_collection_map.clear()
+
 
 def add_to_action1(spritesets, feature, pos):
     """
     Add a list of spritesets to a spriteset collection. This will try to reuse
     one collection as long as possible and create a new one when needed.
+    Spritesets that are in a collection already are not added again.
 
     @param spritesets: List of spritesets that will be used by the next action2.
     @type spritesets: C{list} of L{SpriteSet}
@@ -183,33 +197,37 @@ def add_to_action1(spritesets, feature, pos):
     @return: List of collections that needs to be added to the global action list.
     @rtype: C{list} of L{SpritesetCollection}.
     """
-    if not spritesets:
-        return []
+    collection_map = spriteset_collection_map.setdefault(feature, {})
 
-    actions = []
+    # Group the new spritesets by number of sprites, starting with the number of the current collection.
+    # The order within a call does not matter, and this needs the fewest new collections.
+    new_spritesets = {}
+    if feature in spriteset_collections:
+        new_spritesets[spriteset_collections[feature][-1].num_sprites_per_spriteset] = []
+    for spriteset in spritesets:
+        if spriteset not in collection_map:
+            same_size = new_spritesets.setdefault(real_sprite.get_num_sprites(spriteset), [])
+            if spriteset not in same_size:
+                same_size.append(spriteset)
 
-    if feature not in spriteset_collections:
-        spriteset_collections[feature] = [
-            SpritesetCollection(feature, 0, len(real_sprite.parse_sprite_data(spritesets[0])))
-        ]
-        actions.append(spriteset_collections[feature][-1])
+    actions = []
+    for num_sprites, same_size in new_spritesets.items():
+        for spriteset in same_size:
+            if feature not in spriteset_collections:
+                spriteset_collections[feature] = [SpritesetCollection(feature, 0, num_sprites)]
+                actions.append(spriteset_collections[feature][-1])
 
-    current_collection = spriteset_collections[feature][-1]
-    for spriteset in spritesets:
-        for spriteset_collection in spriteset_collections[feature]:
-            if spriteset in spriteset_collection.spritesets:
-                continue
-        if not current_collection.can_add(spriteset):
-            spriteset_collections[feature].append(
-                SpritesetCollection(
-                    feature,
-                    current_collection.first_set + len(current_collection.spritesets),
-                    len(real_sprite.parse_sprite_data(spriteset)),
-                )
-            )
             current_collection = spriteset_collections[feature][-1]
-            actions.append(current_collection)
-        current_collection.add(spriteset)
+            if not current_collection.can_add(spriteset):
+                spriteset_collections[feature].append(
+                    SpritesetCollection(
+                        feature, current_collection.first_set + len(current_collection.spritesets), num_sprites
+                    )
+                )
+                current_collection = spriteset_collections[feature][-1]
+                actions.append(current_collection)
+            current_collection.add(spriteset)
+            collection_map[spriteset] = current_collection
 
     return actions
 
@@ -217,9 +235,7 @@ def add_to_action1(spritesets, feature, pos):
 def get_action1_index(spriteset, feature):
     """
     Get the index of a spriteset in the action1. The given spriteset must have
-    been added in the last call to #add_to_action1. Any new calls to
-    #add_to_action1 may or may not allocate a new spriteset collection and as
-    such make previous spritesets inaccessible.
+    been added in a call to #add_to_action1 for the same feature.
 
     @param spriteset: The spriteset to get the index of.
     @type spriteset: L{SpriteSet}.
@@ -230,11 +246,7 @@ def get_action1_index(spriteset, feature):
     @return: The index in the action1 of the given spriteset.
     @rtype: C{int}
     """
-    assert feature in spriteset_collections
-    for spriteset_collection in spriteset_collections[feature]:
-        if spriteset in spriteset_collection.spritesets:
-            return spriteset_collection.get_index(spriteset)
-    assert False
+    return spriteset_collection_map[feature][spriteset].get_index(spriteset)
 
 
 def make_cb_failure_action1(feature):
@@ -96,13 +96,29 @@ SOUND_OFFSET = 73  # No of original sounds
 NUM_ANIMATION_SOUNDS = 0x80 - SOUND_OFFSET  # Number of custom sound ids, which can be returned by animation callbacks.
 
 
+def reset():
+    """
+    Forget the registered sounds, to compile another file.
+    """
+    registered_sounds.clear()
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    # Currently NML does not optimise the order of sound effects. So we assume NUM_ANIMATION_SOUNDS as the maximum.
+    return [("Sound effects", len(registered_sounds), NUM_ANIMATION_SOUNDS, None)]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    if len(registered_sounds) > 0:
-        # Currently NML does not optimise the order of sound effects. So we assume NUM_ANIMATION_SOUNDS as the maximum.
-        generic.print_info("Sound effects: {}/{}".format(len(registered_sounds), NUM_ANIMATION_SOUNDS))
+    generic.print_id_stats(get_stats())
 
 
 def add_sound(args, pos):
@@ -29,6 +29,8 @@ The 2nd field of type L{Position} contains a positional reference
 spritegroup_stats = (0, None)
 
 total_tmp_locations = 0x7F
+# Bit mask of the temporary storage registers that are available to NML, see Action2.__init__
+all_tmp_locations = ((1 << total_tmp_locations) - 1) << 0x80
 
 """
 Statistics about temporary Action2 registers.
@@ -38,22 +40,35 @@ The 2nd field of type L{Position} contains a positional reference to the spriteg
 a2register_stats = (0, None)
 
 
+def reset():
+    """
+    Free all action2 ids and registers, and forget the registered sprite groups, to compile another file.
+    """
+    global spritegroup_stats, a2register_stats
+    free_action2_ids[:] = range(0, total_action2_ids)
+    spritegroup_stats = (0, None)
+    a2register_stats = (0, None)
+    spritegroup_list.clear()
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [
+        ("Concurrent spritegroups", spritegroup_stats[0], total_action2_ids, spritegroup_stats[1]),
+        ("Concurrent Action2 registers", a2register_stats[0], total_tmp_locations, a2register_stats[1]),
+    ]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    if spritegroup_stats[0] > 0:
-        generic.print_info(
-            "Concurrent spritegroups: {}/{} ({})".format(
-                spritegroup_stats[0], total_action2_ids, str(spritegroup_stats[1])
-            )
-        )
-    if a2register_stats[0] > 0:
-        generic.print_info(
-            "Concurrent Action2 registers: {}/{} ({})".format(
-                a2register_stats[0], total_tmp_locations, str(a2register_stats[1])
-            )
-        )
+    generic.print_id_stats(get_stats())
 
 
 class Action2(base_action.BaseAction):
@@ -78,9 +93,14 @@ class Action2(base_action.BaseAction):
     @ivar references: All Action2s that are referenced by this Action2.
     @type references: C{list} of L{Action2Reference}
 
-    @ivar tmp_locations: List of address in the temporary storage that are free
-                         to be used in this varaction2.
-    @type tmp_locations: C{list} of C{int}
+    @ivar tmp_locations: Bit mask of the addresses in the temporary storage that are used
+                         by this action2 itself.
+    @type tmp_locations: C{int}
+
+    @ivar inherited_tmp_locations: Bit mask of the addresses in the temporary storage that are
+                                   in use by the action2s calling this one. These may not be used
+                                   by any action2 referenced by this one either.
+    @type inherited_tmp_locations: C{int}
     """
 
     def __init__(self, feature, name, pos):
@@ -94,7 +114,8 @@ class Action2(base_action.BaseAction):
         # 0x80 - 0xFE: used by NML
         # 0xFF: Used for some house variables
         # 0x100 - 0x10F: Special meaning (used for some CB results)
-        self.tmp_locations = list(range(0x80, 0x80 + total_tmp_locations))
+        self.tmp_locations = 0
+        self.inherited_tmp_locations = 0
 
     def prepare_output(self, sprite_num):
         free_references(self)
@@ -136,32 +157,60 @@ class Action2(base_action.BaseAction):
     def skip_needed(self):
         return False
 
-    def remove_tmp_location(self, location, force_recursive):
+    def resolve_tmp_storage(self):
+        """
+        Allocate the temporary storage locations used by this action2, and reserve all locations it uses
+        in the action2s it references. Must be called for all action2s in reverse order of output, so all
+        action2s that reference this action2 are done before it.
         """
-        Recursively remove a location from the list of available temporary
-        storage locations. It is not only removed from the list of the
-        current Action2Var but also from all Action2Var it calls. If an
-        Action2Var is referenced as a procedure call, the location is always
-        removed recursively, otherwise only if force_recursive is True.
+        self.propagate_tmp_locations()
+
+    def get_free_tmp_location(self):
+        """
+        Get the lowest free location in the temporary storage, that is not used by this action2 or its callers.
+
+        @return: Number of the storage register.
+        @rtype: C{int}
+        """
+        free = all_tmp_locations & ~(self.tmp_locations | self.inherited_tmp_locations)
+        if free == 0:
+            raise generic.ScriptError(
+                "There are not enough registers available "
+                + "to perform all required computations in switch blocks. "
+                + "Please reduce the complexity of your code.",
+                self.pos,
+            )
+        return (free & -free).bit_length() - 1
+
+    def remove_tmp_location(self, location):
+        """
+        Remove a location from the available temporary storage locations of this action2.
+        It is removed from the action2s it calls when calling L{propagate_tmp_locations}.
 
         @param location: Number of the storage register to remove.
         @type location: C{int}
+        """
+        self.tmp_locations |= (1 << location) & all_tmp_locations
 
-        @param force_recursive: Force removing this location recursively,
-                                also for 'chained' action2s.
-        @type force_recursive: C{bool}
+    def propagate_tmp_locations(self):
+        """
+        Remove the locations used by this action2 from the action2s it references. If an action2 is
+        referenced as a procedure call, all locations used by this action2 are removed from it and all
+        action2s it references. For 'chained' action2s, only the locations used by the callers of
+        this action2 are removed.
         """
         global a2register_stats
 
-        if location in self.tmp_locations:
-            self.tmp_locations.remove(location)
-            num_used = total_tmp_locations - len(self.tmp_locations)
-            if num_used > a2register_stats[0]:
-                a2register_stats = (num_used, self.pos)
+        used = self.tmp_locations | self.inherited_tmp_locations
+        num_used = bin(used).count("1")
+        if num_used > a2register_stats[0]:
+            a2register_stats = (num_used, self.pos)
 
         for act2_ref in self.references:
-            if force_recursive or act2_ref.is_proc:
-                act2_ref.action2.remove_tmp_location(location, True)
+            if act2_ref.is_proc:
+                act2_ref.action2.inherited_tmp_locations |= used
+            else:
+                act2_ref.action2.inherited_tmp_locations |= self.inherited_tmp_locations
 
 
 class Action2Reference:
@@ -26,16 +26,10 @@ class Action2Layout(action2.Action2):
 
     def resolve_tmp_storage(self):
         for reg in self.param_registers:
-            if not self.tmp_locations:
-                raise generic.ScriptError(
-                    "There are not enough registers available "
-                    + "to perform all required computations in switch blocks. "
-                    + "Please reduce the complexity of your code.",
-                    self.pos,
-                )
-            location = self.tmp_locations[0]
-            self.remove_tmp_location(location, False)
+            location = self.get_free_tmp_location()
+            self.remove_tmp_location(location)
             reg.set_register(location)
+        self.propagate_tmp_locations()
 
     def write(self, file):
         size = self.layout.get_size()
@@ -252,7 +246,7 @@ class Action2LayoutSprite:
                 generic.check_range(
                     offset.value,
                     0,
-                    len(real_sprite.parse_sprite_data(spriteset)) - 1,
+                    real_sprite.get_num_sprites(spriteset) - 1,
                     "offset within spriteset",
                     pos,
                 )
@@ -50,23 +50,18 @@ class Action2Var(action2.Action2):
         # A return action may use the parameters of its parent
         # Make sure param registers are not reused
         for var in self.var_list:
-            if isinstance(var, VarAction2LoadCallParam):
-                self.remove_tmp_location(var.parameter, False)
+            # Parameters without a register (yet) do not use a location
+            if isinstance(var, VarAction2LoadCallParam) and var.parameter is not None:
+                self.remove_tmp_location(var.parameter)
 
         for var in self.param_registers + self.var_list:  # Allocate param registers first
             if isinstance(var, (VarAction2StoreTempVar, VarAction2CallParam)):
                 if isinstance(var, VarAction2CallParam) and var.register:
                     continue
-                if not self.tmp_locations:
-                    raise generic.ScriptError(
-                        "There are not enough registers available "
-                        + "to perform all required computations in switch blocks. "
-                        + "Please reduce the complexity of your code.",
-                        self.pos,
-                    )
-                location = self.tmp_locations[0]
-                self.remove_tmp_location(location, False)
+                location = self.get_free_tmp_location()
+                self.remove_tmp_location(location)
                 var.set_register(location)
+        self.propagate_tmp_locations()
 
     def prepare_output(self, sprite_num):
         action2.Action2.prepare_output(self, sprite_num)
@@ -923,6 +918,15 @@ def create_return_action(expr, feature, name, var_range):
 failed_cb_results = {}
 
 
+def reset():
+    """
+    Restart the names of the generated action2s, and forget the callback failure results, to compile another file.
+    """
+    global return_action_id
+    return_action_id = 0
+    failed_cb_results.clear()
+
+
 def get_failed_cb_result(feature, action_list, parent_action, pos):
     """
     Get a sprite group reference to use for a failed callback
@@ -99,6 +99,15 @@ class Action3(base_action.BaseAction):
 action2_id = 0
 
 
+def reset():
+    """
+    Restart the names of the generated action2s, and forget the station sprite layouts, to compile another file.
+    """
+    global action2_id
+    action2_id = 0
+    station_sprite_layouts.clear()
+
+
 def create_intermediate_varaction2(feature, varact2parser, mapping, default, pos):
     """
     Create a varaction2 based on a parsed expression and a value mapping
@@ -89,6 +89,9 @@ string_ranges = {
     },
 }
 
+# Free ids of the string ranges before compilation, see reset
+initial_string_ids = {t: l["ids"][:] for t, l in string_ranges.items() if l["random_id"]}
+
 # Mapping of string identifiers to D0xx/DCxx text ids
 # This allows outputting strings only once, instead of everywhere they are used
 used_strings = {
@@ -97,15 +100,35 @@ used_strings = {
 }
 
 
+def reset():
+    """
+    Free all string ids, to compile another file.
+    """
+    for t, ids in initial_string_ids.items():
+        string_ranges[t]["ids"] = ids[:]
+    for strings in used_strings.values():
+        strings.clear()
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [
+        ("{:02X}xx strings".format(t), l["total"] - len(l["ids"]), l["total"], None)
+        for t, l in string_ranges.items()
+        if l["random_id"]
+    ]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    for t, l in string_ranges.items():
-        if l["random_id"]:
-            num_used = l["total"] - len(l["ids"])
-            if num_used > 0:
-                generic.print_info("{:02X}xx strings: {}/{}".format(t, num_used, l["total"]))
+    generic.print_id_stats(get_stats())
 
 
 def get_global_string_actions():
@@ -23,16 +23,35 @@ free_parameters = free_number_list.FreeNumberList(
 )
 
 
+def reset():
+    """
+    Free all parameters, to compile another file.
+    """
+    free_parameters.reset()
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [
+        (
+            "Concurrent ActionD registers",
+            free_parameters.stats[0],
+            free_parameters.total_amount,
+            free_parameters.stats[1],
+        )
+    ]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    if free_parameters.stats[0] > 0:
-        generic.print_info(
-            "Concurrent ActionD registers: {}/{} ({})".format(
-                free_parameters.stats[0], free_parameters.total_amount, str(free_parameters.stats[1])
-            )
-        )
+    generic.print_id_stats(get_stats())
 
 
 class Action6(base_action.BaseAction):
@@ -23,16 +23,30 @@ free_labels = free_number_list.FreeNumberList(
 )
 
 
+def reset():
+    """
+    Free all labels, to compile another file.
+    """
+    global recursive_cond_blocks
+    free_labels.reset()
+    recursive_cond_blocks = 0
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [("Concurrent Action10 labels", free_labels.stats[0], free_labels.total_amount, free_labels.stats[1])]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    if free_labels.stats[0] > 0:
-        generic.print_info(
-            "Concurrent Action10 labels: {}/{} ({})".format(
-                free_labels.stats[0], free_labels.total_amount, str(free_labels.stats[1])
-            )
-        )
+    generic.print_id_stats(get_stats())
 
 
 class SkipAction(base_action.BaseAction):
@@ -58,13 +58,33 @@ def get_free_id():
 town_names_blocks = {}  # Mapping of town_names ID number to TownNames instance.
 
 
+def reset():
+    """
+    Free all town names numbers, to compile another file.
+    """
+    global first_free_id
+    free_numbers.update(range(total_numbers))
+    first_free_id = 0
+    named_numbers.clear()
+    numbered_numbers.clear()
+    town_names_blocks.clear()
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [("Town names", total_numbers - len(free_numbers), total_numbers, None)]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    num_used = total_numbers - len(free_numbers)
-    if num_used > 0:
-        generic.print_info("Town names: {}/{}".format(num_used, total_numbers))
+    generic.print_id_stats(get_stats())
 
 
 class ActionF(base_action.BaseAction):
@@ -397,10 +397,8 @@ class RecolourSpriteAction(SpriteAction):
                 " If you don't have any real sprites use the commandline option -p to set a palette."
             )
         colour_table = self.output_table if file.palette == "DEFAULT" else convert_palette(self.output_table)
-        for idx, colour in enumerate(colour_table):
-            if idx % 16 == 0:
-                file.newline()
-            file.print_bytex(colour)
+        file.newline()
+        file.print_bytes(colour_table, 16)
         if self.last:
             file.newline()
         file.end_sprite()
@@ -473,21 +471,23 @@ def parse_real_sprite(sprite, default_file, default_mask_file, poslist, id_dict)
 
     # create new sprite struct, needed for template expansion
     new_sprite = RealSprite(poslist=poslist + sprite.poslist)
+    # Templates are expanded many times with the same parameters, re-use the reduced sprite parameters
+    key = tuple(id_dict.items())
 
     param_offset = 0
 
     if num_param >= 6:
         # xpos, ypos, xsize and ysize are all optional. If not specified they'll default
         # to 0, 0, image_width, image_height
-        new_sprite.xpos = sprite.param_list[0].reduce_constant([id_dict])
-        new_sprite.ypos = sprite.param_list[1].reduce_constant([id_dict])
-        new_sprite.xsize = sprite.param_list[2].reduce_constant([id_dict])
-        new_sprite.ysize = sprite.param_list[3].reduce_constant([id_dict])
+        new_sprite.xpos = sprite.param_list[0].reduce_constant([id_dict], key)
+        new_sprite.ypos = sprite.param_list[1].reduce_constant([id_dict], key)
+        new_sprite.xsize = sprite.param_list[2].reduce_constant([id_dict], key)
+        new_sprite.ysize = sprite.param_list[3].reduce_constant([id_dict], key)
         new_sprite.check_sprite_size()
         param_offset += 4
 
-    new_sprite.xrel = sprite.param_list[param_offset].reduce_constant([id_dict])
-    new_sprite.yrel = sprite.param_list[param_offset + 1].reduce_constant([id_dict])
+    new_sprite.xrel = sprite.param_list[param_offset].reduce_constant([id_dict], key)
+    new_sprite.yrel = sprite.param_list[param_offset + 1].reduce_constant([id_dict], key)
     generic.check_range(
         new_sprite.xrel.value,
         -0x8000,
@@ -508,7 +508,7 @@ def parse_real_sprite(sprite, default_file, default_mask_file, poslist, id_dict)
     new_sprite.flags = expression.ConstantNumeric(0)
     if num_param > param_offset:
         try:
-            new_sprite.flags = sprite.param_list[param_offset].reduce_constant([real_sprite_flags, id_dict])
+            new_sprite.flags = sprite.param_list[param_offset].reduce_constant([real_sprite_flags, id_dict], key)
             param_offset += 1
         except generic.ConstError:
             # No flags
@@ -551,7 +551,7 @@ def parse_real_sprite(sprite, default_file, default_mask_file, poslist, id_dict)
                             "Real sprite parameter 'mask_file' should be a string literal", new_sprite.file.pos
                         )
                 if len(mask.values) & 2:
-                    new_sprite.mask_pos = tuple(mask.values[i].reduce_constant([id_dict]) for i in range(-2, 0))
+                    new_sprite.mask_pos = tuple(mask.values[i].reduce_constant([id_dict], key) for i in range(-2, 0))
                     # Check that there is also a mask specified, else the offsets make no sense
                     if new_sprite.mask_file is None:
                         raise generic.ScriptError(
@@ -578,6 +578,20 @@ def parse_real_sprite(sprite, default_file, default_mask_file, poslist, id_dict)
 
 sprite_template_map = {}
 
+"""
+Expanded sprite data of each sprite container, see L{expand_sprite_data}. The expansion only depends
+on the sprite container and the sprite templates, so it is done once per container per compilation.
+"""
+expanded_sprite_data = {}
+
+
+def reset():
+    """
+    Forget the sprite templates and the expanded sprite data, to compile another file.
+    """
+    sprite_template_map.clear()
+    expanded_sprite_data.clear()
+
 
 def parse_sprite_list(sprite_list, default_file, default_mask_file, poslist, parameters=None):
     real_sprite_list = []
@@ -586,25 +600,32 @@ def parse_sprite_list(sprite_list, default_file, default_mask_file, poslist, par
     return real_sprite_list
 
 
-def parse_sprite_data(sprite_container):
+def expand_sprite_data(sprite_container):
     """
+    Expand the sprite data of a sprite container into the sprites of each output sprite.
+    The result is computed once per sprite container, and shared by all callers.
+
     @param sprite_container: AST node that contains the sprite data
     @type sprite_container: L{SpriteContainer}
 
-    @return: List of real sprite actions
-    @rtype: C{list} of L{BaseAction}
+    @return: For each output sprite, either the real sprites of all alternatives or a recolour sprite.
+    @rtype: C{list} of (C{list} of L{RealSprite} or L{RecolourSprite})
     """
+    expanded = expanded_sprite_data.get(sprite_container)
+    if expanded is not None:
+        return expanded
+
     all_sprite_data = sprite_container.get_all_sprite_data()
-    action_list = []
+    expanded = []
     first = True
 
     for sprite_data in all_sprite_data:
         sprite_list, default_file, default_mask_file, pos, zoom_level, bit_depth = sprite_data
         new_sprite_list = parse_sprite_list(sprite_list, default_file, default_mask_file, [pos])
-        if not first and len(new_sprite_list) != len(action_list):
+        if not first and len(new_sprite_list) != len(expanded):
             msg = "Expected {:d} alternative sprites for {} '{}', got {:d}."
             msg = msg.format(
-                len(action_list), sprite_container.block_type, sprite_container.block_name.value, len(new_sprite_list)
+                len(expanded), sprite_container.block_type, sprite_container.block_name.value, len(new_sprite_list)
             )
             raise generic.ScriptError(msg, sprite_container.pos)
 
@@ -620,18 +641,18 @@ def parse_sprite_data(sprite_container):
                 raise generic.ScriptError("Mask file may only be specified for 32bpp sprites.", sprite.mask_file.pos)
             if first:
                 if isinstance(sprite, RealSprite):
-                    action_list.append(RealSpriteAction())
+                    expanded.append([])
                 else:
                     assert isinstance(sprite, RecolourSprite)
-                    action_list.append(RecolourSpriteAction(sprite))
+                    expanded.append(sprite)
             else:
                 # Not the first sprite, so an alternative sprite
-                if isinstance(sprite, RecolourSprite) or isinstance(action_list[i], RecolourSpriteAction):
+                if isinstance(sprite, RecolourSprite) or isinstance(expanded[i], RecolourSprite):
                     raise generic.ScriptError(
                         "Alternative sprites may only be provided for and contain real sprites, not recolour sprites.",
                         sprite_container.pos,
                     )
-                if action_list[i].sprite_list[0].is_empty and not sprite.is_empty:
+                if expanded[i][0].is_empty and not sprite.is_empty:
                     # if the first sprite is empty, all others are ignored
                     generic.print_warning(
                         generic.Warning.OPTIMISATION,
@@ -639,9 +660,44 @@ def parse_sprite_data(sprite_container):
                         sprite_container.pos,
                     )
             if isinstance(sprite, RealSprite):
-                action_list[i].add_sprite(sprite)
+                expanded[i].append(sprite)
         first = False
 
+    expanded_sprite_data[sprite_container] = expanded
+    return expanded
+
+
+def get_num_sprites(sprite_container):
+    """
+    Get the number of output sprites of a sprite container, without creating the actions for them.
+
+    @param sprite_container: AST node that contains the sprite data
+    @type sprite_container: L{SpriteContainer}
+
+    @return: Number of sprites.
+    @rtype: C{int}
+    """
+    return len(expand_sprite_data(sprite_container))
+
+
+def parse_sprite_data(sprite_container):
+    """
+    @param sprite_container: AST node that contains the sprite data
+    @type sprite_container: L{SpriteContainer}
+
+    @return: List of real sprite actions
+    @rtype: C{list} of L{BaseAction}
+    """
+    # The actions are created for every call, as they are modified when writing the output
+    action_list = []
+    for sprites in expand_sprite_data(sprite_container):
+        if isinstance(sprites, RecolourSprite):
+            action_list.append(RecolourSpriteAction(sprites))
+        else:
+            action = RealSpriteAction()
+            action.sprite_list = list(sprites)
+            action_list.append(action)
+
     if len(action_list) != 0:
         action_list[-1].last = True
     return action_list
@@ -67,8 +67,7 @@ class AltSpritesBlock(base_statement.BaseStatement):
             raise generic.ScriptError(
                 "value for alternative_sprites parameter 3 'bit depth' is not a valid bit depth", param_list[2].pos
             )
-        if self.bit_depth == 32:
-            global_constants.any_32bpp_sprites = global_constants.allow_32bpp
+        self.register_bit_depth()
 
         if len(param_list) >= 4:
             self.image_file = param_list[3].reduce()
@@ -92,6 +91,14 @@ class AltSpritesBlock(base_statement.BaseStatement):
 
         self.sprite_list = sprite_list
 
+    def register_cached(self):
+        # Restored from the parse cache, register it like a newly constructed block
+        self.register_bit_depth()
+
+    def register_bit_depth(self):
+        if self.bit_depth == 32:
+            global_constants.any_32bpp_sprites = global_constants.allow_32bpp
+
     def pre_process(self):
         if (self.bit_depth == 32 and not global_constants.allow_32bpp) or (
             self.zoom_level != 0 and not global_constants.allow_extra_zoom
@@ -28,12 +28,32 @@ The 2nd field is the maximum amount of parameter registers available. This is wh
 param_stats = [0, 0x40]
 
 
+def reset():
+    """
+    Forget the grf block and its parameters, to compile another file.
+    """
+    global palette_node, blitter_node
+    palette_node = None
+    blitter_node = None
+    param_stats[0] = 0
+    ParameterDescription.free_bits.clear()
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [("GRF parameter registers", param_stats[0], param_stats[1], None)]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    if param_stats[0] > 0:
-        generic.print_info("GRF parameter registers: {}/{}".format(param_stats[0], param_stats[1]))
+    generic.print_id_stats(get_stats())
 
 
 def set_palette_used(pal):
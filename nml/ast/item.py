@@ -22,6 +22,16 @@ item_id = None
 item_size = None
 
 
+def reset():
+    """
+    Leave the current item, to compile another file.
+    """
+    global item_feature, item_id, item_size
+    item_feature = None
+    item_id = None
+    item_size = None
+
+
 class Item(base_statement.BaseStatementList):
     """
     AST-node representing an item block
@@ -41,12 +41,19 @@ class SpriteContainer:
         self.block_type = block_type
         self.block_name = block_name
         self.sprite_data = {}
-        if block_name is not None:
-            if block_name.value in SpriteContainer.sprite_blocks:
+        self.register_block_name()
+
+    def register_cached(self):
+        # Restored from the parse cache, register it like a newly constructed block
+        self.register_block_name()
+
+    def register_block_name(self):
+        if self.block_name is not None:
+            if self.block_name.value in SpriteContainer.sprite_blocks:
                 raise generic.ScriptError(
-                    "Block with name '{}' is already defined.".format(block_name.value), block_name.pos
+                    "Block with name '{}' is already defined.".format(self.block_name.value), self.block_name.pos
                 )
-            SpriteContainer.sprite_blocks[block_name.value] = self
+            SpriteContainer.sprite_blocks[self.block_name.value] = self
 
     def add_sprite_data(self, sprite_list, default_file, pos, zoom_level=0, bit_depth=8, default_mask_file=None):
         assert zoom_level in range(0, 6)
@@ -83,3 +90,10 @@ class SpriteContainer:
         raise generic.ScriptError(
             "Undeclared block identifier '{}' encountered".format(block_name.value), block_name.pos
         )
+
+
+def reset():
+    """
+    Forget the named sprite blocks, to compile another file.
+    """
+    SpriteContainer.sprite_blocks.clear()
@@ -125,8 +125,7 @@ class SpriteSet(spriteset_base_class, sprite_container.SpriteContainer):
                     "Spriteset-block parameter 2 'file' must be a string literal", self.image_file.pos
                 )
 
-        if self.bit_depth == 32:
-            global_constants.any_32bpp_sprites = global_constants.allow_32bpp
+        self.register_bit_depth()
 
         if len(param_list) >= 5:
             self.mask_file = param_list[4].reduce()
@@ -144,6 +143,15 @@ class SpriteSet(spriteset_base_class, sprite_container.SpriteContainer):
         self.labels = {}  # mapping of real sprite labels to offsets
         self.add_sprite_data(self.sprite_list, self.image_file, pos, self.zoom_level, self.bit_depth, self.mask_file)
 
+    def register_cached(self):
+        # Restored from the parse cache, register it like a newly constructed spriteset
+        sprite_container.SpriteContainer.register_cached(self)
+        self.register_bit_depth()
+
+    def register_bit_depth(self):
+        if self.bit_depth == 32:
+            global_constants.any_32bpp_sprites = global_constants.allow_32bpp
+
     def pre_process(self):
         spriteset_base_class.pre_process(self)
         offset = 0
@@ -22,6 +22,14 @@ from nml.ast import base_statement
 townname_serial = 1
 
 
+def reset():
+    """
+    Restart the names of the generated town names, to compile another file.
+    """
+    global townname_serial
+    townname_serial = 1
+
+
 class TownNames(base_statement.BaseStatement):
     """
     'town_names' ast node.
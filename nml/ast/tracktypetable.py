@@ -23,9 +23,16 @@ class BaseTracktypeTable(base_statement.BaseStatement):
 
     def __init__(self, tracktype_list, pos):
         base_statement.BaseStatement.__init__(self, self.track_kind + "type table", pos, False, False)
+        self.register_table()
+        self.tracktype_list = tracktype_list
+
+    def register_cached(self):
+        # Restored from the parse cache, register it like a newly constructed table
+        self.register_table()
+
+    def register_table(self):
         generic.OnlyOnce.enforce(self, self.track_kind + "type table")
         self.tracktype_table.clear()
-        self.tracktype_list = tracktype_list
 
     def register_names(self):
         for i, tracktype in enumerate(self.tracktype_list):
@@ -89,9 +96,9 @@ class RailtypeTable(BaseTracktypeTable):
     table_prop_id = 0x12
     cond_tracktype_not_defined = 0x0D
 
-    def __init__(self, *args, **kwargs):
+    def register_table(self):
         global_constants.is_default_railtype_table = False
-        super().__init__(*args, **kwargs)
+        super().register_table()
 
 
 class RoadtypeTable(BaseTracktypeTable):
@@ -100,9 +107,9 @@ class RoadtypeTable(BaseTracktypeTable):
     table_prop_id = 0x16
     cond_tracktype_not_defined = 0x0F
 
-    def __init__(self, *args, **kwargs):
+    def register_table(self):
         global_constants.is_default_roadtype_table = False
-        super().__init__(*args, **kwargs)
+        super().register_table()
 
 
 class TramtypeTable(BaseTracktypeTable):
@@ -111,6 +118,6 @@ class TramtypeTable(BaseTracktypeTable):
     table_prop_id = 0x17
     cond_tracktype_not_defined = 0x11
 
-    def __init__(self, *args, **kwargs):
+    def register_table(self):
         global_constants.is_default_tramtype_table = False
-        super().__init__(*args, **kwargs)
+        super().register_table()
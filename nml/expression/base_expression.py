@@ -15,6 +15,16 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 
 from nml import generic
 
+# Results of L{Expression.reduce_constant} by node and key, see there
+_constant_cache = {}
+
+
+def reset():
+    """
+    Forget the reduced constants, to compile another file.
+    """
+    _constant_cache.clear()
+
 
 class Type:
     """
@@ -69,18 +79,30 @@ class Expression:
         """
         raise NotImplementedError("reduce must be implemented in expression-subclass {!r}".format(type(self)))
 
-    def reduce_constant(self, id_dicts=None):
+    def reduce_constant(self, id_dicts=None, key=None):
         """
         Reduce this expression and make sure the result is a constant number.
 
         @param id_dicts: A list with dicts that are used to map identifiers
             to another (often numeric) representation.
 
+        @param key: If not C{None}, the result is cached for this expression and key, and re-used by later
+            calls with the same key. The key must identify the values of all identifiers in C{id_dicts}.
+        @type key: C{tuple} or C{None}
+
         @return: A constant number that is the result of this expression.
+            A cached result is shared by all callers, and must not be modified.
         """
+        if key is not None:
+            cached = _constant_cache.get((id(self), key))
+            # The expression itself is stored as well, so a new expression with the same id can not match
+            if cached is not None and cached[0] is self:
+                return cached[1]
         expr = self.reduce(id_dicts)
         if not isinstance(expr, ConstantNumeric):
             raise generic.ConstError(self.pos)
+        if key is not None:
+            _constant_cache[(id(self), key)] = (self, expr)
         return expr
 
     def supported_by_action2(self, raise_error):
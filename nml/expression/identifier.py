@@ -61,6 +61,10 @@ class Identifier(Expression):
 
     def reduce(self, id_dicts=None, unknown_id_fatal=True, search_func_ptr=False):
         for id_dict in id_dicts or []:
+            if isinstance(id_dict, global_constants.IdentifierTable):
+                id_dict = id_dict.lookup(self.value)
+                if id_dict is None:
+                    continue
             if isinstance(id_dict, tuple):
                 id_d, func = id_dict
             else:
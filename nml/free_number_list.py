@@ -30,6 +30,9 @@ class FreeNumberList:
     @ivar free_numbers: The list with currently unused numbers.
     @type free_numbers: C{list}
 
+    @ivar initial_numbers: The list with numbers in the beginning, for L{reset}.
+    @type initial_numbers: C{list}
+
     @ivar states: A list of lists. Each sublist contains all numbers
         that were L{popped<pop>} between the last call to L{save} and
         the next call to L{save}. Every time L{save} is called one
@@ -55,6 +58,7 @@ class FreeNumberList:
         self.total_amount = len(free_numbers)
         self.stats = (0, None)
         self.free_numbers = free_numbers
+        self.initial_numbers = free_numbers[:]
         self.states = []
         self.used_numbers = set()
         self.exception = exception
@@ -136,3 +140,12 @@ class FreeNumberList:
         self.states[-1].reverse()
         self.free_numbers.extend(self.states[-1])
         self.states.pop()
+
+    def reset(self):
+        """
+        Return all numbers to the free number list, and clear the statistics.
+        """
+        self.stats = (0, None)
+        self.free_numbers = self.initial_numbers[:]
+        self.states = []
+        self.used_numbers = set()
@@ -17,6 +17,16 @@ import os
 import sys
 import time
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
 # Enable VT100 sequences on windows consoles
 if os.name == "nt":
 
@@ -153,6 +163,9 @@ class Position:
     @type includes: C{list} of L{Position}
     """
 
+    # There is a position for about every line of the input, keep them small
+    __slots__ = ("filename", "includes")
+
     def __init__(self, filename, includes):
         self.filename = filename
         self.includes = includes
@@ -166,6 +179,8 @@ class LinePosition(Position):
     @type line_start: C{int}
     """
 
+    __slots__ = ("line_start",)
+
     def __init__(self, filename, line_start, includes=None):
         Position.__init__(self, filename, includes or [])
         self.line_start = line_start
@@ -185,6 +200,8 @@ class PixelPosition(Position):
     @type ypos: C{int}
     """
 
+    __slots__ = ("xpos", "ypos")
+
     def __init__(self, filename, xpos, ypos):
         Position.__init__(self, filename, [])
         self.xpos = xpos
@@ -199,6 +216,8 @@ class ImageFilePosition(Position):
     Generic (not position-dependant) error with an image file
     """
 
+    __slots__ = ()
+
     def __init__(self, filename, pos=None):
         poslist = []
         if pos is not None:
@@ -214,6 +233,8 @@ class LanguageFilePosition(Position):
     Generic (not position-dependant) error with a language file.
     """
 
+    __slots__ = ()
+
     def __init__(self, filename):
         Position.__init__(self, filename, [])
 
@@ -351,6 +372,12 @@ Timestamp of the last incremental progress update.
 """
 progress_update_time = None
 
+"""
+If not C{None}, called with the progress message when a processing step starts, and with C{None} when it ends.
+It is called regardless of the verbosity level, to measure the processing steps.
+"""
+progress_listener = None
+
 
 def hide_progress():
     if progress_message is not None:
@@ -366,6 +393,8 @@ def clear_progress():
     global progress_message
     global progress_start_time
     global progress_update_time
+    if progress_listener is not None:
+        progress_listener(None)
     hide_progress()
 
     if (progress_message is not None) and (verbosity_level >= VERBOSITY_TIMING):
@@ -386,6 +415,8 @@ def print_progress(msg, incremental=False):
     @param incremental: True if this message is updated incrementally (that is, very often).
     @type  incremental: C{bool}
     """
+    if progress_listener is not None and not incremental:
+        progress_listener(msg)
     if verbosity_level < VERBOSITY_PROGRESS:
         return
 
@@ -421,10 +452,35 @@ def print_info(msg):
     show_progress()
 
 
+def print_id_stats(stats):
+    """
+    Print statistics about used ids, of the pools that have ids in use.
+
+    @param stats: Name of the pool, number of used ids, number of ids, and the position where the most ids were
+                  in use at the same time (or C{None}), of each pool of ids.
+    @type  stats: C{list} of C{tuple} of (C{str}, C{int}, C{int}, L{Position} or C{None})
+    """
+    for name, used, total, extra in stats:
+        if used > 0:
+            if extra is None:
+                print_info("{}: {}/{}".format(name, used, total))
+            else:
+                print_info("{}: {}/{} ({})".format(name, used, total, extra))
+
+
+"""
+If not C{None}, warnings are added to this list as (type, msg, pos) instead of being printed.
+"""
+recorded_warnings = None
+
+
 def print_warning(type, msg, pos=None):
     """
     Output a warning message to the user.
     """
+    if recorded_warnings is not None:
+        recorded_warnings.append((type, msg, pos))
+        return
     if verbosity_level < VERBOSITY_WARNING:
         return
     if Warning.disabled and type in Warning.disabled:
@@ -483,6 +539,14 @@ The key is the path as specified in the sources. The value is the validated path
 _paths = {}
 
 
+def reset():
+    """
+    Forget the resolved paths, as files may have been added or renamed before compiling another file.
+    """
+    _paths.clear()
+    OnlyOnce.clear()
+
+
 def find_file(filepath):
     """
     Verify whether L{filepath} exists. If not, try to find a similar one with a
@@ -565,7 +629,7 @@ def set_cache_root_dir(dir):
     cache_root_dir = None if dir is None else os.path.abspath(dir)
 
 
-def _cache_file_path(sources, extension):
+def cache_file_path(sources, extension):
     """
     Compose a filename for a cache file.
 
@@ -603,7 +667,7 @@ def open_cache_file(sources, extension, mode):
     if not any(sources):
         raise FileNotFoundError("Can't create cache file with no sources")
 
-    path = _cache_file_path(sources, extension)
+    path = cache_file_path(sources, extension)
 
     try:
         if "w" in mode:
@@ -616,3 +680,157 @@ def open_cache_file(sources, extension, mode):
                 "Can't create cache file {}. Check permissions, or use --cache-dir or --no-cache.".format(path),
             )
         raise
+
+
+def lock_cache_file(sources, extension):
+    """
+    Get a lock for cache files, to coordinate processes sharing the cache directory.
+
+    @param sources: List of source files, the cache file depends on / belongs to.
+    @type  sources: C{list} or C{tuple} of C{str} or similar.
+
+    @param extension: File extension for the lock file including leading ".".
+    @type  extension: C{str}
+
+    @return: Lock, not acquired yet.
+    @rtype:  L{FileLock}
+    """
+    if cache_root_dir is None:
+        raise FileNotFoundError("No cache directory")
+
+    if not any(sources):
+        raise FileNotFoundError("Can't create cache file with no sources")
+
+    return FileLock(cache_file_path(sources, extension))
+
+
+class FileLock:
+    """
+    Advisory lock on a file, shared by readers or held by a single writer.
+    The lock file is created if needed, and never removed, as that would break locking by other processes.
+
+    With C{fcntl}, the whole file is locked. Windows only has exclusive locks on byte ranges (C{msvcrt}),
+    there a reader locks one of L{SHARED_SLOTS} bytes, and a writer locks all of them.
+    On systems with neither, locking is not possible, a warning is printed and acquiring the lock always succeeds.
+
+    Used as context manager, the lock is acquired for exclusive use.
+
+    @ivar path: Path to the lock file.
+    @type path: C{str}
+
+    @ivar file: Opened lock file while the lock is held, C{None} otherwise.
+    @type file: C{file} or C{None}
+
+    @ivar region: Offset and length of the locked bytes with C{msvcrt}, C{None} otherwise.
+    @type region: C{tuple} of (C{int}, C{int}) or C{None}
+    """
+
+    # Number of readers that can hold a lock at the same time with msvcrt
+    SHARED_SLOTS = 64
+    # Time to wait before trying again to get a lock with msvcrt, in seconds
+    RETRY_DELAY = 0.05
+
+    unsupported_warned = False
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.region = None
+
+    def acquire(self, exclusive=True, blocking=True):
+        """
+        Acquire the lock.
+
+        @param exclusive: Lock for exclusive use, instead of shared use.
+        @type  exclusive: C{bool}
+
+        @param blocking: Wait until the lock is available, instead of failing.
+        @type  blocking: C{bool}
+
+        @return: Whether the lock is acquired.
+        @rtype:  C{bool}
+        """
+        assert self.file is None
+        if fcntl is None and msvcrt is None:
+            if not FileLock.unsupported_warned:
+                FileLock.unsupported_warned = True
+                print_warning(
+                    Warning.GENERIC,
+                    "Cache files can not be locked on this system. Do not use the same cache directory"
+                    " in several nmlc processes at the same time.",
+                )
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            lock_file = open(self.path, "a")
+        except OSError:
+            if exclusive:
+                raise
+            # Read-only cache directory, nobody can write to it
+            return True
+        locked = False
+        try:
+            if fcntl is not None:
+                locked = self.lock_fcntl(lock_file, exclusive, blocking)
+            else:
+                locked = self.lock_msvcrt(lock_file, exclusive, blocking)
+        finally:
+            if not locked:
+                lock_file.close()
+        if locked:
+            self.file = lock_file
+        return locked
+
+    def lock_fcntl(self, lock_file, exclusive, blocking):
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, operation)
+        except BlockingIOError:
+            return False
+        return True
+
+    def lock_msvcrt(self, lock_file, exclusive, blocking):
+        fd = lock_file.fileno()
+        if exclusive:
+            regions = [(0, self.SHARED_SLOTS)]
+        else:
+            # Start at a different slot in each process, so readers rarely have to try more than one
+            first = os.getpid() % self.SHARED_SLOTS
+            regions = [((first + i) % self.SHARED_SLOTS, 1) for i in range(self.SHARED_SLOTS)]
+        while True:
+            for offset, length in regions:
+                os.lseek(fd, offset, os.SEEK_SET)
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, length)
+                except OSError:
+                    continue
+                self.region = (offset, length)
+                return True
+            if not blocking:
+                return False
+            time.sleep(self.RETRY_DELAY)
+
+    def release(self):
+        """
+        Release the lock, if it is held.
+        """
+        if self.file is not None:
+            try:
+                if self.region is not None:
+                    offset, length = self.region
+                    os.lseek(self.file.fileno(), offset, os.SEEK_SET)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, length)
+            finally:
+                # Closing the file releases a lock with fcntl
+                self.file.close()
+                self.file = None
+                self.region = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -16,6 +16,125 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 from nml import expression, generic, nmlop
 
 
+class IdentifierTable:
+    """
+    Index of the identifiers in a list of id dicts, so L{Identifier.reduce} can find the dict that defines
+    an identifier with a single lookup, instead of trying all dicts in turn.
+    The first dict in the list that contains an identifier shadows the later ones.
+    The index is kept up to date by the L{IdentifierDict}s in the list, the other dicts must not change.
+
+    @ivar id_dicts: Dicts with identifiers, or tuples of such a dict and its conversion function,
+                    in order of precedence.
+    @type id_dicts: C{list}
+
+    @ivar index: Mapping of identifiers to the index in L{id_dicts} of the dict that defines them.
+    @type index: C{dict} mapping C{str} to C{int}
+
+    @ivar lookups: Number of identifiers looked up.
+    @type lookups: C{int}
+
+    @ivar hits: Number of identifiers looked up that were found.
+    @type hits: C{int}
+    """
+
+    def __init__(self, id_dicts):
+        self.id_dicts = id_dicts
+        self.index = {}
+        self.lookups = 0
+        self.hits = 0
+        for layer in reversed(range(len(id_dicts))):
+            id_dict = self.get_dict(layer)
+            if isinstance(id_dict, IdentifierDict):
+                id_dict.tables.append((self, layer))
+            self.index.update(dict.fromkeys(id_dict, layer))
+
+    def get_dict(self, layer):
+        id_dict = self.id_dicts[layer]
+        return id_dict[0] if isinstance(id_dict, tuple) else id_dict
+
+    def lookup(self, name):
+        """
+        Find the id dict that defines an identifier.
+
+        @param name: Identifier to look up.
+        @type  name: C{str}
+
+        @return: Entry of L{id_dicts} that defines the identifier, or C{None} if it is not defined.
+        @rtype:  C{dict}, C{tuple} or C{None}
+        """
+        self.lookups += 1
+        layer = self.index.get(name)
+        if layer is None:
+            return None
+        self.hits += 1
+        return self.id_dicts[layer]
+
+    def add(self, name, layer):
+        current = self.index.get(name)
+        if current is None or layer < current:
+            self.index[name] = layer
+
+    def remove(self, name, layer):
+        if self.index.get(name) != layer:
+            return
+        del self.index[name]
+        for next_layer in range(layer + 1, len(self.id_dicts)):
+            if name in self.get_dict(next_layer):
+                self.index[name] = next_layer
+                break
+
+
+class IdentifierDict(dict):
+    """
+    Dict with identifiers that can change during compilation,
+    it updates the L{IdentifierTable}s it is part of when identifiers are added or removed.
+
+    @ivar tables: Tables that contain this dict, with the index of this dict in the table.
+    @type tables: C{list} of C{tuple} of (L{IdentifierTable}, C{int})
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.tables = []
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            for table, layer in self.tables:
+                table.add(key, layer)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        for table, layer in self.tables:
+            table.remove(key, layer)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        for table, layer in self.tables:
+            table.remove(key, layer)
+        return key, value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+
 def constant_number(name, info, pos):
     if isinstance(info, str):
         generic.print_warning(
@@ -26,7 +145,7 @@ def constant_number(name, info, pos):
 
 
 # fmt: off
-constant_numbers = {
+constant_numbers = IdentifierDict({
     # climates
     "CLIMATE_TEMPERATE"     : 0,
     "CLIMATE_ARCTIC"        : 1,
@@ -1221,7 +1340,7 @@ constant_numbers = {
     "RST_VIEW_BAY_NW"                           : 3,
     "RST_VIEW_DRIVE_THROUGH_X"                  : 4,
     "RST_VIEW_DRIVE_THROUGH_Y"                  : 5,
-}
+})
 # fmt: on
 
 
@@ -1289,12 +1408,14 @@ def misc_grf_bit(name, info, pos):
     return expression.SpecialParameter(name, info, misc_bit_write, misc_bit_read, True, pos)
 
 
-misc_grf_bits = {
-    "traffic_side": {"param": 0x86, "bit": 4},
-    "desert_paved_roads": {"param": 0x9E, "bit": 1},
-    "train_width_32_px": {"param": 0x9E, "bit": 3},
-    "second_rocky_tileset": {"param": 0x9E, "bit": 6},
-}
+misc_grf_bits = IdentifierDict(
+    {
+        "traffic_side": {"param": 0x86, "bit": 4},
+        "desert_paved_roads": {"param": 0x9E, "bit": 1},
+        "train_width_32_px": {"param": 0x9E, "bit": 3},
+        "second_rocky_tileset": {"param": 0x9E, "bit": 6},
+    }
+)
 
 
 def add_1920(expr, info):
@@ -1446,26 +1567,26 @@ def create_spritegroup_ref(name, info, pos):
     return expression.SpriteGroupRef(expression.Identifier(info), [], pos)
 
 
-cargo_numbers = {}
-badge_numbers = {}
+cargo_numbers = IdentifierDict()
+badge_numbers = IdentifierDict()
 
 is_default_railtype_table = True
 # if no railtype_table is provided, OpenTTD assumes these 3 railtypes
-railtype_table = {"RAIL": 0, "MONO": 1, "MGLV": 2}
+railtype_table = IdentifierDict({"RAIL": 0, "MONO": 1, "MGLV": 2})
 
 is_default_roadtype_table = True
 # if no roadtype_table is provided, OpenTTD sets all vehicles to ROAD
-roadtype_table = {"ROAD": 0}
+roadtype_table = IdentifierDict({"ROAD": 0})
 
 is_default_tramtype_table = True
 # if no tramtype_table is provided, OpenTTD sets all vehicles to ELRL
-tramtype_table = {"ELRL": 0}
+tramtype_table = IdentifierDict({"ELRL": 0})
 
 identifier_refcount = {}
-item_names = {}
-settings = {}
-named_parameters = {}
-spritegroups = {"CB_FAILED": "CB_FAILED"}
+item_names = IdentifierDict()
+settings = IdentifierDict()
+named_parameters = IdentifierDict()
+spritegroups = IdentifierDict({"CB_FAILED": "CB_FAILED"})
 
 zoom_levels = {
     "ZOOM_LEVEL_NORMAL": 0,
@@ -1488,39 +1609,102 @@ allow_extra_zoom = True
 
 allow_32bpp = True
 
-const_list = [
-    (constant_numbers, constant_number),
-    (global_parameters, param_from_info),
-    (misc_grf_bits, misc_grf_bit),
-    (patch_variables, patch_variable),
-    (named_parameters, param_from_name),
-    cargo_numbers,
-    badge_numbers,
-    railtype_table,
-    roadtype_table,
-    tramtype_table,
-    (item_names, item_to_id),
-    (settings, setting_from_info),
-    (config_flags, config_flag),
-    (unified_maglev_var, unified_maglev),
-    (spritegroups, create_spritegroup_ref),
-    zoom_levels,
-    bit_depths,
+# Dicts that change during compilation must be IdentifierDicts, to keep const_table up to date
+const_table = IdentifierTable(
+    [
+        (constant_numbers, constant_number),
+        (global_parameters, param_from_info),
+        (misc_grf_bits, misc_grf_bit),
+        (patch_variables, patch_variable),
+        (named_parameters, param_from_name),
+        cargo_numbers,
+        badge_numbers,
+        railtype_table,
+        roadtype_table,
+        tramtype_table,
+        (item_names, item_to_id),
+        (settings, setting_from_info),
+        (config_flags, config_flag),
+        (unified_maglev_var, unified_maglev),
+        (spritegroups, create_spritegroup_ref),
+        zoom_levels,
+        bit_depths,
+    ]
+)
+
+"""
+Identifiers that are valid everywhere. This is a list of id dicts, as expected by L{Identifier.reduce},
+so more specific id dicts can be added in front of it.
+"""
+const_list = [const_table]
+
+# Id dicts that change during compilation, with their contents before compilation, see reset
+initial_id_dicts = [
+    (id_dict, dict(id_dict))
+    for id_dict in (
+        constant_numbers,
+        misc_grf_bits,
+        named_parameters,
+        cargo_numbers,
+        badge_numbers,
+        railtype_table,
+        roadtype_table,
+        tramtype_table,
+        item_names,
+        settings,
+        spritegroups,
+    )
 ]
 
 
+def reset():
+    """
+    Remove all identifiers defined by the compiled file, to compile another file.
+    """
+    global is_default_railtype_table, is_default_roadtype_table, is_default_tramtype_table, any_32bpp_sprites
+    for id_dict, contents in initial_id_dicts:
+        for name in [name for name in id_dict if name not in contents]:
+            del id_dict[name]
+        id_dict.update(contents)
+    identifier_refcount.clear()
+    is_default_railtype_table = True
+    is_default_roadtype_table = True
+    is_default_tramtype_table = True
+    any_32bpp_sprites = False
+    const_table.lookups = 0
+    const_table.hits = 0
+
+
+def get_stats():
+    """
+    Get statistics about used ids, see L{generic.print_id_stats}.
+
+    @return: Name, number of used ids, number of ids and extra information of each pool of ids.
+    @rtype:  C{list} of C{tuple}
+    """
+    return [
+        # Ids FE and FF have special meanings in Action3, so we do not consider them valid ids.
+        ("Cargo translation table", len(cargo_numbers), 0xFE, None),
+        ("Badge translation table", len(badge_numbers), 0xFFFF, None),
+        # The default tables are not written, so they use no ids
+        ("Railtype translation table", 0 if is_default_railtype_table else len(railtype_table), 0x100, None),
+        ("Roadtype translation table", 0 if is_default_roadtype_table else len(roadtype_table), 0x100, None),
+        ("Tramtype translation table", 0 if is_default_tramtype_table else len(tramtype_table), 0x100, None),
+    ]
+
+
 def print_stats():
     """
     Print statistics about used ids.
     """
-    if len(cargo_numbers) > 0:
-        # Ids FE and FF have special meanings in Action3, so we do not consider them valid ids.
-        generic.print_info("Cargo translation table: {}/{}".format(len(cargo_numbers), 0xFE))
-    if len(badge_numbers) > 0:
-        generic.print_info("Badge translation table: {}/{}".format(len(badge_numbers), 0xFFFF))
-    if not is_default_railtype_table:
-        generic.print_info("Railtype translation table: {}/{}".format(len(railtype_table), 0x100))
-    if not is_default_roadtype_table:
-        generic.print_info("Roadtype translation table: {}/{}".format(len(roadtype_table), 0x100))
-    if not is_default_tramtype_table:
-        generic.print_info("Tramtype translation table: {}/{}".format(len(tramtype_table), 0x100))
+    stats = get_stats()
+    generic.print_id_stats(stats[:2])
+    # Translation tables are reported whenever they are written, also when they are empty
+    is_default_tables = (is_default_railtype_table, is_default_roadtype_table, is_default_tramtype_table)
+    for (name, used, total, _), is_default in zip(stats[2:], is_default_tables):
+        if not is_default:
+            generic.print_info("{}: {}/{}".format(name, used, total))
+    if generic.verbosity_level >= generic.VERBOSITY_TIMING:
+        generic.print_info(
+            "Constant identifier lookups: {:d}, found: {:d}".format(const_table.lookups, const_table.hits)
+        )
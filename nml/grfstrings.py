@@ -13,26 +13,21 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
+import concurrent.futures
 import glob
+import hashlib
+import json
 import os
 import re
 
-from nml import generic
-
-
-def utf8_get_size(char):
-    if char < 128:
-        return 1
-    if char < 2048:
-        return 2
-    if char < 65536:
-        return 3
-    return 4
-
+from nml import generic, version_info
 
 DEFAULT_LANGUAGE = 0x7F
 DEFAULT_LANGNAME = "english.lng"
 
+# Strings encoded by encode_string, with whether they are ascii strings
+_encoded_strings = {}
+
 
 def validate_string(string):
     """
@@ -74,6 +69,48 @@ def is_ascii_string(string):
     return True
 
 
+def encode_string(string):
+    """
+    Get the bytes of a string as they are written to a GRF, without final zero byte.
+    The result is cached, as the same strings are usually sized and written several times.
+
+    @param string: The string to encode.
+    @type  string: C{str}
+
+    @return: The encoded string, and whether it is an ascii string.
+    @rtype:  C{tuple} of (C{bytes}, C{bool})
+    """
+    encoded = _encoded_strings.get(string)
+    if encoded is not None:
+        return encoded
+
+    is_ascii = is_ascii_string(string)
+    data = bytearray()
+    if not is_ascii:
+        # Thorn, marks a unicode string
+        data += b"\xc3\x9e"
+    i = 0
+    while True:
+        j = string.find("\\", i)
+        if j == -1:
+            data += string[i:].encode("utf-8")
+            break
+        data += string[i:j].encode("utf-8")
+        if string[j + 1] in ("\\", '"'):
+            data.append(ord(string[j + 1]))
+            i = j + 2
+        elif string[j + 1] == "U":
+            data += chr(int(string[j + 2 : j + 6], 16)).encode("utf-8")
+            i = j + 6
+        else:
+            data.append(int(string[j + 1 : j + 3], 16))
+            i = j + 3
+
+    encoded = (bytes(data), is_ascii)
+    _encoded_strings[string] = encoded
+    return encoded
+
+
 def get_string_size(string, final_zero=True, force_ascii=False):
     """
     Get the size (in bytes) of a given string.
@@ -92,29 +129,10 @@ def get_string_size(string, final_zero=True, force_ascii=False):
 
     @raise generic.ScriptError: force_ascii and not is_ascii_string(string).
     """
-    size = 0
-    if final_zero:
-        size += 1
-    if not is_ascii_string(string):
-        if force_ascii:
-            raise generic.ScriptError("Expected ascii string but got a unicode string")
-        size += 2
-    i = 0
-    while i < len(string):
-        if string[i] != "\\":
-            size += utf8_get_size(ord(string[i]))
-            i += 1
-        else:
-            if string[i + 1] in ("\\", '"'):
-                size += 1
-                i += 2
-            elif string[i + 1] == "U":
-                size += utf8_get_size(int(string[i + 2 : i + 6], 16))
-                i += 6
-            else:
-                size += 1
-                i += 3
-    return size
+    data, is_ascii = encode_string(string)
+    if force_ascii and not is_ascii:
+        raise generic.ScriptError("Expected ascii string but got a unicode string")
+    return len(data) + 1 if final_zero else len(data)
 
 
 def get_translation(string, lang_id=DEFAULT_LANGUAGE):
@@ -282,6 +300,9 @@ commands = {
 }
 # fmt: on
 
+# String commands without the custom tags, see unload_languages
+builtin_commands = dict(commands)
+
 special_commands = [
     "P",
     "G",
@@ -660,7 +681,6 @@ class NewGRFString:
                     "String code '{}' has been deprecated and will be removed soon".format(command_name),
                     pos,
                 )
-                del commands[command_name]["deprecated"]
             #
             command = StringCommand(command_name, cmd_pos, pos)
             if end >= len(string):
@@ -1218,6 +1238,25 @@ default_lang.langid = DEFAULT_LANGUAGE
 langs = []
 
 
+def reset():
+    """
+    Forget the strings used by the compiled file, to compile another file. The language files stay loaded.
+    """
+    Language.used_strings.clear()
+    _encoded_strings.clear()
+
+
+def unload_languages():
+    """
+    Forget the language files and the custom tags, to read them again after they changed.
+    """
+    global default_lang, commands
+    default_lang = Language(True)
+    default_lang.langid = DEFAULT_LANGUAGE
+    langs.clear()
+    commands = dict(builtin_commands)
+
+
 def parse_file(filename, default):
     """
     Read and parse a single language file.
@@ -1227,6 +1266,9 @@ def parse_file(filename, default):
 
     @param default: True iff this is the default language.
     @type  default: C{bool}
+
+    @return: The parsed language, or C{None} if the file can not be used.
+    @rtype:  L{Language} or C{None}
     """
     lang = Language(False)
     try:
@@ -1246,32 +1288,305 @@ def parse_file(filename, default):
         generic.print_warning(
             generic.Warning.GENERIC, "Language file contains non-utf8 characters. Ignoring (part of) the contents.", pos
         )
+        return None
     except generic.ScriptError as err:
         if default:
             raise
         generic.print_warning(generic.Warning.GENERIC, err.value, err.pos)
-    else:
-        if lang.langid is None:
-            generic.print_warning(
-                generic.Warning.GENERIC,
-                "Language file does not contain a ##grflangid pragma",
-                generic.LanguageFilePosition(filename),
+        return None
+
+    if lang.langid is None:
+        generic.print_warning(
+            generic.Warning.GENERIC,
+            "Language file does not contain a ##grflangid pragma",
+            generic.LanguageFilePosition(filename),
+        )
+        return None
+    return lang
+
+
+def add_language(filename, lang):
+    """
+    Add a parsed language to the list of languages.
+
+    @param filename: The filename of the language file.
+    @type  filename: C{str}
+
+    @param lang: The language, or C{None} if the file can not be used.
+    @type  lang: L{Language} or C{None}
+    """
+    if lang is None:
+        return
+    for lng in langs:
+        if lng[0] == lang.langid:
+            msg = "Language file has the same ##grflangid (with number {:d}) as another language file".format(
+                lang.langid
             )
-        else:
-            for lng in langs:
-                if lng[0] == lang.langid:
-                    msg = "Language file has the same ##grflangid (with number {:d}) as another language file".format(
-                        lang.langid
-                    )
-                    raise generic.ScriptError(msg, generic.LanguageFilePosition(filename))
-            langs.append((lang.langid, lang))
+            raise generic.ScriptError(msg, generic.LanguageFilePosition(filename))
+    langs.append((lang.langid, lang))
+
 
+def get_commands_signature():
+    """
+    Get a signature of the string commands, including the custom tags. Parsed language files depend on them.
+
+    @return: Hash of the string commands.
+    @rtype:  C{str}
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name, command in sorted(commands.items()):
+        # Commands may contain functions to parse their arguments, use their name
+        values = sorted((key, getattr(value, "__name__", value)) for key, value in command.items())
+        digest.update(repr((name, values)).encode("utf-8"))
+    return digest.hexdigest()
 
-def read_lang_files(lang_dir, default_lang_file):
+
+def get_file_digest(filename):
+    """
+    Get a hash of the contents of a file.
+
+    @param filename: Name of the file.
+    @type  filename: C{str}
+
+    @return: Hash of the file contents, or C{None} if the file can not be read.
+    @rtype:  C{str} or C{None}
+    """
+    try:
+        with open(generic.find_file(filename), "rb") as fh:
+            return hashlib.blake2b(fh.read(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
+
+def _position_to_data(pos):
+    if pos is None:
+        return None
+    if isinstance(pos, generic.LinePosition):
+        return [pos.filename, pos.line_start]
+    return [pos.filename]
+
+
+def _position_from_data(data):
+    if data is None:
+        return None
+    if len(data) == 2:
+        return generic.LinePosition(data[0], data[1])
+    return generic.LanguageFilePosition(data[0])
+
+
+def _string_to_data(string):
+    components = [
+        comp if isinstance(comp, str) else [comp.name, comp.case, comp.arguments, comp.offset, comp.str_pos]
+        for comp in string.components
+    ]
+    cases = {case: _string_to_data(case_string) for case, case_string in string.cases.items()}
+    return [string.string, string.pos.line_start, components, string.gender, cases]
+
+
+def _string_from_data(data, filename):
+    text, line, components, gender, cases = data
+    pos = generic.LinePosition(filename, line)
+    string = NewGRFString.__new__(NewGRFString)
+    string.string = text
+    string.pos = pos
+    string.gender = gender
+    string.components = []
+    for comp in components:
+        if not isinstance(comp, str):
+            name, case, arguments, offset, str_pos = comp
+            comp = StringCommand(name, str_pos, pos)
+            comp.case = case
+            comp.arguments = arguments
+            comp.offset = offset
+        string.components.append(comp)
+    string.cases = {case: _string_from_data(case_data, filename) for case, case_data in cases.items()}
+    return string
+
+
+def _language_to_data(lang):
+    """
+    Convert a parsed language to plain data that can be stored in the cache, see L{_language_from_data}.
+
+    @param lang: The language, or C{None}.
+    @type  lang: L{Language} or C{None}
+
+    @return: The language as lists, dictionaries, strings and numbers, or C{None}.
+    @rtype:  C{dict} or C{None}
+    """
+    if lang is None:
+        return None
+    # All strings of a language file have the same file name, store it only once
+    filenames = set(string.pos.filename for string in lang.strings.values())
+    assert len(filenames) <= 1
+    return {
+        "default": lang.default,
+        "langid": lang.langid,
+        "plural": lang.plural,
+        "genders": lang.genders,
+        "gender_map": lang.gender_map,
+        "cases": lang.cases,
+        "case_map": lang.case_map,
+        "filename": filenames.pop() if filenames else None,
+        "strings": {name: _string_to_data(string) for name, string in lang.strings.items()},
+    }
+
+
+def _language_from_data(data):
+    """
+    Rebuild a parsed language from the plain data made by L{_language_to_data}.
+
+    @param data: The language as plain data, or C{None}.
+    @type  data: C{dict} or C{None}
+
+    @return: The language, or C{None}.
+    @rtype:  L{Language} or C{None}
+    """
+    if data is None:
+        return None
+    lang = Language(data["default"])
+    for name in ("langid", "plural", "genders", "gender_map", "cases", "case_map"):
+        setattr(lang, name, data[name])
+    lang.strings = {name: _string_from_data(string, data["filename"]) for name, string in data["strings"].items()}
+    return lang
+
+
+class LanguageCache:
+    """
+    Cache of a parsed language file, stored in the cache directory.
+
+    @ivar filename: Name of the language file.
+    @type filename: C{str}
+
+    @ivar digest: Hash of the language file, C{None} if the file can not be read.
+    @type digest: C{str} or C{None}
+
+    @ivar key: Compiler and string commands signature, and hashes of the language file and the default language
+               file it depends on. The cache is only valid for the same key.
+    @type key: C{tuple}
+    """
+
+    def __init__(self, filename, signature, default_digest):
+        self.filename = filename
+        self.digest = get_file_digest(filename)
+        self.key = (version_info.get_compiler_signature(), signature, self.digest, default_digest)
+
+    def read(self):
+        """
+        Read the parsed language from the cache.
+
+        @return: The cached result of L{parse_file_recorded}, or C{None} if it is not cached.
+        @rtype:  C{tuple} or C{None}
+        """
+        if generic.cache_root_dir is None or self.digest is None:
+            return None
+        try:
+            with generic.open_cache_file((self.filename,), ".lngcache", "r") as cache_file:
+                data = json.load(cache_file)
+            if data["key"] != list(self.key):
+                return None
+            lang, default = (_language_from_data(data[name]) for name in ("lang", "default_lang"))
+            warnings = [(type, msg, _position_from_data(pos)) for type, msg, pos in data["warnings"]]
+        except Exception:
+            return None
+        return lang, warnings, default
+
+    def write(self, result):
+        """
+        Store a parsed language in the cache.
+
+        @param result: Result of L{parse_file_recorded}.
+        @type  result: C{tuple}
+        """
+        if generic.cache_root_dir is None or self.digest is None:
+            return
+        lang, warnings, default = result
+        data = {
+            "key": self.key,
+            "lang": _language_to_data(lang),
+            "default_lang": _language_to_data(default),
+            "warnings": [(type, msg, _position_to_data(pos)) for type, msg, pos in warnings],
+        }
+        try:
+            with generic.lock_cache_file((self.filename,), ".lnglock"):
+                with generic.open_cache_file((self.filename,), ".lngcache.tmp", "w") as cache_file:
+                    json.dump(data, cache_file)
+                os.replace(cache_file.name, cache_file.name[: -len(".tmp")])
+        except OSError:
+            pass
+
+
+def parse_file_recorded(filename, default):
+    """
+    Parse a language file with L{parse_file}, and record the warnings instead of printing them.
+
+    @param filename: The filename of the file to parse.
+    @type  filename: C{str}
+
+    @param default: True iff this is the default language.
+    @type  default: C{bool}
+
+    @return: The parsed language, the warnings, and the parsed default language if C{default}.
+             If parsing the default language fails, the warnings are printed and the error is raised.
+    @rtype:  C{tuple} of (L{Language} or C{None}, C{list} of C{tuple}, L{Language} or C{None})
+    """
+    generic.recorded_warnings = []
+    try:
+        lang = parse_file(filename, default)
+    except generic.ScriptError:
+        print_warnings(generic.recorded_warnings)
+        raise
+    finally:
+        warnings = generic.recorded_warnings
+        generic.recorded_warnings = None
+    return lang, warnings, default_lang if default else None
+
+
+def print_warnings(warnings, printed_deprecations=None):
+    """
+    Print recorded warnings. Each deprecated string code is only reported the first time it is used.
+
+    @param warnings: Warnings recorded by L{parse_file_recorded}.
+    @type  warnings: C{list} of C{tuple}
+
+    @param printed_deprecations: Deprecation warnings printed before, to which the printed ones are added.
+    @type  printed_deprecations: C{set} of C{str}, or C{None} if none were printed.
+    """
+    if printed_deprecations is None:
+        printed_deprecations = set()
+    recorded = generic.recorded_warnings
+    generic.recorded_warnings = None
+    for type, msg, pos in warnings:
+        if type == generic.Warning.DEPRECATION:
+            if msg in printed_deprecations:
+                continue
+            printed_deprecations.add(msg)
+        generic.print_warning(type, msg, pos)
+    generic.recorded_warnings = recorded
+
+
+def _init_worker(default, extra_commands):
+    """
+    Initialise a process that parses language files, see L{read_lang_files}.
+
+    @param default: The parsed default language.
+    @type  default: L{Language}
+
+    @param extra_commands: String commands, including custom tags.
+    @type  extra_commands: C{dict}
+    """
+    global default_lang, commands
+    default_lang = default
+    commands = extra_commands
+
+
+def read_lang_files(lang_dir, default_lang_file, jobs=1):
     """
     Read the language files containing the translations for string constants
     used in the NML specification.
 
+    Parsed language files are stored in the cache directory, and only parsed again when
+    they, the default language file or the string commands change.
+
     @param lang_dir: Name of the directory containing the language files.
     @type  lang_dir: C{str}
 
@@ -1279,8 +1594,11 @@ def read_lang_files(lang_dir, default_lang_file):
                               default translation which will be used as
                               fallback for other languages.
     @type  default_lang_file: C{str}
+
+    @param jobs: Number of processes to parse the language files that are not cached.
+    @type  jobs: C{int}
     """
-    global DEFAULT_LANGNAME
+    global DEFAULT_LANGNAME, default_lang
 
     DEFAULT_LANGNAME = default_lang_file
     if not os.path.exists(lang_dir + os.sep + default_lang_file):
@@ -1289,11 +1607,48 @@ def read_lang_files(lang_dir, default_lang_file):
             'Default language file "{}" doesn\'t exist'.format(os.path.join(lang_dir, default_lang_file)),
         )
         return
-    parse_file(lang_dir + os.sep + default_lang_file, True)
-    for filename in glob.glob(lang_dir + os.sep + "*.lng"):
-        if filename.endswith(default_lang_file):
-            continue
-        parse_file(filename, False)
+
+    signature = get_commands_signature()
+    default_filename = lang_dir + os.sep + default_lang_file
+    default_cache = LanguageCache(default_filename, signature, None)
+    result = default_cache.read()
+    if result is None:
+        result = parse_file_recorded(default_filename, True)
+        default_cache.write(result)
+    lang, warnings, default_lang = result
+    # Warnings of the parsing processes and the cache are printed here, so each deprecation is printed once
+    printed_deprecations = set()
+    print_warnings(warnings, printed_deprecations)
+    add_language(default_filename, lang)
+
+    filenames = [
+        filename for filename in glob.glob(lang_dir + os.sep + "*.lng") if not filename.endswith(default_lang_file)
+    ]
+    caches = [LanguageCache(filename, signature, default_cache.digest) for filename in filenames]
+    results = [cache.read() for cache in caches]
+
+    pending = {}
+    executor = None
+    missing = [i for i, result in enumerate(results) if result is None]
+    if jobs > 1 and len(missing) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            min(jobs, len(missing)), initializer=_init_worker, initargs=(default_lang, commands)
+        )
+        for i in missing:
+            pending[i] = executor.submit(parse_file_recorded, filenames[i], False)
+    try:
+        # Add the languages in the same order as without cache and processes, so errors are the same
+        for i, filename in enumerate(filenames):
+            result = results[i]
+            if result is None:
+                result = pending[i].result() if i in pending else parse_file_recorded(filename, False)
+                caches[i].write(result)
+            lang, warnings, _ = result
+            print_warnings(warnings, printed_deprecations)
+            add_language(filename, lang)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
     langs.sort()
 
 
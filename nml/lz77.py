@@ -14,6 +14,7 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
 import array
+import collections
 
 
 def _encode(data):
@@ -75,6 +76,169 @@ def _encode(data):
     return output
 
 
+# Constants of the GRF compression format.
+WINDOW_SIZE = (1 << 11) - 1  # Maximum distance of a back-reference.
+MIN_MATCH = 3  # Shortest back-reference.
+MAX_MATCH = 15  # Longest back-reference.
+MAX_LITERAL = 0x80  # Longest run of literal bytes.
+
+
+def _longest_match(stream, position):
+    """
+    Find the longest back-reference at a position in a stream of data.
+
+    Unlike L{_encode}, which searches the window again for every length, each search here skips
+    directly to the most distant candidate for a longer match, which is then extended as far as
+    possible. So the number of searches is bounded by the number of better candidates.
+
+    @param stream: Uncompressed data.
+    @type  stream: C{bytes}
+
+    @param position: Position in the stream to find a back-reference for.
+    @type  position: C{int}
+
+    @return: Length and distance of the longest back-reference. If there are several, the most
+             distant one is returned. The length is 0 if no back-reference exists.
+    @rtype:  C{tuple} of (C{int}, C{int})
+    """
+    max_len = min(len(stream) - position, MAX_MATCH)
+    if max_len < MIN_MATCH:
+        return 0, 0
+    length = MIN_MATCH - 1
+    best_pos = max(0, position - WINDOW_SIZE) - 1
+    while True:
+        # Find the most distant candidate for a longer match, the match may not overlap the position.
+        candidate = stream.find(stream[position : position + length + 1], best_pos + 1, position)
+        if candidate < 0:
+            break
+        best_pos = candidate
+        length += 1
+        # Extend the match at the candidate as far as possible.
+        limit = min(max_len, position - best_pos)
+        while length < limit and stream[best_pos + length] == stream[position + length]:
+            length += 1
+        if length == max_len:
+            break
+    if length < MIN_MATCH:
+        return 0, 0
+    return length, position - best_pos
+
+
+def _write_literals(output, literal_bytes):
+    """
+    Append a run of at most L{MAX_LITERAL} literal bytes to the compressed data.
+    """
+    output.append(len(literal_bytes) & 0x7F)
+    output.extend(literal_bytes)
+
+
+def _write_reference(output, length, distance):
+    """
+    Append a back-reference to the compressed data.
+    """
+    output.append(((-length) << 3) & 0xFF | (distance >> 8))
+    output.append(distance & 0xFF)
+
+
+def _encode_greedy(data):
+    """
+    GRF compression algorithm, taking the longest back-reference wherever possible.
+
+    The output is identical to L{_encode}, that is, the longest back-reference is taken at every position.
+
+    @param data: Uncompressed data.
+    @type  data: C{str}, C{bytearray}, C{bytes} or similar.
+
+    @return: Compressed data.
+    @rtype:  C{array}
+    """
+    stream = bytes(data)
+    position = 0
+    literal_start = 0
+    output = array.array("B")
+    stream_len = len(stream)
+
+    while position < stream_len:
+        length, distance = _longest_match(stream, position)
+        if length > 0:
+            if literal_start < position:
+                _write_literals(output, stream[literal_start:position])
+            _write_reference(output, length, distance)
+            position += length
+            literal_start = position
+        else:
+            position += 1
+            if position - literal_start == MAX_LITERAL:
+                _write_literals(output, stream[literal_start:position])
+                literal_start = position
+
+    if literal_start < position:
+        _write_literals(output, stream[literal_start:position])
+
+    return output
+
+
+def encode_optimal(data):
+    """
+    GRF compression algorithm, choosing the sequence of literals and back-references
+    with the smallest output size.
+
+    This is slower than L{encode}, but produces smaller output.
+
+    @param data: Uncompressed data.
+    @type  data: C{str}, C{bytearray}, C{bytes} or similar.
+
+    @return: Compressed data.
+    @rtype:  C{array}
+    """
+    stream = bytes(data)
+    stream_len = len(stream)
+    matches = [_longest_match(stream, position) for position in range(stream_len)]
+
+    # cost[i] is the minimal size of the compressed data from position i to the end.
+    # step[i] is the number of bytes encoded by the first back-reference (positive)
+    # or literal run (negative) from position i in that compressed data.
+    cost = [0] * (stream_len + 1)
+    step = [0] * stream_len
+    # Positions j after the current one, ordered by increasing j + cost[j], to find the cheapest literal run.
+    literal_ends = collections.deque()
+    for position in range(stream_len - 1, -1, -1):
+        end = position + 1
+        while literal_ends and literal_ends[-1] + cost[literal_ends[-1]] >= end + cost[end]:
+            literal_ends.pop()
+        literal_ends.append(end)
+        if literal_ends[0] > position + MAX_LITERAL:
+            literal_ends.popleft()
+
+        best_end = literal_ends[0]
+        best_cost = 1 + best_end - position + cost[best_end]
+        best_step = position - best_end
+
+        length = matches[position][0]
+        if length > 0:
+            # Any shorter back-reference at the same distance is valid as well.
+            end_costs = cost[position + MIN_MATCH : position + length + 1]
+            end_cost = min(end_costs)
+            if 2 + end_cost <= best_cost:
+                best_cost = 2 + end_cost
+                best_step = MIN_MATCH + end_costs.index(end_cost)
+        cost[position] = best_cost
+        step[position] = best_step
+
+    output = array.array("B")
+    position = 0
+    while position < stream_len:
+        length = step[position]
+        if length > 0:
+            _write_reference(output, length, matches[position][1])
+            position += length
+        else:
+            _write_literals(output, stream[position : position - length])
+            position -= length
+
+    return output
+
+
 """
 True if the encoding is provided by a native module.
 Used for verbose information.
@@ -86,4 +250,4 @@ try:
 
     is_native = True
 except ImportError:
-    encode = _encode
+    encode = _encode_greedy
@@ -14,19 +14,23 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
 import codecs
+import glob
 import optparse
 import os
 import sys
+import time
 
 from nml import (
     generic,
     global_constants,
     grfstrings,
+    metrics,
     output_dep,
     output_grf,
     output_nfo,
     output_nml,
     palette,
+    parsecache,
     parser,
     spritecache,
     spriteencoder,
@@ -34,10 +38,11 @@ from nml import (
 )
 from nml.actions import (
     action0,
+    action0properties,
     action1,
     action2,
-    action2layout,
     action2var,
+    action3,
     action4,
     action6,
     action7,
@@ -47,7 +52,8 @@ from nml.actions import (
     real_sprite,
     sprite_count,
 )
-from nml.ast import grf
+from nml.ast import grf, item, sprite_container, townnames
+from nml.expression import base_expression
 
 try:
     from PIL import Image
@@ -58,6 +64,9 @@ except ImportError:
 
 developmode = False  # Give 'nice' error message instead of a stack dump.
 
+# Seconds between checks for changed input files in watch mode
+WATCH_INTERVAL = 0.5
+
 version = version_info.get_nml_version()
 
 
@@ -91,6 +100,17 @@ def parse_cli(argv):
         allow_32bpp=True,
         disable_palette_validation=False,
         list_unused_strings=False,
+        jobs=1,
+        optimal_compression=False,
+        deduplicate_sprites=False,
+        cache_format="files",
+        cache_validation="mtime",
+        cache_size=None,
+        cache_compact=False,
+        incremental=False,
+        watch=False,
+        metrics_json=None,
+        image_memory=256,
     )
     opt_parser.add_option("-d", "--debug", action="store_true", dest="debug", help="write the AST to stdout")
     opt_parser.add_option("-s", "--stack", action="store_true", dest="stack", help="Dump stack when an error occurs")
@@ -124,6 +144,18 @@ def parse_cli(argv):
         "-c", action="store_true", dest="crop", help="crop extraneous transparent blue from real sprites"
     )
     opt_parser.add_option("-u", action="store_false", dest="compress", help="save uncompressed data in the grf file")
+    opt_parser.add_option(
+        "--optimal-compression",
+        action="store_true",
+        dest="optimal_compression",
+        help="compress real sprites as small as possible, which is slower",
+    )
+    opt_parser.add_option(
+        "--deduplicate-sprites",
+        action="store_true",
+        dest="deduplicate_sprites",
+        help="write identical real sprites only once to the grf file",
+    )
     opt_parser.add_option("--nml", dest="nml_filename", metavar="<file>", help="write optimized nml to <file>")
     opt_parser.add_option(
         "-o", "--output", dest="outputs", action="append", metavar="<file>", help="write output(nfo/grf) to <file>"
@@ -189,6 +221,74 @@ def parse_cli(argv):
         dest="keep_orphaned",
         help="Remove unused/orphaned items from cache files.",
     )
+    opt_parser.add_option(
+        "--cache-format",
+        dest="cache_format",
+        metavar="<format>",
+        choices=["files", "pack"],
+        help=(
+            "Store cached sprites in a pair of files per source image ('files'),"
+            " or in a single pack file ('pack') [default: %default]"
+        ),
+    )
+    opt_parser.add_option(
+        "--cache-validation",
+        dest="cache_validation",
+        metavar="<method>",
+        choices=["mtime", "hash"],
+        help=(
+            "Check whether cached sprites are up to date by the modification time ('mtime'),"
+            " or by the contents ('hash') of the source images [default: %default]"
+        ),
+    )
+    opt_parser.add_option(
+        "--cache-size",
+        type="int",
+        dest="cache_size",
+        metavar="<MiB>",
+        help="Limit the size of the sprite pack, by removing the least recently used sprites",
+    )
+    opt_parser.add_option(
+        "--cache-compact",
+        action="store_true",
+        dest="cache_compact",
+        help="Remove unused data, and the sprites of deleted image files, from the sprite pack. "
+        "May be used without input file.",
+    )
+    opt_parser.add_option(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help="Cache the parsed input file, and only parse the parts that changed since the previous compilation.",
+    )
+    opt_parser.add_option(
+        "--watch",
+        action="store_true",
+        dest="watch",
+        help="Keep running, and compile again when the input file, language files or graphics change.",
+    )
+    opt_parser.add_option(
+        "--image-memory",
+        type="int",
+        dest="image_memory",
+        metavar="<MiB>",
+        help="Keep at most <MiB> of decoded source images in memory while encoding sprites [default: %default]",
+    )
+    opt_parser.add_option(
+        "--metrics-json",
+        dest="metrics_json",
+        metavar="<file>",
+        help="Write the time, growth of the peak memory use and net allocated memory blocks of each processing step,"
+        " counters of the sprite encoder and the usage of the id pools as JSON to <file>",
+    )
+    opt_parser.add_option(
+        "-j",
+        "--jobs",
+        type="int",
+        dest="jobs",
+        metavar="<num>",
+        help="Encode sprites and parse language files in <num> parallel processes [default: %default]",
+    )
     opt_parser.add_option(
         "--verbosity",
         type="int",
@@ -235,14 +335,27 @@ def parse_cli(argv):
     generic.Warning.disabled = opts.disable_warning
     generic.set_cache_root_dir(None if opts.no_cache else opts.cache_dir)
     spritecache.keep_orphaned = opts.keep_orphaned
+    spritecache.cache_format = opts.cache_format
+    spritecache.cache_validation = opts.cache_validation
+    spritecache.max_pack_size = None if opts.cache_size is None else opts.cache_size * 1024 * 1024
+    spriteencoder.max_image_memory = opts.image_memory * 1024 * 1024
+    parsecache.enabled = opts.incremental
     global_constants.allow_extra_zoom = opts.allow_extra_zoom
     global_constants.allow_32bpp = opts.allow_32bpp
 
+    if opts.jobs < 1:
+        opt_parser.error("Error: the number of jobs must be at least 1")
+    if opts.watch and not args:
+        opt_parser.error("Error: --watch requires an input file")
+
     opts.outputfile_given = (
         opts.grf_filename or opts.nfo_filename or opts.nml_filename or opts.dep_filename or opts.outputs
     )
 
     if not args:
+        if opts.cache_compact and not opts.outputfile_given:
+            # Only compact the sprite pack
+            return opts, None
         if not opts.outputfile_given:
             opt_parser.print_help()
             sys.exit(2)
@@ -265,14 +378,65 @@ def main(argv):
     if opts.stack:
         developmode = True
 
+    if input_filename is None and opts.cache_compact and not opts.outputfile_given:
+        spritecache.compact_pack()
+        sys.exit(0)
+
+    if opts.watch:
+        watch(opts, input_filename)
+
+    if opts.metrics_json is not None:
+        metrics.start()
+    read_languages(opts)
+    ret = compile_file(opts, input_filename)
+    if opts.metrics_json is not None:
+        metrics.write(opts.metrics_json)
+
+    if opts.list_unused_strings:
+        grfstrings.list_unused_strings()
+    if opts.cache_compact:
+        spritecache.compact_pack()
+    sys.exit(ret)
+
+
+def read_languages(opts):
+    """
+    Read the custom tags and the language files.
+
+    @param opts: Command line options.
+    @type  opts: C{Object}
+    """
     grfstrings.read_extra_commands(opts.custom_tags)
 
     generic.print_progress("Reading lang ...")
 
-    grfstrings.read_lang_files(opts.lang_dir, opts.default_lang)
+    grfstrings.read_lang_files(opts.lang_dir, opts.default_lang, opts.jobs)
 
     generic.clear_progress()
 
+
+def compile_file(opts, input_filename, nml_parser=None, parse_cache=None, source_files=None):
+    """
+    Compile the input file to the outputs given on the command line.
+
+    @param opts: Command line options.
+    @type  opts: C{Object}
+
+    @param input_filename: Filename of the input file, C{None} to read from L{sys.stdin}.
+    @type  input_filename: C{str} or C{None}
+
+    @param nml_parser: Parser to use, or C{None} to create one, see L{nml}.
+    @type  nml_parser: L{NMLParser} or C{None}
+
+    @param parse_cache: Cache of the parsed input file to use, see L{nml}.
+    @type  parse_cache: L{ParseCache} or C{None}
+
+    @param source_files: Set to add the used source image files to, see L{nml}.
+    @type  source_files: C{set} or C{None}
+
+    @return: Exit code.
+    @rtype:  C{int}
+    """
     # We have to do the dependency check first or we might later have
     #   more targets than we asked for
     outputs = []
@@ -319,7 +483,7 @@ def main(argv):
         opts.forced_palette = "LEGACY"
 
     if opts.grf_filename:
-        outputs.append(output_grf.OutputGRF(opts.grf_filename))
+        outputs.append(output_grf.OutputGRF(opts.grf_filename, opts.deduplicate_sprites))
     if opts.nfo_filename:
         outputs.append(output_nfo.OutputNFO(opts.nfo_filename, opts.start_sprite_num))
     if opts.nml_filename:
@@ -329,7 +493,7 @@ def main(argv):
         outroot, outext = os.path.splitext(output)
         outext = outext.lower()
         if outext == ".grf":
-            outputs.append(output_grf.OutputGRF(output))
+            outputs.append(output_grf.OutputGRF(output, opts.deduplicate_sprites))
         elif outext == ".nfo":
             outputs.append(output_nfo.OutputNFO(output, opts.start_sprite_num))
         elif outext == ".nml":
@@ -340,25 +504,144 @@ def main(argv):
             generic.print_error("Unknown output format {}".format(outext))
             sys.exit(2)
 
-    ret = nml(
-        input,
-        input_filename,
-        opts.debug,
-        outputs,
-        opts.start_sprite_num,
-        opts.compress,
-        opts.crop,
-        opts.forced_palette,
-        opts.md5_filename,
-        opts.debug_parser,
-        opts.disable_palette_validation,
-    )
+    try:
+        ret = nml(
+            input,
+            input_filename,
+            opts.debug,
+            outputs,
+            opts.start_sprite_num,
+            opts.compress,
+            opts.crop,
+            opts.forced_palette,
+            opts.md5_filename,
+            opts.debug_parser,
+            opts.disable_palette_validation,
+            opts.jobs,
+            opts.optimal_compression,
+            nml_parser,
+            parse_cache,
+            source_files,
+        )
+    finally:
+        input.close()
+    return ret
 
-    input.close()
 
-    if opts.list_unused_strings:
-        grfstrings.list_unused_strings()
-    sys.exit(ret)
+def reset_state():
+    """
+    Reset the state that compiling a file leaves in the modules, to compile again in the same process.
+    The language files and the sprite caches stay loaded.
+    """
+    generic.reset()
+    global_constants.reset()
+    grfstrings.reset()
+    spritecache.reset()
+    base_expression.reset()
+    action0.reset()
+    action0properties.reset()
+    action1.reset()
+    action2.reset()
+    action2var.reset()
+    action3.reset()
+    action4.reset()
+    action6.reset()
+    action7.reset()
+    action11.reset()
+    actionF.reset()
+    real_sprite.reset()
+    grf.reset()
+    item.reset()
+    sprite_container.reset()
+    townnames.reset()
+
+
+def get_files_state(filenames):
+    """
+    Get the modification times of files, to find out whether they changed.
+
+    @param filenames: Names of the files.
+    @type  filenames: C{iterable} of C{str}
+
+    @return: Modification time of each file, C{None} for files that do not exist.
+    @rtype:  C{dict} mapping C{str} to C{int} or C{None}
+    """
+    state = {}
+    for filename in filenames:
+        try:
+            state[filename] = os.stat(filename).st_mtime_ns
+        except OSError:
+            state[filename] = None
+    return state
+
+
+def get_lang_files(opts):
+    """
+    Get the custom tags file and the language files.
+
+    @param opts: Command line options.
+    @type  opts: C{Object}
+
+    @return: Names of the files.
+    @rtype:  C{list} of C{str}
+    """
+    return [opts.custom_tags] + sorted(glob.glob(opts.lang_dir + os.sep + "*.lng"))
+
+
+def watch(opts, input_filename):
+    """
+    Compile the input file, and compile it again whenever it, the language files or the source images change.
+    The parser, the language files, the parsed input file and the sprite caches are kept in memory in between.
+    Only returns by an exception, stopping with Ctrl+C while waiting for changes exits the program.
+
+    @param opts: Command line options.
+    @type  opts: C{Object}
+
+    @param input_filename: Filename of the input file.
+    @type  input_filename: C{str}
+    """
+    spritecache.resident = True
+    nml_parser = parser.NMLParser(opts.debug_parser)
+    parse_cache = parsecache.ParseCache(input_filename)
+    if parsecache.enabled:
+        parse_cache.read_cache()
+
+    lang_state = None
+    while True:
+        if opts.metrics_json is not None:
+            metrics.start()
+        new_lang_state = get_files_state(get_lang_files(opts))
+        if new_lang_state != lang_state:
+            lang_state = new_lang_state
+            grfstrings.unload_languages()
+            try:
+                read_languages(opts)
+                langs_ok = True
+            except generic.ScriptError as ex:
+                generic.print_error(str(ex))
+                langs_ok = False
+
+        source_files = set()
+        if langs_ok:
+            reset_state()
+            start_time = time.time()
+            try:
+                compile_file(opts, input_filename, nml_parser, parse_cache, source_files)
+                generic.print_info("Compiled {} in {:.2f} s".format(input_filename, time.time() - start_time))
+                if opts.metrics_json is not None:
+                    metrics.write(opts.metrics_json)
+            except generic.ScriptError as ex:
+                generic.clear_progress()
+                generic.print_error(str(ex))
+            parse_cache.keep_parts()
+
+        state = get_files_state([input_filename] + sorted(source_files))
+        generic.print_info("Waiting for changes ...")
+        try:
+            while get_files_state(state) == state and get_files_state(get_lang_files(opts)) == lang_state:
+                time.sleep(WATCH_INTERVAL)
+        except KeyboardInterrupt:
+            sys.exit(0)
 
 
 def filename_output_from_input(name, ext):
@@ -377,6 +660,11 @@ def nml(
     md5_filename,
     debug_parser,
     disable_palette_validation,
+    jobs=1,
+    optimal_compression=False,
+    nml_parser=None,
+    parse_cache=None,
+    source_files=None,
 ):
     """
     Compile an NML file.
@@ -405,6 +693,21 @@ def nml(
     @param md5_filename: Filename to use for writing the md5 sum of the grf file.
                          C{None} if the file should not be written.
     @type  md5_filename: C{str} or C{None}
+
+    @param jobs: Number of processes to use for encoding sprites.
+    @type  jobs: C{int}
+
+    @param optimal_compression: Compress sprites as small as possible, instead of as fast as possible.
+    @type  optimal_compression: C{bool}
+
+    @param nml_parser: Parser to parse the input file with, C{None} to create one.
+    @type  nml_parser: L{NMLParser} or C{None}
+
+    @param parse_cache: Cache of the parsed input file, C{None} to create one if L{parsecache.enabled}.
+    @type  parse_cache: L{ParseCache} or C{None}
+
+    @param source_files: If not C{None}, the source image files of the real sprites are added to this set.
+    @type  source_files: C{set} or C{None}
     """
     generic.OnlyOnce.clear()
 
@@ -423,13 +726,25 @@ def nml(
 
     generic.print_progress("Init parser ...")
 
-    nml_parser = parser.NMLParser(debug_parser)
+    if nml_parser is None:
+        nml_parser = parser.NMLParser(debug_parser)
+    if parse_cache is None and parsecache.enabled and input_filename is not None:
+        parse_cache = parsecache.ParseCache(input_filename)
+        parse_cache.read_cache()
     if input_filename is None:
         input_filename = "input"
 
     generic.print_progress("Parsing ...")
 
-    result = nml_parser.parse(script, input_filename)
+    if parse_cache is None:
+        result = nml_parser.parse(script, input_filename)
+    else:
+        result = parse_cache.parse(nml_parser, script, input_filename)
+        if parsecache.enabled:
+            parse_cache.write_cache()
+        generic.print_info("Parts of the script taken from the parse cache: {:d}".format(parse_cache.hits))
+        metrics.add("parse_cache", "hits", parse_cache.hits)
+        metrics.add("parse_cache", "parts", len(parse_cache.used_parts))
     result.validate([])
 
     if output_debug > 0:
@@ -460,7 +775,7 @@ def nml(
 
     action8_index = -1
     for i in range(len(actions) - 1, -1, -1):
-        if isinstance(actions[i], (action2var.Action2Var, action2layout.Action2Layout)):
+        if isinstance(actions[i], action2.Action2):
             actions[i].resolve_tmp_storage()
         elif isinstance(actions[i], action8.Action8):
             action8_index = i
@@ -504,6 +819,9 @@ def nml(
                 key = (file, mask_file)
                 sprite_files.setdefault(key, []).append(sprite)
 
+    if source_files is not None:
+        source_files.update(f for f_pair in sprite_files for f in f_pair if f is not None)
+
     # Check whether we can terminate sprite processing prematurely for
     #     dependency checks
     skip_sprite_processing = True
@@ -571,7 +889,9 @@ def nml(
         outputfile.palette = used_palette  # used by RecolourSpriteAction
         if isinstance(outputfile, output_grf.OutputGRF):
             if encoder is None:
-                encoder = spriteencoder.SpriteEncoder(compress_grf, crop_sprites, used_palette)
+                encoder = spriteencoder.SpriteEncoder(
+                    compress_grf, crop_sprites, used_palette, jobs, optimal_compression
+                )
             outputfile.encoder = encoder
 
     generic.clear_progress()
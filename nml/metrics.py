@@ -0,0 +1,200 @@
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+"""
+Measurements of a compilation, written as JSON with --metrics-json.
+
+The processing steps are the ones reported by L{generic.print_progress}. For each step the wall clock time,
+the CPU time, how much the peak memory use of the process grew, and the net number of allocated memory blocks
+(allocated minus freed) are measured. The CPU time includes the worker processes of --jobs, which exit at the end
+of the step that uses them, except on Windows. The peak memory use itself never goes down, so it is only reported
+for the whole compilation. Counters of the other parts of the compiler are added with L{add}, and the usage of the
+id pools is collected when writing the file.
+"""
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from nml import generic, global_constants, version_info
+from nml.actions import action0, action2, action4, action6, action7, action11, actionF
+from nml.ast import grf
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory use and the CPU time of worker processes are not measured then
+    resource = None
+
+# Version of the format of the JSON file
+METRICS_FORMAT = 1
+
+"""
+Whether the compilation is measured, see L{start}.
+"""
+enabled = False
+
+# Measured processing steps, in the order they started
+phases = {}
+# Counters, by group and name
+counters = {}
+
+_start = None
+_current = None
+_previous_listener = None
+
+
+def get_peak_rss():
+    """
+    Get the peak resident memory use of this process.
+
+    @return: Peak memory use in bytes, or C{None} if it cannot be measured.
+    @rtype:  C{int} or C{None}
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_cpu_time():
+    """
+    Get the CPU time used by this process, and by its child processes that have exited.
+
+    @return: CPU time in seconds.
+    @rtype:  C{float}
+    """
+    if resource is None:
+        return time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def _sample():
+    return {
+        "wall": time.perf_counter(),
+        "cpu": get_cpu_time(),
+        "peak_rss": get_peak_rss(),
+        "blocks": sys.getallocatedblocks(),
+        "collections": sum(stats["collections"] for stats in gc.get_stats()),
+    }
+
+
+def _end_phase():
+    global _current
+    if _current is None:
+        return
+    name, begin = _current
+    end = _sample()
+    phase = phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "net_allocated_blocks": 0, "gc_collections": 0})
+    phase["wall"] += end["wall"] - begin["wall"]
+    phase["cpu"] += end["cpu"] - begin["cpu"]
+    phase["net_allocated_blocks"] += end["blocks"] - begin["blocks"]
+    phase["gc_collections"] += end["collections"] - begin["collections"]
+    if end["peak_rss"] is not None:
+        phase["peak_rss_increase"] = phase.get("peak_rss_increase", 0) + end["peak_rss"] - begin["peak_rss"]
+    if tracemalloc.is_tracing():
+        phase["traced_peak"] = max(phase.get("traced_peak", 0), tracemalloc.get_traced_memory()[1])
+    _current = None
+
+
+def _progress(msg):
+    _end_phase()
+    if msg is not None:
+        global _current
+        if msg.endswith(" ..."):
+            msg = msg[: -len(" ...")]
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        _current = (msg, _sample())
+    if _previous_listener is not None:
+        _previous_listener(msg)
+
+
+def start():
+    """
+    Start measuring a compilation, forgetting the measurements of a previous one.
+    """
+    global enabled, _start, _current, _previous_listener
+    if not enabled:
+        _previous_listener = generic.progress_listener
+        generic.progress_listener = _progress
+    enabled = True
+    phases.clear()
+    counters.clear()
+    _current = None
+    _start = _sample()
+
+
+def add(group, name, value):
+    """
+    Add to a counter. Does nothing if the compilation is not measured.
+
+    @param group: Part of the compiler the counter belongs to.
+    @type  group: C{str}
+
+    @param name: Name of the counter.
+    @type  name: C{str}
+
+    @param value: Amount to add.
+    @type  value: C{int} or C{float}
+    """
+    if enabled:
+        group_counters = counters.setdefault(group, {})
+        group_counters[name] = group_counters.get(name, 0) + value
+
+
+def get_id_pools():
+    """
+    Get the usage of the pools of ids, the same numbers as reported by the print_stats functions.
+
+    @return: Number of used ids and size of each pool, by name.
+    @rtype:  C{dict} mapping C{str} to C{dict}
+    """
+    pools = {}
+    for module in (action0, actionF, action7, action2, action6, grf, global_constants, action4, action11):
+        for name, used, total, _ in module.get_stats():
+            pools[name] = {"used": used, "total": total}
+    return pools
+
+
+def write(filename):
+    """
+    Stop measuring, and write the measurements to a file.
+
+    @param filename: Name of the file.
+    @type  filename: C{str}
+    """
+    _end_phase()
+    end = _sample()
+    add("constants", "lookups", global_constants.const_table.lookups)
+    add("constants", "hits", global_constants.const_table.hits)
+    result = {
+        "format": METRICS_FORMAT,
+        "nml_version": version_info.get_nml_version(),
+        "wall": end["wall"] - _start["wall"],
+        "cpu": end["cpu"] - _start["cpu"],
+        "peak_rss": get_peak_rss(),
+        "net_allocated_blocks": end["blocks"] - _start["blocks"],
+        "gc_collections": end["collections"] - _start["collections"],
+        "phases": [dict(name=name, **phase) for name, phase in phases.items()],
+        "counters": counters,
+        "id_pools": get_id_pools(),
+    }
+    with open(filename, "w", encoding="utf-8") as metrics_file:
+        json.dump(result, metrics_file, indent=2)
@@ -105,6 +105,19 @@ class Operator:
     def __call__(self, expr1, expr2, pos=None):
         return binop.BinOp(self, expr1, expr2, pos)
 
+    def get_name(self):
+        """
+        Get the name of the operator in this module. Operators are compared by identity,
+        so the parse cache stores them by name.
+
+        @return: Name of the operator.
+        @rtype:  C{str}
+        """
+        for name, value in globals().items():
+            if value is self:
+                return name
+        raise TypeError("Operator is not defined in module nmlop")
+
 
 def unsigned_rshift(a, b):
     if a < 0:
@@ -18,6 +18,10 @@ Abstract base classes that implements common functionality for output classes
 """
 import array
 import io
+import os
+import shutil
+import struct
+import tempfile
 
 
 class OutputBase:
@@ -234,6 +238,31 @@ class SpriteOutputBase(OutputBase):
         """
         raise NotImplementedError("Implement print_dwordx() in {}".format(type(self)))
 
+    def print_bytes(self, values, line_length=None):
+        """
+        Output a sequence of unsigned bytes.
+
+        @param values: Values to output.
+        @type  values: C{list}, C{bytes} or similar sequence of C{int}.
+
+        @param line_length: Start a new line after every this many values, if not C{None}.
+        @type  line_length: C{int} or C{None}
+        """
+        for i, value in enumerate(values):
+            if line_length is not None and i > 0 and i % line_length == 0:
+                self.newline()
+            self.print_bytex(value)
+
+    def print_words(self, values):
+        """
+        Output a sequence of unsigned words.
+
+        @param values: Values to output.
+        @type  values: C{list} or similar sequence of C{int}.
+        """
+        for value in values:
+            self.print_wordx(value)
+
     def newline(self, msg="", prefix="\t"):
         """
         Output a line separator, prefixed with L{prefix}, C{"// "}, and the
@@ -303,10 +332,20 @@ class TextOutputBase(OutputBase):
 class BinaryOutputBase(SpriteOutputBase):
     """
     Class for binary output.
+
+    Values are range checked once each, as in L{SpriteOutputBase.prepare_byte} and friends, and the bytes of
+    a sprite are counted once at the end of the sprite, instead of for every value written.
+
+    @ivar sprite_start: Position in L{file} where the current sprite starts.
+    @type sprite_start: C{int}
     """
 
+    word_struct = struct.Struct("<H")
+    dword_struct = struct.Struct("<I")
+
     def __init__(self, filename):
         SpriteOutputBase.__init__(self, filename)
+        self.sprite_start = 0
 
     def open(self):
         self.file = array.array("B")
@@ -314,40 +353,114 @@ class BinaryOutputBase(SpriteOutputBase):
     def newline(self, msg="", prefix="\t"):
         pass
 
+    def start_sprite(self, expected_size, is_real_sprite=False):
+        SpriteOutputBase.start_sprite(self, expected_size, is_real_sprite)
+        self.sprite_start = len(self.file)
+
+    def end_sprite(self):
+        self.byte_count = len(self.file) - self.sprite_start
+        SpriteOutputBase.end_sprite(self)
+
     def print_data(self, data):
         """
         Print a chunk of data in one go
 
         @param data: Data to output
-        @type data: C{array}
+        @type data: C{array}, C{bytes} or similar.
         """
-        self.byte_count += len(data)
-        self.file.extend(data)
+        self.file.frombytes(data)
 
-    def wb(self, byte):
-        self.file.append(byte)
+    def print_bytes(self, values, line_length=None):
+        assert self.in_sprite
+        try:
+            data = bytes(values)
+        except ValueError:
+            # Negative values, or values out of range
+            assert all(-0x80 <= value <= 0xFF for value in values)
+            data = bytes(value & 0xFF for value in values)
+        self.file.frombytes(data)
+
+    def print_words(self, values):
+        assert self.in_sprite
+        assert all(-0x8000 <= value <= 0xFFFF for value in values)
+        self.file.frombytes(struct.pack("<{:d}H".format(len(values)), *[value & 0xFFFF for value in values]))
 
     def print_byte(self, value):
-        value = self.prepare_byte(value)
-        self.wb(value)
+        assert self.in_sprite
+        assert -0x80 <= value <= 0xFF
+        self.file.append(value & 0xFF)
 
     def print_bytex(self, value, pretty_print=None):
-        self.print_byte(value)
+        assert self.in_sprite
+        assert -0x80 <= value <= 0xFF
+        self.file.append(value & 0xFF)
 
     def print_word(self, value):
-        value = self.prepare_word(value)
-        self.wb(value & 0xFF)
-        self.wb(value >> 8)
+        assert self.in_sprite
+        assert -0x8000 <= value <= 0xFFFF
+        self.file.frombytes(self.word_struct.pack(value & 0xFFFF))
 
     def print_wordx(self, value):
         self.print_word(value)
 
     def print_dword(self, value):
-        value = self.prepare_dword(value)
-        self.wb(value & 0xFF)
-        self.wb((value >> 8) & 0xFF)
-        self.wb((value >> 16) & 0xFF)
-        self.wb(value >> 24)
+        assert self.in_sprite
+        assert -0x80000000 <= value <= 0xFFFFFFFF
+        self.file.frombytes(self.dword_struct.pack(value & 0xFFFFFFFF))
 
     def print_dwordx(self, value):
         self.print_dword(value)
+
+
+class SpooledBinaryOutputBase(BinaryOutputBase):
+    """
+    Class for binary output, that is moved to a temporary file after each sprite instead of kept in memory.
+    The temporary file is created next to L{filename}, and removed automatically.
+    Use L{copy_to} to copy the output to the real output file.
+
+    @ivar spool_file: Temporary file with the output of the finished sprites, if opened.
+    @type spool_file: C{file} or C{None}
+    """
+
+    def __init__(self, filename):
+        BinaryOutputBase.__init__(self, filename)
+        self.spool_file = None
+
+    def open(self):
+        BinaryOutputBase.open(self)
+        self.spool_file = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.filename)))
+
+    def flush(self):
+        """
+        Move the output in memory to the temporary file.
+        """
+        self.file.tofile(self.spool_file)
+        self.sprite_start -= len(self.file)
+        del self.file[:]
+
+    def print_data(self, data):
+        # Large chunks of data go to the temporary file directly, without copying them in memory first
+        self.flush()
+        self.sprite_start -= len(data)
+        self.spool_file.write(data)
+
+    def end_sprite(self):
+        BinaryOutputBase.end_sprite(self)
+        self.flush()
+
+    def copy_to(self, real_file):
+        """
+        Copy all output to another file.
+
+        @param real_file: File to copy the output to.
+        @type  real_file: C{file}
+        """
+        self.flush()
+        self.spool_file.seek(0)
+        shutil.copyfileobj(self.spool_file, real_file, 1 << 20)
+
+    def discard(self):
+        BinaryOutputBase.discard(self)
+        if self.spool_file is not None:
+            self.spool_file.close()
+            self.spool_file = None
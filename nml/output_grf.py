@@ -16,20 +16,35 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 import hashlib
 import os
 
-from nml import generic, grfstrings, output_base
+from nml import generic, grfstrings, metrics, output_base
 
 
 class OutputGRF(output_base.BinaryOutputBase):
-    def __init__(self, filename):
+    """
+    Output to a GRF file, in the container format version 2.
+    The pseudo sprites and the references to the real sprites are written to the data section in L{file},
+    the data of the real sprites to the sprite section in L{sprite_output}.
+
+    @ivar deduplicate_sprites: Write the data of identical real sprites only once, and refer to it from all uses.
+    @type deduplicate_sprites: C{bool}
+
+    @ivar sprite_ids: Sprite id in the sprite section of each written real sprite, by digest of its data.
+    @type sprite_ids: C{dict} mapping C{bytes} to C{int}
+    """
+
+    def __init__(self, filename, deduplicate_sprites=False):
         output_base.BinaryOutputBase.__init__(self, filename)
         self.encoder = None
-        self.sprite_output = output_base.BinaryOutputBase(filename + ".sprite.tmp")
+        # The sprite section holds most of the data, do not keep it in memory
+        self.sprite_output = output_base.SpooledBinaryOutputBase(filename)
         self.md5 = hashlib.md5()
         # sprite_num is deliberately off-by-one because it is used as an
         # id between data and sprite section. For the sprite section an id
         # of 0 is invalid (means end of sprites), and for a non-NewGRF GRF
         # the first sprite is a real sprite.
         self.sprite_num = 1
+        self.deduplicate_sprites = deduplicate_sprites
+        self.sprite_ids = {}
 
     def open_file(self):
         # Remove / unlink the file, most useful for linux systems
@@ -71,7 +86,7 @@ class OutputGRF(output_base.BinaryOutputBase):
         real_file.write(self.file)
         self.md5.update(self.file)
 
-        real_file.write(self.sprite_output.file)
+        self.sprite_output.copy_to(real_file)
 
     def open(self):
         output_base.BinaryOutputBase.open(self)
@@ -81,41 +96,21 @@ class OutputGRF(output_base.BinaryOutputBase):
         output_base.BinaryOutputBase.close(self)
         self.sprite_output.discard()
 
-    def _print_utf8(self, char, stream):
-        for c in chr(char).encode("utf8"):
-            stream.print_byte(c)
-
     def print_string(self, value, final_zero=True, force_ascii=False, stream=None):
         if stream is None:
             stream = self
 
-        if not grfstrings.is_ascii_string(value):
-            if force_ascii:
-                raise generic.ScriptError("Expected ascii string but got a unicode string")
-            stream.print_byte(0xC3)
-            stream.print_byte(0x9E)
-        i = 0
-        while i < len(value):
-            if value[i] == "\\":
-                if value[i + 1] in ("\\", '"'):
-                    stream.print_byte(ord(value[i + 1]))
-                    i += 2
-                elif value[i + 1] == "U":
-                    self._print_utf8(int(value[i + 2 : i + 6], 16), stream)
-                    i += 6
-                else:
-                    stream.print_byte(int(value[i + 1 : i + 3], 16))
-                    i += 3
-            else:
-                self._print_utf8(ord(value[i]), stream)
-                i += 1
+        data, is_ascii = grfstrings.encode_string(value)
+        if force_ascii and not is_ascii:
+            raise generic.ScriptError("Expected ascii string but got a unicode string")
+        stream.print_bytes(data)
         if final_zero:
             stream.print_byte(0)
 
     def comment(self, msg):
         pass
 
-    def start_sprite(self, size, is_real_sprite=False):
+    def start_sprite(self, size, is_real_sprite=False, sprite_id=None):
         if is_real_sprite:
             # Real sprite, this means no data is written to the data section
             # This call is still needed to open 'output mode'
@@ -123,7 +118,7 @@ class OutputGRF(output_base.BinaryOutputBase):
             output_base.BinaryOutputBase.start_sprite(self, 9)
             self.print_dword(4)
             self.print_byte(0xFD)
-            self.print_dword(self.sprite_num)
+            self.print_dword(self.sprite_num if sprite_id is None else sprite_id)
         else:
             output_base.BinaryOutputBase.start_sprite(self, size + 5)
             self.print_dword(size)
@@ -134,12 +129,36 @@ class OutputGRF(output_base.BinaryOutputBase):
         @param sprite_list: List of non-empty real sprites for various bit depths / zoom levels
         @type  sprite_list: C{list} of L{RealSprite}
         """
+        sprites = [self.get_single_sprite(sprite) for sprite in sprite_list]
+        if self.deduplicate_sprites:
+            # The sprite section is looked up by sprite id, so a sprite id may be referred to more than once
+            digest = hashlib.blake2b(digest_size=16)
+            for header, compressed_data in sprites:
+                # Include the length, so the data of the alternatives can not be split differently
+                digest.update(repr((header, len(compressed_data))).encode("ascii"))
+                digest.update(compressed_data)
+            sprite_id = self.sprite_ids.setdefault(digest.digest(), self.sprite_num)
+            if sprite_id != self.sprite_num:
+                metrics.add("grf", "deduplicated_sprites", 1)
+                self.start_sprite(0, True, sprite_id)
+                self.end_sprite()
+                return
+
         self.start_sprite(0, True)
-        for sprite in sprite_list:
-            self.print_single_sprite(sprite)
+        for header, compressed_data in sprites:
+            self.print_single_sprite(header, compressed_data)
         self.end_sprite()
 
-    def print_single_sprite(self, sprite_info):
+    def get_single_sprite(self, sprite_info):
+        """
+        Get the encoded data of a real sprite, and report the warnings of encoding it.
+
+        @param sprite_info: Real sprite.
+        @type  sprite_info: L{RealSprite}
+
+        @return: Size, offsets, info byte and zoom level of the sprite, and the compressed data.
+        @rtype:  C{tuple} of (C{tuple} of C{int}) and C{bytearray}
+        """
         assert sprite_info.file is not None or sprite_info.mask_file is not None
 
         # Position for warning messages
@@ -156,8 +175,12 @@ class OutputGRF(output_base.BinaryOutputBase):
         for w in warnings:
             generic.print_warning(generic.Warning.GENERIC, w, pos_warning)
 
+        return (size_x, size_y, xoffset, yoffset, info_byte, sprite_info.zoom_level), compressed_data
+
+    def print_single_sprite(self, header, compressed_data):
+        size_x, size_y, xoffset, yoffset, info_byte, zoom_level = header
         self.sprite_output.start_sprite(len(compressed_data) + 18)
-        self.wsprite_header(size_x, size_y, len(compressed_data), xoffset, yoffset, info_byte, sprite_info.zoom_level)
+        self.wsprite_header(size_x, size_y, len(compressed_data), xoffset, yoffset, info_byte, zoom_level)
         self.sprite_output.print_data(compressed_data)
         self.sprite_output.end_sprite()
 
@@ -193,11 +216,10 @@ class OutputGRF(output_base.BinaryOutputBase):
         )  # ASCII filenames seems sufficient.
         with open(generic.find_file(filename), "rb") as file:
             while True:
-                data = file.read(1024)
+                data = file.read(1 << 16)
                 if len(data) == 0:
                     break
-                for d in data:
-                    self.sprite_output.print_byte(d)
+                self.sprite_output.print_data(data)
 
         self.sprite_output.end_sprite()
         self.end_sprite()
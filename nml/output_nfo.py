@@ -89,19 +89,16 @@ class OutputNFO(output_base.SpriteOutputBase):
     def print_string(self, value, final_zero=True, force_ascii=False):
         assert self.in_sprite
         self.file.write('"')
-        if not grfstrings.is_ascii_string(value):
+        data, is_ascii = grfstrings.encode_string(value)
+        if not is_ascii:
             if force_ascii:
                 raise generic.ScriptError("Expected ascii string but got a unicode string")
             self.file.write("Þ")  # b'\xC3\x9E'.decode('utf-8')
         self.file.write(value.replace('"', '\\"'))
-        self.byte_count += grfstrings.get_string_size(value, final_zero, force_ascii)
+        self.byte_count += len(data)
         self.file.write('" ')
         if final_zero:
             self.print_bytex(0)
-            # get_string_size already includes the final 0 byte
-            # but print_bytex also increases byte_count, so decrease
-            # it here by one to correct it.
-            self.byte_count -= 1
 
     def print_decimal(self, value):
         assert self.in_sprite
@@ -0,0 +1,399 @@
+__license__ = """
+NML is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+NML is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with NML; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
+
+import gc
+import hashlib
+import marshal
+import os
+import re
+import sys
+
+from nml import generic, global_constants, nmlop, unit, version_info
+from nml.ast import general, sprite_container
+
+"""
+Whether to cache the parsed blocks of the input file, see L{ParseCache}.
+"""
+enabled = False
+
+# String literals, comments and line directives are skipped, so brackets and semicolons in them are not counted.
+_split_pat = re.compile(r'"(?:[^"\\]|\\.)*"|//[^\n]*|/\*.*?\*/|^[ \t]*\#[^\n]*|[][{}();]', re.S | re.M)
+# An 'else' after a closing brace continues the same if-statement.
+_else_pat = re.compile(r"(?:\s|//[^\n]*|/\*.*?\*/)*else\b", re.S)
+# Parts are only split at the end of a line, so the column numbers of lexer errors are not affected.
+_line_end_pat = re.compile(r"[ \t\r]*(?://[^\n]*)?\n")
+_directive_pat = re.compile(r"^[ \t]*\#", re.M)
+
+_depth_change = {"{": 1, "(": 1, "[": 1, "}": -1, ")": -1, "]": -1}
+
+
+def split_blocks(text):
+    """
+    Split a script into parts that each hold one or more complete top-level blocks.
+    The text is not tokenized, the parts are only as good as the nesting of brackets in the script.
+    That is fine, as a script that is not split correctly fails to parse, and is then parsed as a whole.
+
+    @param text: Script to split.
+    @type  text: C{str}
+
+    @return: Parts of the script, that together form the complete script.
+    @rtype:  C{list} of C{str}
+    """
+    parts = []
+    start = 0
+    depth = 0
+    for match in _split_pat.finditer(text):
+        token = match.group()
+        change = _depth_change.get(token)
+        if change is not None:
+            depth += change
+            if depth != 0 or token != "}" or _else_pat.match(text, match.end()) is not None:
+                continue
+        elif token != ";" or depth != 0:
+            continue
+        line_end = _line_end_pat.match(text, match.end())
+        if line_end is not None:
+            parts.append(text[start : line_end.end()])
+            start = line_end.end()
+
+    if start < len(text):
+        if parts:
+            parts[-1] += text[start:]
+        else:
+            parts.append(text[start:])
+    return parts
+
+
+def _get_node_classes():
+    """
+    Get the classes of the objects that may be stored in the parse cache, by name.
+    These are the classes of the abstract syntax tree, the expressions and the sprites.
+
+    @return: Class, and whether objects restored from the cache have to be registered, by module and class name.
+    @rtype:  C{dict} mapping C{str} to C{tuple} of (C{type}, C{bool})
+    """
+    if not _node_classes:
+        for module_name, module in list(sys.modules.items()):
+            if module is None or not module_name.startswith(("nml.ast.", "nml.expression.", "nml.actions.")):
+                continue
+            for value in vars(module).values():
+                if isinstance(value, type) and value.__module__ == module_name:
+                    name = "{}.{}".format(module_name, value.__qualname__)
+                    _node_classes[name] = (value, hasattr(value, "register_cached"))
+    return _node_classes
+
+
+_node_classes = {}
+_plain_types = (type(None), bool, int, float, str)
+
+
+class _PartEncoder:
+    """
+    Convert the blocks of a part to nested tuples of plain values, that are stored with C{marshal}.
+    Line positions are stored relative to the start of the part.
+    That way the cached part can be used when lines before it are added or removed.
+
+    Every container and object is stored once, later uses refer to it by its index (in order of appearance).
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.indices = {}
+
+    def encode(self, value):
+        value_type = type(value)
+        if value_type in _plain_types:
+            return value
+        index = self.indices.get(id(value))
+        if index is not None:
+            return ("r", index)
+        self.indices[id(value)] = len(self.indices)
+
+        if value_type is list:
+            return ("l", tuple(self.encode(item) for item in value))
+        if value_type is tuple:
+            return ("t", tuple(self.encode(item) for item in value))
+        if value_type is set:
+            return ("s", tuple(self.encode(item) for item in value))
+        if value_type is dict:
+            return ("d", tuple(self.encode(key) for key in value), tuple(self.encode(item) for item in value.values()))
+        if value_type is generic.LinePosition:
+            if value.filename == self.start.filename and value.includes == self.start.includes:
+                return ("p", value.line_start - self.start.line_start)
+            return ("P", value.filename, value.line_start, self.encode(value.includes))
+        if value_type is nmlop.Operator:
+            return ("op", value.get_name())
+        if value_type is unit.Unit:
+            return ("u", value.name)
+        name = "{}.{}".format(value_type.__module__, value_type.__qualname__)
+        if _get_node_classes().get(name, (None,))[0] is not value_type:
+            raise TypeError("Can't store objects of type {} in the parse cache".format(name))
+        state = vars(value)
+        return ("o", name, tuple(state), tuple(self.encode(item) for item in state.values()))
+
+
+class _PartDecoder:
+    """
+    Rebuild the blocks of a part from the plain values made by L{_PartEncoder}.
+    Only the objects of L{_get_node_classes} are created, without running their constructors.
+    Blocks that register themselves when constructed are registered with their C{register_cached} method,
+    after the part has been rebuilt.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.includes = start.includes[:]
+        self.classes = _get_node_classes()
+        self.values = []
+        self.restored = []
+
+    def decode_part(self, data):
+        result = self.decode(marshal.loads(data))
+        for obj in self.restored:
+            obj.register_cached()
+        return result
+
+    def decode(self, data):
+        if type(data) in _plain_types:
+            return data
+        if type(data) is not tuple:
+            raise ValueError("Invalid parse cache data")
+        tag = data[0]
+        if tag == "r":
+            return self.values[data[1]]
+
+        # Mutable values are added to the values before their items, in the same order as they were encoded
+        values = self.values
+        if tag == "o":
+            cls, register = self.classes[data[1]]
+            value = cls.__new__(cls)
+            values.append(value)
+            state = vars(value)
+            for name, item in zip(data[2], data[3]):
+                if type(name) is not str:
+                    raise ValueError("Invalid attribute name")
+                state[name] = item if type(item) in _plain_types else self.decode(item)
+            if register:
+                self.restored.append(value)
+            return value
+        if tag == "p":
+            value = generic.LinePosition(self.start.filename, self.start.line_start + data[1], self.includes)
+            values.append(value)
+            return value
+        if tag == "l":
+            value = []
+            values.append(value)
+            value.extend(item if type(item) in _plain_types else self.decode(item) for item in data[1])
+            return value
+        if tag == "d":
+            value = {}
+            values.append(value)
+            keys = [self.decode(key) for key in data[1]]
+            value.update(zip(keys, (self.decode(item) for item in data[2])))
+            return value
+
+        index = len(values)
+        values.append(None)
+        if tag == "op":
+            value = getattr(nmlop, data[1])
+            if type(value) is not nmlop.Operator:
+                raise ValueError("Unknown operator")
+        elif tag == "t":
+            value = tuple(self.decode(item) for item in data[1])
+        elif tag == "s":
+            value = set(self.decode(item) for item in data[1])
+        elif tag == "P":
+            value = generic.LinePosition(data[1], data[2], self.decode(data[3]))
+        elif tag == "u":
+            value = unit.units[data[1]]
+        else:
+            raise ValueError("Invalid parse cache data")
+        values[index] = value
+        return value
+
+
+class ParseCache:
+    """
+    Cache of the parsed top-level blocks of an input file.
+
+    The script is split into parts of complete top-level blocks, and only parts that changed since the previous
+    compilation are parsed. All later steps (name registration, pre-processing, action generation) allocate
+    IDs and registers for the script as a whole, and are always done for the complete script.
+
+    @ivar sources: Source files the cache belongs to, i.e. the input file.
+    @type sources: C{tuple} of C{str}
+
+    @ivar cached_parts: Stored blocks and end position of the parts of the previous compilation, by key.
+    @type cached_parts: C{dict} mapping C{tuple} to C{bytes}
+
+    @ivar used_parts: Stored parts of the current compilation, by key.
+    @type used_parts: C{dict} mapping C{tuple} to C{bytes}
+
+    @ivar hits: Number of parts that were taken from the cache.
+    @type hits: C{int}
+    """
+
+    def __init__(self, input_filename):
+        self.sources = (input_filename,)
+        self.cached_parts = {}
+        self.used_parts = {}
+        self.hits = 0
+
+    def read_cache(self):
+        """
+        Read the cache file, an unusable cache file is ignored.
+        """
+        if generic.cache_root_dir is None:
+            return
+        try:
+            with generic.open_cache_file(self.sources, ".parsecache", "rb") as cache_file:
+                signature, parts = marshal.load(cache_file)
+        except Exception:
+            return
+        if signature == version_info.get_compiler_signature() and isinstance(parts, dict):
+            self.cached_parts = parts
+
+    def write_cache(self):
+        """
+        Write the parts of the current compilation to the cache file.
+        """
+        if generic.cache_root_dir is None:
+            return
+        try:
+            with generic.lock_cache_file(self.sources, ".parselock"):
+                with generic.open_cache_file(self.sources, ".parsecache.tmp", "wb") as cache_file:
+                    marshal.dump((version_info.get_compiler_signature(), self.used_parts), cache_file)
+                os.replace(cache_file.name, cache_file.name[: -len(".tmp")])
+        except OSError:
+            pass
+
+    def keep_parts(self):
+        """
+        Use the parts of the current compilation as the cache of the next compilation in the same process.
+        If the current compilation did not get that far, the cache stays as it is.
+        """
+        if self.used_parts:
+            self.cached_parts = self.used_parts
+        self.used_parts = {}
+        self.hits = 0
+
+    def parse(self, nml_parser, script, input_filename):
+        """
+        Parse a script, re-using the blocks of unchanged parts.
+
+        @param nml_parser: Parser to parse changed parts with.
+        @type  nml_parser: L{NMLParser}
+
+        @param script: Script to parse.
+        @type  script: C{str}
+
+        @param input_filename: Name of the input file.
+        @type  input_filename: C{str}
+
+        @return: Parsed script.
+        @rtype:  L{MainScript}
+        """
+        # Constructing blocks registers names, save the state to undo that when falling back to a full parse
+        refcount = dict(global_constants.identifier_refcount)
+        sprite_blocks = dict(sprite_container.SpriteContainer.sprite_blocks)
+        seen = dict(generic.OnlyOnce.seen)
+
+        position = generic.LinePosition(input_filename, 1)
+        statements = []
+        # Loading creates many long-lived objects and no garbage, collecting it in between only costs time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for part in split_blocks(script):
+                blocks, position = self.parse_part(nml_parser, part, position)
+                statements.extend(blocks)
+        except generic.ScriptError:
+            statements = None
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        if statements is None:
+            # Parse the script as a whole, so errors are reported exactly as without the cache
+            global_constants.identifier_refcount.clear()
+            global_constants.identifier_refcount.update(refcount)
+            sprite_container.SpriteContainer.sprite_blocks.clear()
+            sprite_container.SpriteContainer.sprite_blocks.update(sprite_blocks)
+            generic.OnlyOnce.seen = seen
+            self.used_parts = {}
+            return nml_parser.parse(script, input_filename)
+        return general.MainScript(statements)
+
+    def parse_part(self, nml_parser, part, start):
+        """
+        Get the blocks of a single part, from the cache if possible.
+
+        @param nml_parser: Parser to parse the part with, if it is not cached.
+        @type  nml_parser: L{NMLParser}
+
+        @param part: Text of the part.
+        @type  part: C{str}
+
+        @param start: Position of the start of the part.
+        @type  start: L{LinePosition}
+
+        @return: Blocks of the part, and the position at the end of the part.
+        @rtype:  C{tuple} of (C{list} of L{BaseStatement}, L{LinePosition})
+        """
+        key = (
+            hashlib.blake2b(part.encode("utf-8"), digest_size=16).digest(),
+            start.filename,
+            tuple((pos.filename, pos.line_start) for pos in start.includes),
+        )
+        if _directive_pat.search(part) is not None:
+            # Line directives set absolute line numbers, so the part is only valid at the same line
+            key += (start.line_start,)
+
+        data = self.cached_parts.get(key)
+        if data is None:
+            data = self.used_parts.get(key)
+        if data is not None:
+            try:
+                blocks, end, references = _PartDecoder(start).decode_part(data)
+            except generic.ScriptError:
+                raise
+            except Exception:
+                # Damaged cache entry, parse the part again
+                data = None
+        if data is not None:
+            self.hits += 1
+            self.used_parts[key] = data
+        else:
+            # Count the identifiers of this part separately, they are not all part of the blocks
+            refcount = global_constants.identifier_refcount
+            global_constants.identifier_refcount = {}
+            try:
+                blocks = nml_parser.parse(part, start.filename, start).statements
+                end = nml_parser.get_position()
+                references = {name: count + 1 for name, count in global_constants.identifier_refcount.items()}
+            finally:
+                global_constants.identifier_refcount = refcount
+            try:
+                self.used_parts[key] = marshal.dumps(_PartEncoder(start).encode((blocks, end, references)))
+            except TypeError:
+                # The part contains values that can not be stored, it is parsed again the next time
+                pass
+
+        for name, count in references.items():
+            if name in global_constants.identifier_refcount:
+                global_constants.identifier_refcount[name] += count
+            else:
+                global_constants.identifier_refcount[name] = count - 1
+        return blocks, end
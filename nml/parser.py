@@ -13,6 +13,14 @@ You should have received a copy of the GNU General Public License along
 with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import types
+
+from nml.ply import __version__ as ply_version
 from nml.ply import yacc
 
 from nml import expression, generic, nmlop, tokens, unit
@@ -60,20 +68,122 @@ class NMLParser:
     @type parser: L{ply.yacc}
     """
 
+    """
+    Name of the file with the parser tables, stored in the cache directory.
+    """
+    TABLES_FILE = "parsetab.dat"
+
     def __init__(self, debug=False):
         self.lexer = tokens.NMLLexer()
         self.lexer.build()
         self.tokens = self.lexer.tokens
-        self.parser = yacc.yacc(
-            module=self,
-            debug=debug,
-            optimize=not debug,
+        self.parser = None
+        if not debug:
+            self.parser = self.load_tables()
+        if self.parser is None:
+            self.parser = yacc.yacc(
+                module=self,
+                debug=debug,
+                optimize=not debug,
+            )
+            if not debug:
+                self.write_tables()
+
+    def get_table_path(self):
+        """
+        Get the location of the parser tables file.
+
+        @return: Path of the tables file, or C{None} if there is no cache directory.
+        @rtype:  C{str} or C{None}
+        """
+        if generic.cache_root_dir is None:
+            return None
+        return os.path.join(generic.cache_root_dir, self.TABLES_FILE)
+
+    def get_grammar_signature(self):
+        """
+        Get a signature of the grammar, the parser tables can only be used for the grammar they were built from.
+        Production rules are numbered in the order of their definition, so the order is included as well.
+
+        @return: Hash of the grammar.
+        @rtype:  C{bytes}
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((ply_version, sys.version_info[:2], self.tokens, self.precedence)).encode("utf-8"))
+        for name in dir(self):
+            if name.startswith("p_") and name != "p_error":
+                func = getattr(self, name)
+                digest.update(repr((name, func.__code__.co_firstlineno, func.__doc__)).encode("utf-8"))
+        return digest.digest()
+
+    def load_tables(self):
+        """
+        Create the parser from stored parser tables, without analysing the grammar.
+
+        @return: PLY parser, or C{None} if there are no valid parser tables for the current grammar.
+        @rtype:  L{ply.yacc.LRParser} or C{None}
+        """
+        path = self.get_table_path()
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as tables_file:
+                tables = marshal.load(tables_file)
+            if tables[0] != self.get_grammar_signature():
+                return None
+            productions = []
+            for number, (name, symbols, func) in enumerate(tables[1]):
+                production = yacc.Production(number, name, symbols, func=func)
+                if func is not None:
+                    production.callable = getattr(self, func)
+                productions.append(production)
+            lr_table = types.SimpleNamespace(lr_productions=productions, lr_action=tables[2], lr_goto=tables[3])
+        except (OSError, EOFError, ValueError, TypeError, IndexError, AttributeError):
+            return None
+        return yacc.LRParser(lr_table, self.p_error)
+
+    def write_tables(self):
+        """
+        Store the tables of the parser, so later runs can skip building them.
+        Failing to write them is not an error, the tables are just built again next time.
+        """
+        tables = (
+            self.get_grammar_signature(),
+            [(p.name, p.prod, p.func) for p in self.parser.productions],
+            self.parser.action,
+            self.parser.goto,
         )
-
-    def parse(self, text, input_filename):
-        self.lexer.setup(text, input_filename)
+        path = self.get_table_path()
+        if path is None:
+            return
+        tmp_name = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as tmp_file:
+                tmp_name = tmp_file.name
+                tmp_file.write(marshal.dumps(tables))
+            os.replace(tmp_name, path)
+        except OSError:
+            # Do not leave the temporary file behind
+            if tmp_name is not None:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+
+    def parse(self, text, input_filename, position=None):
+        self.lexer.setup(text, input_filename, position)
         return self.parser.parse(None, lexer=self.lexer.lexer)
 
+    def get_position(self):
+        """
+        Get the position the lexer has reached, i.e. the end of the parsed text.
+
+        @return: Current position of the lexer.
+        @rtype:  L{LinePosition}
+        """
+        return self.lexer.lexer.lineno
+
     # operator precedence (lower in the list = higher priority)
     precedence = (
         ("left", "COMMA"),
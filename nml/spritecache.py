@@ -14,13 +14,95 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
 import array
+import hashlib
 import json
+import mmap
 import os
+import struct
+import time
 
 from nml import generic
 
 keep_orphaned = True
 
+"""
+Storage format of the sprite cache, either 'files' for a pair of files per source image,
+or 'pack' for a single L{SpritePack}.
+"""
+cache_format = "files"
+
+"""
+Maximum size of the sprite pack in bytes, or C{None} for no limit.
+"""
+max_pack_size = None
+
+"""
+How to check whether cached sprites are up to date, either 'mtime' to compare the modification time of the
+source image files with the cache, or 'hash' to compare the contents of the source image files.
+"""
+cache_validation = "mtime"
+
+"""
+Keep the sprites of the cache files in memory, to compile again in the same process without reading
+the cache files that did not change, see L{SpriteCache.read_cache}.
+"""
+resident = False
+
+# Sprites kept in memory by sources and compression, with the state of the files they were read from
+_resident_caches = {}
+
+# Modification time and hash of the contents of source image files, computed once per file by get_source_digest
+_source_digests = {}
+
+
+def reset():
+    """
+    Forget the hashes of source image files that changed, to compile another file.
+    """
+    for filename, (mtime, digest) in list(_source_digests.items()):
+        try:
+            changed = os.stat(generic.find_file(filename)).st_mtime_ns != mtime
+        except (OSError, generic.ScriptError):
+            changed = True
+        if changed:
+            del _source_digests[filename]
+
+
+def get_source_digest(filename):
+    """
+    Get a hash of the contents of a source image file.
+
+    @param filename: Name of the image file.
+    @type  filename: C{str}
+
+    @return: Hash of the file contents.
+    @rtype:  C{bytes}
+    """
+    cached = _source_digests.get(filename)
+    if cached is not None:
+        return cached[1]
+    with open(generic.find_file(filename), "rb") as source_file:
+        mtime = os.fstat(source_file.fileno()).st_mtime_ns
+        digest = hashlib.blake2b(source_file.read(), digest_size=16).digest()
+    _source_digests[filename] = (mtime, digest)
+    return digest
+
+
+def get_sprite_digest(key):
+    """
+    Get a hash of the contents of the source image files of a cached sprite.
+
+    @param key: Cache key of the sprite, see L{SpriteCache}.
+    @type  key: C{tuple}
+
+    @return: Hash of the source image files.
+    @rtype:  C{bytes}
+    """
+    sprite_hash = hashlib.blake2b(digest_size=16)
+    for filename in (key[0], key[2]):
+        sprite_hash.update(b"\0" if filename is None else get_source_digest(filename))
+    return sprite_hash.digest()
+
 
 class SpriteCache:
     """
@@ -29,12 +111,21 @@ class SpriteCache:
     @ivar sources: Tuple of paths to files the cache belongs to or depends on.
     @type sources: C{tuple} of (C{str} or C{None})
 
+    @ivar optimal_compression: Whether the sprites are compressed with L{lz77.encode_optimal}.
+                               Cached sprites compressed differently are invalid.
+    @type optimal_compression: C{bool}
+
     @ivar cache_time: Date of cache files. The cache is invalid, if the source image files are newer.
+                      Not used if L{cache_validation} is 'hash'.
     @type cache_time: C{int}
 
     @ivar cached_sprites: Cache contents
     @type cached_sprites: C{dict} mapping cache keys to cache items.
 
+    @ivar index_keys: Keys of all sprites in the cache index when it was read, including invalid ones.
+                      Other sprites found in the index when writing were added by other processes.
+    @type index_keys: C{set} of C{tuple}
+
     Cache file format description:
         Format of cache index is JSON (JavaScript Object Notation), which is
         easily readable by both humans (for debugging) and machines. Format is as follows:
@@ -54,6 +145,9 @@ class SpriteCache:
               'anim':  Amount of animated pixels in 8bpp.
          - offset: Offset into the cache file for this sprite
          - size: Length of this sprite in the cache file
+         - optimal: True if the sprite is compressed with the optimal parse, not present otherwise
+         - source_hash: Hash of the contents of the source image files (hexadecimal string),
+              only present if the cache was written with 'hash' validation
 
         Either rgb_file/rect, mask_file/rect, or both must be specified, depending on the sprite
         The cache should contain the sprite data, but not the header (sizes/offsets and such)
@@ -79,10 +173,12 @@ class SpriteCache:
         are in the cacheindex file.
     """
 
-    def __init__(self, sources=()):
+    def __init__(self, sources=(), optimal_compression=False):
         self.sources = sources
+        self.optimal_compression = optimal_compression
         self.cache_time = 0
         self.cached_sprites = {}
+        self.index_keys = set()
 
     def get_item(self, cache_key, palette):
         """
@@ -134,22 +230,122 @@ class SpriteCache:
 
         return sum(not item[5] for item in self.cached_sprites.values())
 
+    def read_files(self):
+        """
+        Read the *.grf.cache[index] files. The caller should hold the cache lock, see L{lock}.
+
+        @return: Sprite data, date of the cache files, the undecoded index, and name of the index file.
+        @rtype:  C{tuple} of (C{array}, C{float}, C{str}, C{str})
+        """
+        with generic.open_cache_file(self.sources, ".cache", "rb") as cache_file:
+            cache_data = array.array("B")
+            cache_size = os.fstat(cache_file.fileno()).st_size
+            cache_data.fromfile(cache_file, cache_size)
+            assert cache_size == len(cache_data)
+            cache_time = os.path.getmtime(cache_file.name)
+
+        with generic.open_cache_file(self.sources, ".cacheindex", "r") as index_file:
+            return cache_data, cache_time, index_file.read(), index_file.name
+
+    def lock(self):
+        """
+        Get the lock of the cache files. Readers share the lock, writers hold it exclusively,
+        so concurrent nmlc processes never see the cache and index files of different writes.
+
+        @return: Lock of the cache files, not acquired yet.
+        @rtype:  L{generic.FileLock}
+        """
+        return generic.lock_cache_file(self.sources, ".cachelock")
+
+    @staticmethod
+    def parse_key(sprite):
+        """
+        Get the cache key of an entry of the cache index.
+
+        @param sprite: Entry of the cache index.
+        @type  sprite: C{dict}
+
+        @return: Cache key.
+        @rtype:  C{tuple}
+        """
+        assert isinstance(sprite, dict)
+        # load RGB (32bpp) data
+        rgb_key = (None, None)
+        if "rgb_file" in sprite and "rgb_rect" in sprite:
+            assert isinstance(sprite["rgb_file"], str)
+            assert isinstance(sprite["rgb_rect"], list) and len(sprite["rgb_rect"]) == 4
+            assert all(isinstance(num, int) for num in sprite["rgb_rect"])
+            rgb_key = (sprite["rgb_file"], tuple(sprite["rgb_rect"]))
+
+        # load Mask (8bpp) data
+        mask_key = (None, None)
+        if "mask_file" in sprite and "mask_rect" in sprite:
+            assert isinstance(sprite["mask_file"], str)
+            assert isinstance(sprite["mask_rect"], list) and len(sprite["mask_rect"]) == 4
+            assert all(isinstance(num, int) for num in sprite["mask_rect"])
+            mask_key = (sprite["mask_file"], tuple(sprite["mask_rect"]))
+
+        palette_key = None
+        if "mask_pal" in sprite:
+            palette_key = sprite["mask_pal"]
+
+        # Compose key
+        assert any(i is not None for i in rgb_key + mask_key)
+        return rgb_key + mask_key + ("crop" in sprite, palette_key)
+
+    def get_files_state(self):
+        """
+        Get the state of the cache files and the source image files, to check whether the sprites kept in memory
+        are up to date, see L{resident}.
+
+        @return: Modification time and size of the files, C{None} for files that do not exist.
+        @rtype:  C{tuple}
+        """
+        paths = [generic.cache_file_path(self.sources, extension) for extension in (".cache", ".cacheindex")]
+        paths.extend(generic.find_file(source) for source in self.sources if source is not None)
+        state = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                state.append(None)
+        return tuple(state)
+
     def read_cache(self):
+        """
+        Read the *.grf.cache[index] files, or take the sprites from memory if the files did not change
+        since they were read before, see L{resident}.
+        """
+        if not resident or generic.cache_root_dir is None or not any(self.sources):
+            self.read_cache_files()
+            return
+
+        key = (self.sources, self.optimal_compression)
+        state = self.get_files_state()
+        cached = _resident_caches.get(key)
+        if cached is None or cached[0] != state:
+            self.read_cache_files()
+            cached = (state, self.cache_time, dict(self.cached_sprites), frozenset(self.index_keys))
+            _resident_caches[key] = cached
+        else:
+            self.cache_time = cached[1]
+            self.cached_sprites = dict(cached[2])
+            self.index_keys = set(cached[3])
+
+    def read_cache_files(self):
         """
         Read the *.grf.cache[index] files.
         """
 
         try:
-            with generic.open_cache_file(self.sources, ".cache", "rb") as cache_file:
-                cache_data = array.array("B")
-                cache_size = os.fstat(cache_file.fileno()).st_size
-                cache_data.fromfile(cache_file, cache_size)
-                assert cache_size == len(cache_data)
-                self.cache_time = os.path.getmtime(cache_file.name)
-
-            with generic.open_cache_file(self.sources, ".cacheindex", "r") as index_file:
-                index_file_name = index_file.name
-                sprite_index = json.load(index_file)
+            lock = self.lock()
+            lock.acquire(exclusive=False)
+            try:
+                cache_data, self.cache_time, index_data, index_file_name = self.read_files()
+            finally:
+                lock.release()
+            sprite_index = json.loads(index_data)
         except OSError:
             # Cache files don't exist (or otherwise aren't readable)
             return
@@ -162,6 +358,7 @@ class SpriteCache:
             self.cached_sprites = {}
             return
 
+        cache_size = len(cache_data)
         source_mtime = {}
 
         try:
@@ -170,31 +367,10 @@ class SpriteCache:
             # Also, it doesn't make sense to inform the user about things he shouldn't know about and can't fix
             assert isinstance(sprite_index, list)
             for sprite in sprite_index:
-                assert isinstance(sprite, dict)
-                # load RGB (32bpp) data
-                rgb_key = (None, None)
-                if "rgb_file" in sprite and "rgb_rect" in sprite:
-                    assert isinstance(sprite["rgb_file"], str)
-                    assert isinstance(sprite["rgb_rect"], list) and len(sprite["rgb_rect"]) == 4
-                    assert all(isinstance(num, int) for num in sprite["rgb_rect"])
-                    rgb_key = (sprite["rgb_file"], tuple(sprite["rgb_rect"]))
-
-                # load Mask (8bpp) data
-                mask_key = (None, None)
-                if "mask_file" in sprite and "mask_rect" in sprite:
-                    assert isinstance(sprite["mask_file"], str)
-                    assert isinstance(sprite["mask_rect"], list) and len(sprite["mask_rect"]) == 4
-                    assert all(isinstance(num, int) for num in sprite["mask_rect"])
-                    mask_key = (sprite["mask_file"], tuple(sprite["mask_rect"]))
-
-                palette_key = None
-                if "mask_pal" in sprite:
-                    palette_key = sprite["mask_pal"]
-
-                # Compose key
-                assert any(i is not None for i in rgb_key + mask_key)
-                key = rgb_key + mask_key + ("crop" in sprite, palette_key)
-                assert key not in self.cached_sprites
+                key = self.parse_key(sprite)
+                assert key not in self.index_keys
+                self.index_keys.add(key)
+                rgb_file, rgb_rect, mask_file, mask_rect, do_crop, palette_key = key
 
                 # Read size/offset from cache
                 assert "offset" in sprite and "size" in sprite
@@ -225,26 +401,27 @@ class SpriteCache:
 
                 # Check if cache item is still valid
                 is_valid = True
-                if rgb_key[0] is not None:
-                    mtime = source_mtime.get(rgb_key[0])
-                    if mtime is None:
-                        mtime = os.path.getmtime(generic.find_file(rgb_key[0]))
-                        source_mtime[rgb_key[0]] = mtime
-
-                    if mtime > self.cache_time:
+                if cache_validation == "hash":
+                    if sprite.get("source_hash") != get_sprite_digest(key).hex():
                         is_valid = False
+                else:
+                    for filename in (rgb_file, mask_file):
+                        if filename is None:
+                            continue
+                        mtime = source_mtime.get(filename)
+                        if mtime is None:
+                            mtime = os.path.getmtime(generic.find_file(filename))
+                            source_mtime[filename] = mtime
 
-                if mask_key[0] is not None:
-                    mtime = source_mtime.get(mask_key[0])
-                    if mtime is None:
-                        mtime = os.path.getmtime(generic.find_file(mask_key[0]))
-                        source_mtime[mask_key[0]] = mtime
-
-                    if mtime > self.cache_time:
-                        is_valid = False
+                        if mtime > self.cache_time:
+                            is_valid = False
 
                 # Drop items from older spritecache format without palette entry
-                if (mask_key[0] is None) != (palette_key is None):
+                if (mask_file is None) != (palette_key is None):
+                    is_valid = False
+
+                # Drop items compressed differently, the output should not depend on the cache contents
+                if sprite.get("optimal", False) != self.optimal_compression:
                     is_valid = False
 
                 if is_valid:
@@ -256,6 +433,40 @@ class SpriteCache:
                 + " Please remove the file and file a bug report if this warning keeps appearing",
             )
             self.cached_sprites = {}  # Clear cache
+            self.index_keys = set()
+
+    def merge_cache(self, index_data, sprite_data):
+        """
+        Add the sprites that other processes wrote to the cache files since L{read_cache}.
+        The caller should hold the cache lock exclusively.
+
+        @param index_data: Entries of the cache index to write, extended by the entries of the other processes.
+        @type  index_data: C{list} of C{dict}
+
+        @param sprite_data: Sprite data to write, extended by the data of the other processes.
+        @type  sprite_data: C{array}
+        """
+        try:
+            cache_data, _, other_index_data, _ = self.read_files()
+            other_index = json.loads(other_index_data)
+            assert isinstance(other_index, list)
+            merged_index = []
+            merged_data = array.array("B")
+            for sprite in other_index:
+                key = self.parse_key(sprite)
+                if key in self.cached_sprites or key in self.index_keys:
+                    continue
+                offset, size = sprite["offset"], sprite["size"]
+                assert isinstance(offset, int) and isinstance(size, int)
+                assert offset >= 0 and size > 0 and offset + size <= len(cache_data)
+                sprite = dict(sprite, offset=len(sprite_data) + len(merged_data))
+                merged_index.append(sprite)
+                merged_data.extend(cache_data[offset : offset + size])
+        except Exception:
+            # Nothing to merge, or the cache files are broken, which read_cache reports
+            return
+        index_data.extend(merged_index)
+        sprite_data.extend(merged_data)
 
     def write_cache(self):
         """
@@ -301,6 +512,10 @@ class SpriteCache:
             if do_crop:
                 sprite["crop"] = tuple(crop_rect)
             sprite["pixel_stats"] = pixel_stats
+            if self.optimal_compression:
+                sprite["optimal"] = True
+            if cache_validation == "hash":
+                sprite["source_hash"] = get_sprite_digest(key).hex()
 
             index_data.append(sprite)
             sprite_data.extend(data)
@@ -309,13 +524,589 @@ class SpriteCache:
         if old_cache_valid:
             return
 
-        index_output = json.JSONEncoder(sort_keys=True).encode(index_data)
+        try:
+            # Write to temporary files, and replace the cache files at once while holding the lock.
+            # Readers never see a partially written cache, or cache and index files of different writes.
+            with self.lock():
+                if keep_orphaned:
+                    # Keep the sprites other processes added in the meantime, e.g. for other GRFs using this image
+                    self.merge_cache(index_data, sprite_data)
+                index_output = json.JSONEncoder(sort_keys=True).encode(index_data)
+
+                with generic.open_cache_file(self.sources, ".cache.tmp", "wb") as cache_file, generic.open_cache_file(
+                    self.sources, ".cacheindex.tmp", "w"
+                ) as index_file:
+                    index_file.write(index_output)
+                    sprite_data.tofile(cache_file)
+                os.replace(cache_file.name, cache_file.name[: -len(".tmp")])
+                os.replace(index_file.name, index_file.name[: -len(".tmp")])
+        except OSError:
+            return
+
+
+class SpritePack:
+    """
+    Cache for compressed sprites of all source images, stored in a single pack file.
+
+    The pack file holds the compressed data of the sprites, stored only once for identical data.
+    New data is appended to the end. The pack index describes the cached sprites, and refers to
+    their data by a hash of it. The pack file is memory-mapped, so cached data is not copied.
+
+    Data in the pack file that is no longer referred to by the index is only removed by L{compact}.
+    If the pack grows beyond L{max_size}, the least recently used sprites are removed from the index,
+    and the pack is compacted.
+
+    Several processes can use the pack at the same time. Data is only appended while holding the write lock,
+    and the index is replaced at once, after merging the sprites other processes wrote in the meantime.
+    Each process holds the use lock shared while it has the pack open. Compacting the pack moves the data,
+    so it requires the use lock exclusively, and is skipped when compacting automatically while others use the pack.
+
+    @ivar directory: Directory of the pack files.
+    @type directory: C{str}
+
+    @ivar max_size: Maximum size of the pack file in bytes, or C{None} for no limit.
+    @type max_size: C{int} or C{None}
+
+    @ivar blobs: Location of the data in the pack file, by hash of the data.
+    @type blobs: C{dict} mapping C{bytes} to C{tuple} of (offset, size)
+
+    @ivar entries: Cached sprites by sources they belong to. Entries are keyed like L{SpriteCache.cached_sprites},
+                   the value is a tuple with hash of the data, info byte, cropping information, pixel stats,
+                   whether the data is compressed optimally, time of encoding, time of last usage, and hash of
+                   the source image files (see L{get_sprite_digest}, empty if not known).
+    @type entries: C{dict} mapping C{tuple} of C{str} to C{dict} mapping C{tuple} to C{tuple}
+
+    @ivar pack_data: Contents of the pack file.
+    @type pack_data: C{mmap}, C{bytes} or C{None}
+
+    @ivar pack_size: Size of the pack file in bytes.
+    @type pack_size: C{int}
+
+    @ivar source_mtime: Cached modification time of source image files.
+    @type source_mtime: C{dict} mapping C{str} to C{float}
+
+    @ivar read_entries: Cached sprites by sources, as read from the index by L{open}.
+    @type read_entries: C{dict}, like L{entries}
+
+    @ivar written_sources: Sources whose sprites were written by this process.
+    @type written_sources: C{set} of C{tuple} of C{str}
+
+    @ivar write_lock: Lock for appending data, and replacing the index.
+    @type write_lock: L{generic.FileLock}
+
+    @ivar use_lock: Lock for using the pack.
+    @type use_lock: L{generic.FileLock}
+
+    Pack index format description:
+        All values are little-endian. The index starts with a header with a magic value, and the
+        number of strings, data blocks and sprites. This is followed by:
+         - The strings (file names and palettes), each a 16 bit length followed by UTF-8 characters.
+         - For each data block in the pack file, its hash, offset and size.
+         - For each sprite, the sources it belongs to, the key, info byte, cropping information,
+           pixel stats, number of the data block, times of encoding and last usage, and hash of the
+           source image files (all zero if not known).
+        Strings are referred to by their number, with 0xFFFFFFFF for C{None}.
+    """
+
+    PACK_FILE = "sprites.pack"
+    INDEX_FILE = "sprites.packindex"
+    LOCK_FILE = "sprites.packlock"
+    USE_LOCK_FILE = "sprites.packuse"
+    MAGIC = b"NMLPACK\x01"
+    NO_STRING = 0xFFFFFFFF
+
+    header_struct = struct.Struct("<8sIII")
+    string_struct = struct.Struct("<H")
+    blob_struct = struct.Struct("<16sQI")
+    entry_struct = struct.Struct("<IIIiiiiIiiiiI??iiiiBIIIIIdd16s")
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.blobs = {}
+        self.entries = {}
+        self.pack_data = None
+        self.pack_size = 0
+        self.source_mtime = {}
+        self.read_entries = {}
+        self.written_sources = set()
+        self.write_lock = generic.FileLock(self.get_path(self.LOCK_FILE))
+        self.use_lock = generic.FileLock(self.get_path(self.USE_LOCK_FILE))
+        self.time = time.time()
+
+    def get_path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def open(self, exclusive=False):
+        """
+        Start using the pack. Map the pack file into memory, and read the index.
+
+        @param exclusive: Wait until no other process uses the pack, and keep them from using it.
+        @type  exclusive: C{bool}
+        """
+        self.use_lock.acquire(exclusive)
+        try:
+            # Read the index first, the pack file only grows while the pack is used
+            with open(self.get_path(self.INDEX_FILE), "rb") as index_file:
+                index_data = index_file.read()
+            with open(self.get_path(self.PACK_FILE), "rb") as pack_file:
+                self.pack_size = os.fstat(pack_file.fileno()).st_size
+                if self.pack_size > 0:
+                    self.pack_data = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            # Pack files don't exist (or otherwise aren't readable)
+            return
+
+        try:
+            self.blobs, self.entries = self.read_index(index_data, self.pack_size)
+        except (AssertionError, struct.error, IndexError, UnicodeDecodeError):
+            generic.print_warning(
+                generic.Warning.GENERIC,
+                "{} contains invalid data, ignoring.".format(self.get_path(self.INDEX_FILE))
+                + " Please remove the file and file a bug report if this warning keeps appearing",
+            )
+            self.blobs = {}
+            self.entries = {}
+        self.read_entries = dict(self.entries)
+
+    def read_index(self, index_data, pack_size):
+        """
+        Decode the pack index.
+
+        @param index_data: Contents of the pack index file.
+        @type  index_data: C{bytes}
+
+        @param pack_size: Size of the pack file.
+        @type  pack_size: C{int}
+
+        @return: Location of the data, and cached sprites by sources, see L{blobs} and L{entries}.
+        @rtype:  C{tuple} of (C{dict}, C{dict})
+        """
+        blobs = {}
+        entries = {}
+        magic, num_strings, num_blobs, num_entries = self.header_struct.unpack_from(index_data, 0)
+        assert magic == self.MAGIC
+        pos = self.header_struct.size
+
+        strings = []
+        for _ in range(num_strings):
+            (length,) = self.string_struct.unpack_from(index_data, pos)
+            pos += self.string_struct.size
+            assert pos + length <= len(index_data)
+            strings.append(index_data[pos : pos + length].decode("utf-8"))
+            pos += length
+
+        def get_string(number):
+            return None if number == self.NO_STRING else strings[number]
+
+        digests = []
+        for _ in range(num_blobs):
+            digest, offset, size = self.blob_struct.unpack_from(index_data, pos)
+            pos += self.blob_struct.size
+            assert offset + size <= pack_size
+            blobs[digest] = (offset, size)
+            digests.append(digest)
+
+        for _ in range(num_entries):
+            values = self.entry_struct.unpack_from(index_data, pos)
+            pos += self.entry_struct.size
+            sources = (get_string(values[0]), get_string(values[1]))
+            rgb_file = get_string(values[2])
+            rgb_rect = tuple(values[3:7]) if rgb_file is not None else None
+            mask_file = get_string(values[7])
+            mask_rect = tuple(values[8:12]) if mask_file is not None else None
+            key = (rgb_file, rgb_rect, mask_file, mask_rect, values[13], get_string(values[12]))
+            crop = tuple(values[15:19]) if values[13] else None
+            pixel_stats = {"total": values[20], "alpha": values[21], "white": values[22], "anim": values[23]}
+            source_digest = values[27] if any(values[27]) else b""
+            entry = (
+                digests[values[24]],
+                values[19],
+                crop,
+                pixel_stats,
+                values[14],
+                values[25],
+                values[26],
+                source_digest,
+            )
+            entries.setdefault(sources, {})[key] = entry
+        assert pos == len(index_data)
+        return blobs, entries
+
+    def write_index(self):
+        """
+        Write the pack index, replacing the old one at once.
+        """
+        strings = {}
+
+        def add_string(value):
+            if value is None:
+                return self.NO_STRING
+            return strings.setdefault(value, len(strings))
+
+        digests = {}
+        entry_data = []
+        for sources, entries in self.entries.items():
+            for key, entry in entries.items():
+                rgb_file, rgb_rect, mask_file, mask_rect, do_crop, mask_pal = key
+                digest, info, crop_rect, pixel_stats, optimal, encode_time, use_time, source_digest = entry
+                entry_data.append(
+                    self.entry_struct.pack(
+                        add_string(sources[0]),
+                        add_string(sources[1]),
+                        add_string(rgb_file),
+                        *(rgb_rect or (0, 0, 0, 0)),
+                        add_string(mask_file),
+                        *(mask_rect or (0, 0, 0, 0)),
+                        add_string(mask_pal),
+                        do_crop,
+                        optimal,
+                        *(crop_rect or (0, 0, 0, 0)),
+                        info,
+                        pixel_stats.get("total", 0),
+                        pixel_stats.get("alpha", 0),
+                        pixel_stats.get("white", 0),
+                        pixel_stats.get("anim", 0),
+                        digests.setdefault(digest, len(digests)),
+                        encode_time,
+                        use_time,
+                        source_digest,
+                    )
+                )
+
+        index_data = [self.header_struct.pack(self.MAGIC, len(strings), len(digests), len(entry_data))]
+        for value in strings:
+            encoded = value.encode("utf-8")
+            index_data.append(self.string_struct.pack(len(encoded)))
+            index_data.append(encoded)
+        for digest in digests:
+            index_data.append(self.blob_struct.pack(digest, *self.blobs[digest]))
+        index_data.extend(entry_data)
+
+        index_path = self.get_path(self.INDEX_FILE)
+        with open(index_path + ".tmp", "wb") as index_file:
+            index_file.write(b"".join(index_data))
+        os.replace(index_path + ".tmp", index_path)
+
+    def get_data(self, digest):
+        """
+        Get compressed data of a sprite, without copying it.
+
+        @param digest: Hash of the data.
+        @type  digest: C{bytes}
 
+        @return: Compressed data.
+        @rtype:  C{memoryview}
+        """
+        offset, size = self.blobs[digest]
+        return memoryview(self.pack_data)[offset : offset + size]
+
+    def add_data(self, pack_file, data):
+        """
+        Append compressed data of a sprite to the pack file, unless it is already stored.
+
+        @param pack_file: Pack file opened for appending.
+        @type  pack_file: C{file}
+
+        @param data: Compressed data.
+        @type  data: C{array}, C{bytes} or similar.
+
+        @return: Hash of the data.
+        @rtype:  C{bytes}
+        """
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest not in self.blobs:
+            pack_file.write(data)
+            self.blobs[digest] = (self.pack_size, len(data))
+            self.pack_size += len(data)
+        return digest
+
+    def is_up_to_date(self, key, encode_time, source_digest):
+        """
+        Check whether the source image files of a sprite were not modified after encoding it.
+        """
+        if cache_validation == "hash":
+            try:
+                return get_sprite_digest(key) == source_digest
+            except (OSError, generic.ScriptError):
+                return False
+
+        for filename in (key[0], key[2]):
+            if filename is None:
+                continue
+            mtime = self.source_mtime.get(filename)
+            if mtime is None:
+                try:
+                    mtime = os.path.getmtime(generic.find_file(filename))
+                except (OSError, generic.ScriptError):
+                    mtime = float("inf")
+                self.source_mtime[filename] = mtime
+            if mtime > encode_time:
+                return False
+        return True
+
+    def read_sprites(self, sources, optimal_compression):
+        """
+        Get the valid cached sprites belonging to some sources.
+
+        @return: Cache items by key, see L{SpriteCache}.
+        @rtype:  C{dict} mapping C{tuple} to C{tuple}
+        """
+        cached_sprites = {}
+        for key, entry in self.entries.get(sources, {}).items():
+            digest, info, crop_rect, pixel_stats, optimal, encode_time, use_time, source_digest = entry
+            if optimal == optimal_compression and self.is_up_to_date(key, encode_time, source_digest):
+                cached_sprites[key] = (self.get_data(digest), info, crop_rect, pixel_stats, True, False)
+        return cached_sprites
+
+    def write_sprites(self, sources, cached_sprites, optimal_compression):
+        """
+        Replace the cached sprites belonging to some sources. New data is appended to the pack file immediately.
+
+        @param cached_sprites: Cache items by key, see L{SpriteCache}.
+        @type  cached_sprites: C{dict} mapping C{tuple} to C{tuple}
+        """
+        old_entries = self.entries.get(sources, {})
+        entries = {}
+        os.makedirs(self.directory, exist_ok=True)
+        with self.write_lock, open(self.get_path(self.PACK_FILE), "ab") as pack_file:
+            # Appending does not necessarily move the position to the end yet
+            pack_file.seek(0, os.SEEK_END)
+            self.pack_size = pack_file.tell()
+            for key, value in cached_sprites.items():
+                data, info, crop_rect, pixel_stats, in_old_cache, in_use = value
+                if not in_use and not keep_orphaned:
+                    continue
+                if in_old_cache:
+                    digest, encode_time, use_time, source_digest = (old_entries[key][i] for i in (0, 5, 6, 7))
+                else:
+                    digest, encode_time, use_time = self.add_data(pack_file, data), self.time, self.time
+                    source_digest = get_sprite_digest(key) if cache_validation == "hash" else b""
+                if in_use:
+                    use_time = self.time
+                entries[key] = (
+                    digest,
+                    info,
+                    crop_rect,
+                    pixel_stats,
+                    optimal_compression,
+                    encode_time,
+                    use_time,
+                    source_digest,
+                )
+        self.entries[sources] = entries
+        self.written_sources.add(sources)
+
+    def merge_index(self):
+        """
+        Add the sprites that other processes wrote to the index since L{open}. The caller should hold the write lock.
+        """
         try:
-            with generic.open_cache_file(self.sources, ".cache", "wb") as cache_file, generic.open_cache_file(
-                self.sources, ".cacheindex", "w"
-            ) as index_file:
-                index_file.write(index_output)
-                sprite_data.tofile(cache_file)
+            with open(self.get_path(self.INDEX_FILE), "rb") as index_file:
+                index_data = index_file.read()
+            pack_size = os.path.getsize(self.get_path(self.PACK_FILE))
+            blobs, entries = self.read_index(index_data, pack_size)
         except OSError:
+            # No index written yet
+            return
+        except (AssertionError, struct.error, IndexError, UnicodeDecodeError):
+            # Broken index, which is reported by open
+            return
+
+        merged_entries = {}
+        for sources, other_entries in entries.items():
+            if sources not in self.written_sources:
+                # Not written by this process, the index has the latest state
+                merged_entries[sources] = other_entries
+                continue
+            read_entries = self.read_entries.get(sources, {})
+            own_entries = self.entries[sources]
+            for key, entry in other_entries.items():
+                if key not in own_entries and key not in read_entries:
+                    own_entries[key] = entry
+        for sources in self.written_sources:
+            merged_entries[sources] = self.entries[sources]
+
+        blobs.update(self.blobs)
+        self.blobs = blobs
+        self.entries = merged_entries
+        self.pack_size = pack_size
+
+    def evict(self):
+        """
+        Remove the least recently used sprites from the index, until the data referred to fits in L{max_size}.
+        Sprites used by the current compilation are kept.
+        """
+        references = {}
+        by_age = []
+        for sources, entries in self.entries.items():
+            for key, entry in entries.items():
+                references[entry[0]] = references.get(entry[0], 0) + 1
+                if entry[6] < self.time:
+                    by_age.append((entry[6], sources, key))
+        used_size = sum(self.blobs[digest][1] for digest in references)
+
+        by_age.sort(key=lambda item: item[0])
+        for use_time, sources, key in by_age:
+            if used_size <= self.max_size:
+                break
+            digest = self.entries[sources].pop(key)[0]
+            references[digest] -= 1
+            if references[digest] == 0:
+                used_size -= self.blobs[digest][1]
+
+    def remove_missing_sources(self):
+        """
+        Remove the sprites of source image files that no longer exist from the index.
+        File names are relative to the current working directory, as when compiling.
+
+        @return: Number of removed sources.
+        @rtype:  C{int}
+        """
+        missing = []
+        for sources in self.entries:
+            for filename in sources:
+                if filename is None:
+                    continue
+                try:
+                    exists = os.path.isfile(generic.find_file(filename))
+                except (OSError, generic.ScriptError):
+                    exists = False
+                if not exists:
+                    missing.append(sources)
+                    break
+        for sources in missing:
+            del self.entries[sources]
+            self.written_sources.discard(sources)
+        return len(missing)
+
+    def compact(self):
+        """
+        Rewrite the pack file with only the data referred to by the index, after removing the sprites of
+        source image files that no longer exist.
+
+        @return: Number of removed sources, see L{remove_missing_sources}.
+        @rtype:  C{int}
+        """
+        self.release()
+        removed_sources = self.remove_missing_sources()
+        digests = {entry[0]: None for entries in self.entries.values() for entry in entries.values()}
+        pack_path = self.get_path(self.PACK_FILE)
+        blobs = {}
+        offset = 0
+        with open(pack_path, "rb") as old_file, open(pack_path + ".tmp", "wb") as new_file:
+            for digest in digests:
+                old_offset, size = self.blobs[digest]
+                old_file.seek(old_offset)
+                new_file.write(old_file.read(size))
+                blobs[digest] = (offset, size)
+                offset += size
+        os.replace(pack_path + ".tmp", pack_path)
+        self.blobs = blobs
+        self.pack_size = offset
+        return removed_sources
+
+    def release(self):
+        """
+        Unmap the pack file. Data obtained from L{get_data} is no longer valid afterwards.
+        """
+        if self.pack_data is not None:
+            try:
+                self.pack_data.close()
+            except BufferError:
+                # Sprite data is still referenced somewhere, leave the mapping to the garbage collector.
+                pass
+            self.pack_data = None
+
+    def close(self):
+        """
+        Stop using the pack. Merge the index with other processes, enforce the size limit, write the index,
+        and unmap the pack file.
+        """
+        self.release()
+        try:
+            if len(self.written_sources) > 0:
+                with self.write_lock:
+                    self.merge_index()
+                    compact = self.max_size is not None and self.pack_size > self.max_size
+                    if compact:
+                        self.evict()
+                    self.write_index()
+
+                    # Compacting moves the data, so it is skipped while other processes use the pack
+                    self.use_lock.release()
+                    if compact and self.use_lock.acquire(exclusive=True, blocking=False):
+                        self.compact()
+                        self.write_index()
+        except OSError:
+            generic.print_warning(
+                generic.Warning.GENERIC,
+                "Can't write sprite pack in {}. Check permissions, or use --cache-dir or --no-cache.".format(
+                    self.directory
+                ),
+            )
+        finally:
+            self.use_lock.release()
+
+
+class PackedSpriteCache(SpriteCache):
+    """
+    Cache for compressed sprites of a source image, stored in a L{SpritePack}.
+
+    @ivar pack: Pack storing the sprites.
+    @type pack: L{SpritePack}
+    """
+
+    def __init__(self, pack, sources=(), optimal_compression=False):
+        SpriteCache.__init__(self, sources, optimal_compression)
+        self.pack = pack
+
+    def read_cache(self):
+        """
+        Read the sprites from the pack.
+        """
+        self.cached_sprites = self.pack.read_sprites(self.sources, self.optimal_compression)
+
+    def write_cache(self):
+        """
+        Write the sprites to the pack.
+        """
+        try:
+            self.pack.write_sprites(self.sources, self.cached_sprites, self.optimal_compression)
+        except OSError:
+            generic.print_warning(
+                generic.Warning.GENERIC,
+                "Can't write sprite pack in {}. Check permissions, or use --cache-dir or --no-cache.".format(
+                    self.pack.directory
+                ),
+            )
+
+
+def compact_pack():
+    """
+    Remove the data from the sprite pack in the cache directory that is no longer used.
+    """
+    if generic.cache_root_dir is None:
+        return
+    pack = SpritePack(generic.cache_root_dir)
+    try:
+        pack.open(exclusive=True)
+        if pack.pack_size == 0:
             return
+        old_size = pack.pack_size
+        with pack.write_lock:
+            removed_sources = pack.compact()
+            pack.write_index()
+    except OSError:
+        generic.print_warning(
+            generic.Warning.GENERIC,
+            "Can't compact sprite pack in {}. Check permissions.".format(generic.cache_root_dir),
+        )
+        return
+    finally:
+        pack.use_lock.release()
+    generic.print_info(
+        "Sprite pack compacted from {:d} to {:d} bytes, removed {:d} missing source file(s)".format(
+            old_size, pack.pack_size, removed_sources
+        )
+    )
@@ -14,8 +14,12 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA."""
 
 import array
+import bisect
+import collections
+import concurrent.futures
+import time
 
-from nml import generic, lz77, palette, spritecache
+from nml import generic, lz77, metrics, palette, spritecache
 from nml.actions import real_sprite
 
 try:
@@ -24,6 +28,12 @@ except ImportError:
     # Image is required only when using graphics
     pass
 
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional, it only speeds up processing the pixel data
+    numpy = None
+
 # Some constants for the 'info' byte
 INFO_RGB = 1
 INFO_ALPHA = 2
@@ -31,6 +41,11 @@ INFO_PAL = 4
 INFO_TILE = 8
 INFO_NOCROP = 0x40
 
+"""
+Size in bytes of the decoded source images kept in memory while encoding sprites, see L{ImageSheetStore}.
+"""
+max_image_memory = 256 * 1024 * 1024
+
 
 def get_bpp(info):
     bpp = 0
@@ -64,6 +79,303 @@ def transparency_offset(info):
         return 0
 
 
+def count_pixels(data, low, high, offset=0, step=1):
+    """
+    Count the pixels with a byte value within a range.
+
+    @param data: Pixel data, in parts of whole pixels, see L{ImageSheet.get_pixels}.
+    @type  data: C{list} of C{bytes} or similar.
+
+    @param low: Lowest value to count.
+    @type  low: C{int}
+
+    @param high: Highest value to count.
+    @type  high: C{int}
+
+    @param offset: Offset of the byte to inspect within a pixel.
+    @type  offset: C{int}
+
+    @param step: Number of bytes per pixel.
+    @type  step: C{int}
+
+    @return: Number of pixels with L{low} <= value <= L{high}.
+    @rtype:  C{int}
+    """
+    if numpy is not None:
+        count = 0
+        for part in data:
+            values = numpy.frombuffer(part, dtype=numpy.uint8)[offset::step]
+            count += int(numpy.count_nonzero((values >= low) & (values <= high)))
+        return count
+    return sum(low <= p <= high for part in data for p in part[offset::step])
+
+
+def add_mask(rgb_data, mask_data, rgb_bpp):
+    """
+    Append the mask byte to every pixel of the RGB(A) data.
+
+    @param rgb_data: RGB(A) pixel data, in parts of whole pixels, see L{ImageSheet.get_pixels}.
+    @type  rgb_data: C{list} of C{bytes} or similar.
+
+    @param mask_data: 8bpp pixel data, one byte for each pixel, in parts.
+    @type  mask_data: C{list} of C{bytes} or similar.
+
+    @param rgb_bpp: Number of bytes per RGB(A) pixel, 3 or 4.
+    @type  rgb_bpp: C{int}
+
+    @return: Pixel data with L{rgb_bpp} + 1 bytes per pixel.
+    @rtype:  C{array}
+    """
+    if numpy is not None:
+        # Copy the parts straight into their place in the result
+        num_pixels = sum(len(part) for part in mask_data)
+        pixels = numpy.empty((num_pixels, rgb_bpp + 1), dtype=numpy.uint8)
+        start = 0
+        for part in rgb_data:
+            rgb = numpy.frombuffer(part, dtype=numpy.uint8).reshape(-1, rgb_bpp)
+            pixels[start : start + len(rgb), :rgb_bpp] = rgb
+            start += len(rgb)
+        start = 0
+        for part in mask_data:
+            pixels[start : start + len(part), rgb_bpp] = numpy.frombuffer(part, dtype=numpy.uint8)
+            start += len(part)
+        sprite_data = array.array("B")
+        sprite_data.frombytes(pixels)
+        return sprite_data
+
+    sprite_data = array.array("B")
+    mask = array.array("B")  # Convert to numeric
+    rgb = array.array("B")
+    for part in mask_data:
+        mask.frombytes(part)
+    for part in rgb_data:
+        rgb.frombytes(part)
+    for i in range(len(mask)):
+        sprite_data.extend(rgb[rgb_bpp * i : rgb_bpp * (i + 1)])
+        sprite_data.append(mask[i])
+    return sprite_data
+
+
+def get_line_chunks(opaque_x, max_chunk_len):
+    """
+    Divide a line of a sprite into chunks for the chunked format.
+
+    A chunk only ends at 3 or more consecutive transparent pixels, or when it reaches the maximum length.
+
+    @param opaque_x: Positions of the non-transparent pixels in the line, in increasing order.
+    @type  opaque_x: C{list} of C{int}, or a NumPy array.
+
+    @param max_chunk_len: Maximum length of a chunk.
+    @type  max_chunk_len: C{int}
+
+    @return: Start and end position of each chunk.
+    @rtype:  C{list} of C{tuple} of (C{int}, C{int})
+    """
+    if len(opaque_x) == 0:
+        return []
+
+    if numpy is not None and isinstance(opaque_x, numpy.ndarray):
+        gaps = numpy.flatnonzero(numpy.diff(opaque_x) > 3)
+        starts = opaque_x[numpy.concatenate(([0], gaps + 1))].tolist()
+        ends = (opaque_x[numpy.concatenate((gaps, [len(opaque_x) - 1]))] + 1).tolist()
+    else:
+        starts = [opaque_x[0]]
+        ends = []
+        for x1, x2 in zip(opaque_x, opaque_x[1:]):
+            if x2 - x1 > 3:
+                ends.append(x1 + 1)
+                starts.append(x2)
+        ends.append(opaque_x[-1] + 1)
+
+    chunks = []
+    for x1, x2 in zip(starts, ends):
+        while x2 - x1 > max_chunk_len:
+            chunks.append((x1, x1 + max_chunk_len))
+            # Continue at the next non-transparent pixel
+            x1 = int(opaque_x[bisect.bisect_left(opaque_x, x1 + max_chunk_len)])
+        chunks.append((x1, x2))
+    return chunks
+
+
+class ImageSheet:
+    """
+    A source image, of which the pixel data is decoded once into a single buffer when it is first needed.
+
+    @ivar filename: Name of the image file.
+    @type filename: C{str}
+
+    @ivar image: Opened image file, until the pixel data is decoded.
+    @type image: L{Image} or C{None}
+
+    @ivar mode: Mode of the image, as in PIL.
+    @type mode: C{str}
+
+    @ivar format: File format of the image, as in PIL.
+    @type format: C{str}
+
+    @ivar size: Width and height of the image.
+    @type size: C{tuple} of (C{int}, C{int})
+
+    @ivar palette: Palette of the image, so the sheet can be given to L{palette.validate_palette} like an image.
+    @type palette: C{ImagePalette} or C{None}
+
+    @ivar palette_name: Name of the validated palette, or C{None} if not validated yet.
+    @type palette_name: C{str} or C{None}
+
+    @ivar pixels: Pixel data of the whole image, row by row, or C{None} if not decoded yet.
+    @type pixels: C{memoryview} or C{None}
+
+    @ivar bpp: Number of bytes per pixel in L{pixels}.
+    @type bpp: C{int}
+
+    @ivar store: Store the image belongs to, it is told when the pixel data is decoded.
+    @type store: L{ImageSheetStore}
+    """
+
+    def __init__(self, filename, store):
+        self.filename = filename
+        self.store = store
+        self.image = Image.open(generic.find_file(filename))
+        self.mode = self.image.mode
+        self.format = self.image.format
+        self.size = self.image.size
+        self.palette = self.image.palette
+        self.palette_name = None
+        self.pixels = None
+        self.bpp = 0
+
+    def get_palette_name(self):
+        """
+        Get the name of the palette of the image, and check that it is a valid palette.
+
+        @return: Name of the palette, see L{palette.palette_name}.
+        @rtype:  C{str}
+        """
+        if self.palette_name is None:
+            self.palette_name = palette.validate_palette(self, self.filename)
+        return self.palette_name
+
+    def get_memory(self):
+        """
+        Get the size of the decoded pixel data.
+
+        @return: Size in bytes.
+        @rtype:  C{int}
+        """
+        return 0 if self.pixels is None else len(self.pixels)
+
+    def get_pixels(self, x, y, size_x, size_y):
+        """
+        Get the pixel data of a rectangle of the image, as views of the decoded image without copying it.
+        A rectangle of whole rows is contiguous in the image, and is returned as a single view.
+
+        @precond: The rectangle lies within the image.
+
+        @return: Pixel data of the rectangle, row by row.
+        @rtype:  C{list} of C{memoryview}
+
+        @raise OSError: The image file could not be decoded.
+        """
+        if self.pixels is None:
+            self.pixels = memoryview(self.image.tobytes())
+            self.bpp = len(self.pixels) // (self.size[0] * self.size[1]) if self.size[0] * self.size[1] > 0 else 0
+            self.image.close()
+            self.image = None
+            self.store.add_decoded(self)
+        row_size = self.size[0] * self.bpp
+        start = y * row_size + x * self.bpp
+        if size_x == self.size[0]:
+            return [self.pixels[start : start + size_y * row_size]]
+        end = start + size_x * self.bpp
+        return [self.pixels[start + i * row_size : end + i * row_size] for i in range(size_y)]
+
+    def close(self):
+        if self.image is not None:
+            self.image.close()
+            self.image = None
+        self.pixels = None
+
+
+class ImageSheetStore:
+    """
+    Source images that are used by the sprites, kept in memory between sprites, also when a sprite sheet
+    is used as 8bpp image by some sprites and as mask by others. When an image is decoded and the decoded
+    images take more than L{max_memory}, the least recently used images are dropped. The images of the sprite
+    being encoded are never dropped, so they may take more memory than that.
+
+    @ivar max_memory: Maximum size of the decoded pixel data in bytes.
+    @type max_memory: C{int}
+
+    @ivar memory: Size of the decoded pixel data of the images in bytes.
+    @type memory: C{int}
+
+    @ivar sheets: Opened images, by file name, from least to most recently used.
+    @type sheets: C{OrderedDict} mapping C{str} to L{ImageSheet}
+
+    @ivar in_use: File names of the images used by the sprite being encoded, see L{start_sprite}.
+    @type in_use: C{set} of C{str}
+    """
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.memory = 0
+        self.sheets = collections.OrderedDict()
+        self.in_use = set()
+
+    def start_sprite(self):
+        """
+        Start encoding another sprite, the images of the previous sprite may be dropped again.
+        """
+        self.in_use.clear()
+
+    def get(self, filename):
+        """
+        Get an image, opening it if needed.
+
+        @param filename: Name of the image file.
+        @type  filename: C{str}
+
+        @return: The image.
+        @rtype:  L{ImageSheet}
+        """
+        self.in_use.add(filename)
+        sheet = self.sheets.get(filename)
+        if sheet is not None:
+            self.sheets.move_to_end(filename)
+            return sheet
+
+        sheet = ImageSheet(filename, self)
+        self.sheets[filename] = sheet
+        return sheet
+
+    def add_decoded(self, sheet):
+        """
+        Account for the memory of a newly decoded image, and drop the least recently used images
+        that are not used by the current sprite while the decoded images take too much memory.
+
+        @param sheet: The decoded image.
+        @type  sheet: L{ImageSheet}
+        """
+        self.memory += sheet.get_memory()
+        for filename in list(self.sheets):
+            if self.memory <= self.max_memory:
+                break
+            if filename not in self.in_use:
+                old_sheet = self.sheets.pop(filename)
+                self.memory -= old_sheet.get_memory()
+                old_sheet.close()
+
+    def clear(self):
+        """
+        Drop all images.
+        """
+        for sheet in self.sheets.values():
+            sheet.close()
+        self.sheets.clear()
+        self.in_use.clear()
+        self.memory = 0
+
+
 class SpriteEncoder:
     """
     Algorithms for cropping and compressing sprites. That is encoding source images into GRF sprites.
@@ -77,16 +389,33 @@ class SpriteEncoder:
     @ivar palette: Palette for encoding, see L{palette.palette_name}.
     @type palette: C{str}
 
-    @ivar cached_image_files: Currently opened source image files.
-    @type cached_image_files: C{dict} mapping C{str} to C{Image}
+    @ivar jobs: Number of processes used for encoding sprites. With C{1}, sprites are encoded in this process.
+    @type jobs: C{int}
+
+    @ivar optimal_compression: Compress sprites as small as possible, instead of as fast as possible.
+    @type optimal_compression: C{bool}
+
+    @ivar sprite_pack: Pack storing the cached sprites, if the cache is stored in a pack.
+    @type sprite_pack: L{spritecache.SpritePack} or C{None}
+
+    @ivar image_sheets: Source image files used by the sprites being encoded.
+    @type image_sheets: L{ImageSheetStore}
+
+    @ivar compress_stats: Time spent in L{sprite_compress}, including the attempts that are not used, and the size
+                          of the pixel data and the compressed data of the encoded sprites.
+    @type compress_stats: C{list} of a C{float} and two C{int}
     """
 
-    def __init__(self, compress_grf, crop_sprites, palette):
+    def __init__(self, compress_grf, crop_sprites, palette, jobs=1, optimal_compression=False):
         self.compress_grf = compress_grf
         self.crop_sprites = crop_sprites
         self.palette = palette
+        self.jobs = jobs
+        self.optimal_compression = optimal_compression
         self.sprite_cache = spritecache.SpriteCache()
-        self.cached_image_files = {}
+        self.sprite_pack = None
+        self.image_sheets = ImageSheetStore(max_image_memory)
+        self.compress_stats = [0.0, 0, 0]
 
     def open(self, sprite_files):
         """
@@ -99,74 +428,138 @@ class SpriteEncoder:
 
         generic.print_progress("Encoding ...")
 
+        if spritecache.cache_format == "pack" and generic.cache_root_dir is not None:
+            self.sprite_pack = spritecache.SpritePack(generic.cache_root_dir, spritecache.max_pack_size)
+            self.sprite_pack.open()
+
         num_cached = 0
         num_dup = 0
         num_enc = 0
         num_orphaned = 0
         count_sprites = 0
-        for sources, sprite_list in sprite_files.items():
-            # Iterate over sprites grouped by source image file.
-            #  - Open source files only once. (speed)
-            #  - Do not keep files around for long. (memory)
 
-            source_name = "_".join(src for src in sources if src is not None)
+        local_caches = {}
+        pending = {}
+        executor = None
+        if self.jobs > 1:
+            # Read all caches up front and hand the sprites missing from them to worker processes.
+            # The results are merged below in the same order as in a serial run, so the output is identical.
+            for sources, sprite_list in sprite_files.items():
+                local_cache = self.open_cache(sources)
+                local_caches[sources] = local_cache
+
+                missing = {}
+                for sprite_info in sprite_list:
+                    cache_key = sprite_info.get_cache_key(self.crop_sprites)
+                    if cache_key not in missing and local_cache.get_item(cache_key, self.palette) is None:
+                        missing[cache_key] = sprite_info
+                if len(missing) > 0:
+                    if executor is None:
+                        executor = concurrent.futures.ProcessPoolExecutor(self.jobs)
+                    pending[sources] = executor.submit(
+                        _encode_sprites,
+                        self.compress_grf,
+                        self.crop_sprites,
+                        self.palette,
+                        self.optimal_compression,
+                        self.image_sheets.max_memory,
+                        missing,
+                    )
 
-            local_cache = spritecache.SpriteCache(sources)
-            local_cache.read_cache()
+        try:
+            for sources, sprite_list in sprite_files.items():
+                # Iterate over sprites grouped by source image file.
+                #  - Open source files only once. (speed)
+                #  - Do not keep files around for long. (memory)
 
-            for sprite_info in sprite_list:
-                count_sprites += 1
-                generic.print_progress(
-                    "Encoding {}/{}: {}".format(count_sprites, num_sprites, source_name), incremental=True
-                )
+                source_name = "_".join(src for src in sources if src is not None)
+
+                local_cache = local_caches.pop(sources, None)
+                if local_cache is None:
+                    local_cache = self.open_cache(sources)
 
-                cache_key = sprite_info.get_cache_key(self.crop_sprites)
-                cache_item = local_cache.get_item(cache_key, self.palette)
+                encoded = {}
+                if sources in pending:
+                    encoded, compress_stats = pending.pop(sources).result()
+                    for i, value in enumerate(compress_stats):
+                        self.compress_stats[i] += value
+
+                for sprite_info in sprite_list:
+                    count_sprites += 1
+                    generic.print_progress(
+                        "Encoding {}/{}: {}".format(count_sprites, num_sprites, source_name), incremental=True
+                    )
 
-                in_use = False
-                in_old_cache = False
-                if cache_item is not None:
-                    # Write a sprite from the cached data
-                    compressed_data, info_byte, crop_rect, pixel_stats, in_old_cache, in_use = cache_item
-                    if in_use:
-                        num_dup += 1
+                    cache_key = sprite_info.get_cache_key(self.crop_sprites)
+                    cache_item = local_cache.get_item(cache_key, self.palette)
+
+                    in_use = False
+                    in_old_cache = False
+                    if cache_item is not None:
+                        # Write a sprite from the cached data
+                        compressed_data, info_byte, crop_rect, pixel_stats, in_old_cache, in_use = cache_item
+                        if in_use:
+                            num_dup += 1
+                        else:
+                            num_cached += 1
                     else:
-                        num_cached += 1
-                else:
-                    (
-                        size_x,
-                        size_y,
-                        xoffset,
-                        yoffset,
-                        compressed_data,
-                        info_byte,
-                        crop_rect,
-                        pixel_stats,
-                    ) = self.encode_sprite(sprite_info)
-                    num_enc += 1
-
-                # Store sprite in cache, unless already up-to-date
-                if not in_use:
-                    cache_item = (compressed_data, info_byte, crop_rect, pixel_stats, in_old_cache, True)
-                    local_cache.add_item(cache_key, self.palette, cache_item)
-
-            # Delete all files from dictionary to free memory
-            self.cached_image_files.clear()
-
-            num_orphaned += local_cache.count_orphaned()
-
-            # Only write cache if compression is enabled. Uncompressed data is not worth to be cached.
-            if self.compress_grf:
-                local_cache.write_cache()
-
-            # Transfer data to global cache for later usage
-            self.sprite_cache.cached_sprites.update(local_cache.cached_sprites)
+                        if cache_key in encoded:
+                            encoded_sprite = encoded[cache_key]
+                        else:
+                            encoded_sprite = self.encode_sprite(sprite_info)
+                        (
+                            size_x,
+                            size_y,
+                            xoffset,
+                            yoffset,
+                            compressed_data,
+                            info_byte,
+                            crop_rect,
+                            pixel_stats,
+                        ) = encoded_sprite
+                        num_enc += 1
+
+                    # Store sprite in cache, unless already up-to-date
+                    if not in_use:
+                        cache_item = (compressed_data, info_byte, crop_rect, pixel_stats, in_old_cache, True)
+                        local_cache.add_item(cache_key, self.palette, cache_item)
+
+                num_orphaned += local_cache.count_orphaned()
+
+                # Only write cache if compression is enabled. Uncompressed data is not worth to be cached.
+                if self.compress_grf:
+                    local_cache.write_cache()
+
+                # Transfer data to global cache for later usage
+                self.sprite_cache.cached_sprites.update(local_cache.cached_sprites)
+
+        finally:
+            # Free the memory of the source images
+            self.image_sheets.clear()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
         generic.print_progress("Encoding ...", incremental=True)
         generic.clear_progress()
+        for name, value in [
+            ("sprites", num_sprites),
+            ("cached", num_cached),
+            ("orphaned", num_orphaned),
+            ("duplicates", num_dup),
+            ("encoded", num_enc),
+            ("compress_time", self.compress_stats[0]),
+            ("bytes_in", self.compress_stats[1]),
+            ("bytes_out", self.compress_stats[2]),
+        ]:
+            metrics.add("sprite_encoder", name, value)
         generic.print_info(
             "{} sprites, {} cached, {} orphaned, {} duplicates, {} newly encoded ({})".format(
-                num_sprites, num_cached, num_orphaned, num_dup, num_enc, "native" if lz77.is_native else "python"
+                num_sprites,
+                num_cached,
+                num_orphaned,
+                num_dup,
+                num_enc,
+                "optimal" if self.optimal_compression else "native" if lz77.is_native else "python",
             )
         )
 
@@ -174,7 +567,27 @@ class SpriteEncoder:
         """
         Close the encoder, validate data, write caches, and stuff.
         """
-        pass
+        self.sprite_cache = spritecache.SpriteCache()
+        if self.sprite_pack is not None:
+            self.sprite_pack.close()
+            self.sprite_pack = None
+
+    def open_cache(self, sources):
+        """
+        Read the cached sprites of some source image files.
+
+        @param sources: Source image files.
+        @type  sources: C{tuple} of (C{str} or C{None})
+
+        @return: Cache with the sprites.
+        @rtype:  L{spritecache.SpriteCache}
+        """
+        if self.sprite_pack is not None:
+            local_cache = spritecache.PackedSpriteCache(self.sprite_pack, sources, self.optimal_compression)
+        else:
+            local_cache = spritecache.SpriteCache(sources, self.optimal_compression)
+        local_cache.read_cache()
+        return local_cache
 
     def get(self, sprite_info):
         """
@@ -240,14 +653,9 @@ class SpriteEncoder:
         @type  filename: C{str}
 
         @return: Image file
-        @rtype:  L{Image}
+        @rtype:  L{ImageSheet}
         """
-        if filename in self.cached_image_files:
-            im = self.cached_image_files[filename]
-        else:
-            im = Image.open(generic.find_file(filename))
-            self.cached_image_files[filename] = im
-        return im
+        return self.image_sheets.get(filename)
 
     def encode_sprite(self, sprite_info):
         """
@@ -260,6 +668,7 @@ class SpriteEncoder:
         @rtype: C{tuple}
         """
 
+        self.image_sheets.start_sprite()
         filename_8bpp = None
         filename_32bpp = None
         if sprite_info.bit_depth == 8:
@@ -302,22 +711,21 @@ class SpriteEncoder:
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ScriptError("Read beyond bounds of image file '{}'".format(filename_32bpp.value), pos)
             try:
-                sprite = im.crop((x, y, x + size_x, y + size_y))
+                rgb_sprite_data = im.get_pixels(x, y, size_x, size_y)
             except OSError:
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ImageError("Failed to crop 32bpp {} image".format(im.format), filename_32bpp.value, pos)
-            rgb_sprite_data = sprite.tobytes()
 
             if (info_byte & INFO_ALPHA) != 0:
                 # Check for half-transparent pixels (not valid for ground sprites)
-                pixel_stats["alpha"] = sum(0x00 < p < 0xFF for p in rgb_sprite_data[3::4])
+                pixel_stats["alpha"] = count_pixels(rgb_sprite_data, 0x01, 0xFE, 3, 4)
 
         if filename_8bpp is not None:
             mask_im = self.open_image_file(filename_8bpp.value)
             if mask_im.mode != "P":
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ImageError("8bpp image does not have a palette", filename_8bpp.value, pos)
-            im_mask_pal = palette.validate_palette(mask_im, filename_8bpp.value)
+            im_mask_pal = mask_im.get_palette_name()
             info_byte |= INFO_PAL
 
             im_width, im_height = mask_im.size
@@ -325,40 +733,33 @@ class SpriteEncoder:
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ScriptError("Read beyond bounds of image file '{}'".format(filename_8bpp.value), pos)
             try:
-                mask_sprite = mask_im.crop((mask_x, mask_y, mask_x + size_x, mask_y + size_y))
+                mask_sprite_data = mask_im.get_pixels(mask_x, mask_y, size_x, size_y)
             except OSError:
                 pos = generic.build_position(sprite_info.poslist)
                 raise generic.ImageError(
                     "Failed to crop 8bpp {} image".format(mask_im.format), filename_8bpp.value, pos
                 )
-            mask_sprite_data = self.palconvert(mask_sprite.tobytes(), im_mask_pal)
+            mask_sprite_data = self.palconvert(mask_sprite_data, im_mask_pal)
 
             # Check for white pixels; those that cause "artefacts" when shading
-            pixel_stats["white"] = sum(p == 255 for p in mask_sprite_data)
+            pixel_stats["white"] = count_pixels(mask_sprite_data, 0xFF, 0xFF)
 
             # Check for palette animation colours
             if self.palette == "DEFAULT":
-                pixel_stats["anim"] = sum(0xE3 <= p <= 0xFE for p in mask_sprite_data)
+                pixel_stats["anim"] = count_pixels(mask_sprite_data, 0xE3, 0xFE)
             else:
-                pixel_stats["anim"] = sum(0xD9 <= p <= 0xF4 for p in mask_sprite_data)
+                pixel_stats["anim"] = count_pixels(mask_sprite_data, 0xD9, 0xF4)
 
-        # Compose pixel information in an array of bytes
+        # Compose pixel information in an array of bytes, this is the only copy of the pixels of the image
         sprite_data = array.array("B")
         if (info_byte & INFO_RGB) != 0 and (info_byte & INFO_PAL) != 0:
-            mask_data = array.array("B", mask_sprite_data)  # Convert to numeric
-            rgb_data = array.array("B", rgb_sprite_data)
-            if (info_byte & INFO_ALPHA) != 0:
-                for i in range(len(mask_sprite_data)):
-                    sprite_data.extend(rgb_data[4 * i : 4 * (i + 1)])
-                    sprite_data.append(mask_data[i])
-            else:
-                for i in range(len(mask_sprite_data)):
-                    sprite_data.extend(rgb_data[3 * i : 3 * (i + 1)])
-                    sprite_data.append(mask_data[i])
+            sprite_data = add_mask(rgb_sprite_data, mask_sprite_data, 4 if (info_byte & INFO_ALPHA) != 0 else 3)
         elif (info_byte & INFO_RGB) != 0:
-            sprite_data.frombytes(rgb_sprite_data)
+            for row in rgb_sprite_data:
+                sprite_data.frombytes(row)
         else:
-            sprite_data.frombytes(mask_sprite_data)
+            for row in mask_sprite_data:
+                sprite_data.frombytes(row)
 
         bpp = get_bpp(info_byte)
         assert len(sprite_data) == size_x * size_y * bpp
@@ -370,8 +771,9 @@ class SpriteEncoder:
         assert len(sprite_data) == size_x * size_y * bpp
 
         compressed_data = self.sprite_compress(sprite_data)
+        data_len = len(sprite_data)
         # Try tile compression, and see if it results in a smaller file size
-        tile_data = self.sprite_encode_tile(size_x, size_y, sprite_data, info_byte, bpp)
+        tile_data = self.sprite_encode_tile(size_x, size_y, sprite_data, info_byte, bpp, len(compressed_data) - 4)
         if tile_data is not None:
             tile_compressed_data = self.sprite_compress(tile_data)
             # Tile compression adds another 4 bytes for the uncompressed chunked data in the header
@@ -385,6 +787,9 @@ class SpriteEncoder:
                 compressed_data.append((data_len >> 24) & 0xFF)
                 compressed_data.extend(tile_compressed_data)
 
+        # Count the compressed sprite that is written, not the attempts to compress it
+        self.compress_stats[1] += data_len
+        self.compress_stats[2] += len(compressed_data)
         return (size_x, size_y, xoffset, yoffset, compressed_data, info_byte, crop_rect, pixel_stats)
 
     def fakecompress(self, data):
@@ -399,29 +804,81 @@ class SpriteEncoder:
         return output
 
     def sprite_compress(self, data):
-        if self.compress_grf:
+        start = time.perf_counter()
+        if self.compress_grf and self.optimal_compression:
+            stream = lz77.encode_optimal(data)
+        elif self.compress_grf:
             stream = lz77.encode(data)
         else:
             stream = self.fakecompress(data)
+        self.compress_stats[0] += time.perf_counter() - start
         return stream
 
-    def sprite_encode_tile(self, size_x, size_y, data, info, bpp, long_format=False):
+    def min_compressed_size(self, size):
+        """
+        Lower bound for the size of data after L{sprite_compress}.
+
+        @param size: Size of the uncompressed data.
+        @type  size: C{int}
+
+        @return: Minimal size of the compressed data.
+        @rtype:  C{int}
+        """
+        if self.compress_grf:
+            # A back-reference takes 2 bytes for at most 15 bytes of data
+            return (2 * size + 14) // 15
+        return size + (size + 126) // 127
+
+    def sprite_encode_tile(self, size_x, size_y, data, info, bpp, max_compressed_size=None):
+        """
+        Encode a sprite in the chunked format, which skips transparent pixels.
+
+        @param max_compressed_size: If not C{None}, only encode the sprite if the compressed chunked
+                                    data may be smaller than this.
+        @type  max_compressed_size: C{int} or C{None}
+
+        @return: Chunked data, or C{None} if the sprite cannot be or is not encoded.
+        @rtype:  C{array} or C{None}
+        """
         long_chunk = size_x > 256
 
         # There are basically four different encoding configurations here,
         # but just two variables. If the width of the sprite is more than
         # 256, then the chunk could be 'out of bounds' and thus the long
-        # chunk format is used. If the sprite is more than 65536 bytes,
+        # chunk format is used. If the sprite is more than 65535 bytes,
         # then the offsets might not fit and the long format method is
-        # used. The latter is enabled via recursion if it's needed.
+        # used. The size is computed before encoding to decide this.
         if not has_transparency(info):
             return None
         trans_offset = transparency_offset(info)
         max_chunk_len = 0x7FFF if long_chunk else 0x7F
+        chunk_header_size = 4 if long_chunk else 2
+
+        if numpy is not None:
+            opaque = numpy.frombuffer(data, dtype=numpy.uint8)[trans_offset::bpp].reshape(size_y, size_x) != 0
+            lines = [get_line_chunks(numpy.flatnonzero(line), max_chunk_len) for line in opaque]
+        else:
+            line_size = size_x * bpp
+            lines = []
+            for line_start in range(0, size_y * line_size, line_size):
+                line = data[line_start + trans_offset : line_start + line_size : bpp]
+                lines.append(get_line_chunks([x for x, p in enumerate(line) if p != 0], max_chunk_len))
+
+        size = 2 * size_y
+        for line_parts in lines:
+            # A completely transparent line takes a single empty chunk
+            size += max(len(line_parts), 1) * chunk_header_size
+            size += sum(x2 - x1 for x1, x2 in line_parts) * bpp
+        long_format = size > 65535
+        if long_format:
+            size += 2 * size_y
+        if max_compressed_size is not None and self.min_compressed_size(size) >= max_compressed_size:
+            return None
+
         line_offset_size = 4 if long_format else 2  # Whether to use 2 or 4 bytes in the list of line offsets
         output = array.array("B", [0] * (line_offset_size * size_y))
 
-        for y in range(size_y):
+        for y, line_parts in enumerate(lines):
             # Write offset in the correct place, in little-endian format
             offset = len(output)
             output[y * line_offset_size] = offset & 0xFF
@@ -432,28 +889,6 @@ class SpriteEncoder:
 
             line_start = y * size_x * bpp
 
-            line_parts = []
-            x1 = 0
-            while True:
-                # Skip transparent pixels
-                while x1 < size_x and data[line_start + x1 * bpp + trans_offset] == 0:
-                    x1 += 1
-                if x1 == size_x:
-                    # End-of-line reached
-                    break
-
-                # Grab as many non-transparent pixels as possible, but not without x2-x1 going out of bounds
-                # Only stop the chunk when encountering 3 consecutive transparent pixels
-                x2 = x1 + 1
-                while x2 - x1 < max_chunk_len and (
-                    (x2 < size_x and data[line_start + x2 * bpp + trans_offset] != 0)
-                    or (x2 + 1 < size_x and data[line_start + (x2 + 1) * bpp + trans_offset] != 0)
-                    or (x2 + 2 < size_x and data[line_start + (x2 + 2) * bpp + trans_offset] != 0)
-                ):
-                    x2 += 1
-                line_parts.append((x1, x2))
-                x1 = x2
-
             if len(line_parts) == 0:
                 # Completely transparent line
                 if long_chunk:
@@ -472,9 +907,7 @@ class SpriteEncoder:
                     output.extend((chunk_len | last_mask, x1))
                 output.extend(data[line_start + x1 * bpp : line_start + x2 * bpp])
 
-        if len(output) > 65535 and not long_format:
-            # Recurse into the long format if that's possible.
-            return self.sprite_encode_tile(size_x, size_y, data, info, bpp, True)
+        assert len(output) == size
         return output
 
     def recompute_offsets(self, size_x, size_y, xoffset, yoffset, crop_rect):
@@ -492,6 +925,8 @@ class SpriteEncoder:
             return (data, (left, right, top, bottom))
 
         trans_offset = transparency_offset(info)
+        if numpy is not None:
+            return self.crop_sprite_numpy(data, size_x, size_y, bpp, trans_offset)
         line_size = size_x * bpp  # size (no. of bytes) of a scan line
         data_size = len(data)
 
@@ -532,8 +967,53 @@ class SpriteEncoder:
 
         return (data, (left, right, top, bottom))
 
+    def crop_sprite_numpy(self, data, size_x, size_y, bpp, trans_offset):
+        pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape(size_y, size_x, bpp)
+        opaque = pixels[:, :, trans_offset] != 0
+
+        # Crop the top and bottom of the sprite, but keep at least one line
+        rows = numpy.flatnonzero(opaque.any(axis=1))
+        if len(rows) == 0:
+            top, bottom = size_y - 1, 0
+        else:
+            top, bottom = int(rows[0]), size_y - 1 - int(rows[-1])
+
+        # Crop the left and right of the remaining lines, but keep at least one column
+        columns = numpy.flatnonzero(opaque[top : size_y - bottom].any(axis=0))
+        if len(columns) == 0:
+            left, right = size_x - 1, 0
+        else:
+            left, right = int(columns[0]), size_x - 1 - int(columns[-1])
+
+        if left + right + top + bottom > 0:
+            data = array.array("B", pixels[top : size_y - bottom, left : size_x - right].tobytes())
+        return (data, (left, right, top, bottom))
+
     def palconvert(self, sprite_str, orig_pal):
         if orig_pal == "LEGACY" and self.palette == "DEFAULT":
-            return sprite_str.translate(real_sprite.translate_w2d)
+            return [bytes(row).translate(real_sprite.translate_w2d) for row in sprite_str]
         else:
             return sprite_str
+
+
+def _encode_sprites(compress_grf, crop_sprites, palette, optimal_compression, max_memory, sprites):
+    """
+    Encode sprites in a worker process.
+
+    @param max_memory: Size in bytes of the decoded source images kept in memory, see L{ImageSheetStore}.
+    @type  max_memory: C{int}
+
+    @param sprites: Sprites to encode, by cache key.
+    @type  sprites: C{dict} mapping C{tuple} to C{RealSprite}
+
+    @return: Result of L{SpriteEncoder.encode_sprite} for each sprite, by cache key,
+             and the L{SpriteEncoder.compress_stats} of encoding them.
+    @rtype: C{tuple} of a C{dict} mapping C{tuple} to C{tuple}, and a C{list}
+    """
+    encoder = SpriteEncoder(compress_grf, crop_sprites, palette, optimal_compression=optimal_compression)
+    encoder.image_sheets.max_memory = max_memory
+    try:
+        encoded = {cache_key: encoder.encode_sprite(sprite_info) for cache_key, sprite_info in sprites.items()}
+    finally:
+        encoder.image_sheets.clear()
+    return encoded, encoder.compress_stats
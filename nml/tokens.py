@@ -78,6 +78,9 @@ class NMLLexer:
     @ivar includes: Stack of included files.
     @type includes: C{List} of L{generic.LinePosition}
 
+    @ivar position_includes: Copy of L{includes}, shared by all positions created while the stack is unchanged.
+    @type position_includes: C{List} of L{generic.LinePosition}
+
     @ivar text: Input text to scan.
     @type text: C{str}
     """
@@ -264,7 +267,7 @@ class NMLLexer:
         """
         self.lexer = lex.lex(module=self)
 
-    def setup(self, text, fname):
+    def setup(self, text, fname, position=None):
         """
         Setup scanner for scanning an input file.
 
@@ -273,20 +276,31 @@ class NMLLexer:
 
         @param fname: Filename associated with the input text (main input file).
         @type  fname: C{str}
+
+        @param position: Position of the start of the text, if it is not the start of the input file.
+        @type  position: L{LinePosition} or C{None}
         """
-        self.includes = []
         self.text = text
-        self.set_position(fname, 1)
+        self.position_includes = None
+        if position is None:
+            self.includes = []
+            self.set_position(fname, 1)
+        else:
+            self.includes = position.includes[:]
+            self.set_position(position.filename, position.line_start)
         self.lexer.input(text)
 
     def set_position(self, fname, line):
         """
         @note: The lexer.lineno contains a Position object.
         """
-        self.lexer.lineno = generic.LinePosition(fname, line, self.includes[:])
+        if self.position_includes != self.includes:
+            self.position_includes = self.includes[:]
+        self.lexer.lineno = generic.LinePosition(fname, line, self.position_includes)
 
     def increment_lines(self, count):
-        self.set_position(self.lexer.lineno.filename, self.lexer.lineno.line_start + count)
+        pos = self.lexer.lineno
+        self.lexer.lineno = generic.LinePosition(pos.filename, pos.line_start + count, pos.includes)
 
     def find_column(self, t):
         last_cr = self.text.rfind("\n", 0, t.lexpos)
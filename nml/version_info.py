@@ -16,6 +16,15 @@ with NML; if not, write to the Free Software Foundation, Inc.,
 import os
 import sys
 
+"""
+Version of the format of the parse and language cache files. Increase it when their contents change,
+so files written by an earlier compiler are not used.
+"""
+CACHE_FORMAT = 1
+
+# Signature of the compiler, computed once by get_compiler_signature
+_compiler_signature = None
+
 
 def get_lib_versions():
     versions = {}
@@ -59,6 +68,19 @@ def get_nml_version():
     return version
 
 
+def get_compiler_signature():
+    """
+    Get a signature of the compiler, cache files written by another compiler version can not be used.
+
+    @return: Version of nml, and the version of the cache format.
+    @rtype:  C{str}
+    """
+    global _compiler_signature
+    if _compiler_signature is None:
+        _compiler_signature = "{} {:d}".format(get_nml_version(), CACHE_FORMAT)
+    return _compiler_signature
+
+
 def get_cli_version():
     # Version string for usage in command line
     result = get_nml_version() + "\n\n"